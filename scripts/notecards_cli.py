@@ -3,9 +3,15 @@
 
 import urllib.request
 import urllib.parse
+import http.client
+import concurrent.futures
+import collections
+import threading
+import time
 import getpass
 import json
 import io
+import os
 import tarfile
 import argparse
 
@@ -23,6 +29,11 @@ INDEX_PAGE_URL = ""
 csrf_token = ""
 session_id = ""
 
+DEFAULT_CONCURRENCY = 8
+UPLOAD_BATCH_SIZE = 100
+DEFAULT_MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+
 
 # Taken from django.core.serializers.json version 2.1.5.
 # This adds support here for encoding non-standard types
@@ -83,7 +94,7 @@ def extract_cookie(headers, cookie_name):
     return value
 
 
-def add_cookies_to_request(request, cookie_names=[]):
+def get_cookie_header(cookie_names=[]):
     values = [] 
 
     for cookie_name in cookie_names:
@@ -93,8 +104,14 @@ def add_cookies_to_request(request, cookie_names=[]):
         elif (cookie_name == "sessionid") and (session_id != ""):
             values.append("sessionid={}".format(session_id))
 
-    if len(values) > 0:
-        request.add_header('Cookie', "; ".join(values))
+    return "; ".join(values)
+
+
+def add_cookies_to_request(request, cookie_names=[]):
+    cookie_header = get_cookie_header(cookie_names)
+
+    if cookie_header != "":
+        request.add_header('Cookie', cookie_header)
 
 
 def get_csrf_token():
@@ -194,6 +211,249 @@ def get_cards(filter_overrides={}, card_format=""):
     return result
 
 
+def get_changes(since, limit=500, card_format=""):
+    result = None
+
+    query_string = urllib.parse.urlencode({'since': since, 'limit': limit, 'format': card_format})
+    url = BASE_API_URL + "changes/?{}".format(query_string)
+    request = urllib.request.Request(url, method="GET")
+
+    add_cookies_to_request(request, ['sessionid'])
+
+    with urllib.request.urlopen(request) as f:
+        if f.status == 200:
+            result = f.read()
+
+    return result
+
+
+# Concurrent transfers
+#
+# The cards of an archive are transferred with one request per card.
+# These requests are sent from a pool of worker threads where each
+# thread keeps a persistent (keep-alive) connection to the server.
+# Failed requests are retried with an exponential backoff. The results
+# are returned in the order of the requests so the archive members are
+# always written in the same order as the card list.
+
+class TransferError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class TransferStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.num_requests = 0
+        self.num_failures = 0
+        self.num_retries = 0
+        self.num_bytes = 0
+
+    def add_request(self, num_bytes, num_retries):
+        with self.lock:
+            self.num_requests += 1
+            self.num_retries += num_retries
+            self.num_bytes += num_bytes
+
+    def add_failure(self, num_retries):
+        with self.lock:
+            self.num_failures += 1
+            self.num_retries += num_retries
+
+    def get_summary(self):
+        elapsed_time = max(time.monotonic() - self.start_time, 0.001)
+        num_megabytes = self.num_bytes / (1024 * 1024)
+
+        return ("{} requests ({} failed, {} retries), {:.2f} MB in {:.1f} s "
+                "({:.1f} requests/s, {:.2f} MB/s)").format(self.num_requests,
+                                                          self.num_failures,
+                                                          self.num_retries,
+                                                          num_megabytes,
+                                                          elapsed_time,
+                                                          self.num_requests / elapsed_time,
+                                                          num_megabytes / elapsed_time)
+
+
+connection_state = threading.local()
+
+
+def get_connection():
+    connection = getattr(connection_state, 'connection', None)
+
+    if connection is None:
+        url_parts = urllib.parse.urlsplit(BASE_URL)
+
+        if url_parts.scheme == 'https':
+            connection = http.client.HTTPSConnection(url_parts.hostname, url_parts.port)
+        else:
+            connection = http.client.HTTPConnection(url_parts.hostname, url_parts.port)
+
+        connection_state.connection = connection
+
+        # Connections of worker threads are closed by map_in_order
+        pool_connections = getattr(connection_state, 'pool_connections', None)
+        if pool_connections is not None:
+            pool_connections.add(connection)
+
+    return connection
+
+
+def close_connection():
+    connection = getattr(connection_state, 'connection', None)
+
+    if connection is not None:
+        connection.close()
+        connection_state.connection = None
+
+
+def send_request(method, url, body=None, headers={}, expected_status=200,
+                 max_retries=DEFAULT_MAX_RETRIES, stats=None):
+    """
+    Sends the request on the persistent connection of the current
+    thread and returns the response body. Connection errors and
+    server errors are retried (after a backoff which doubles with
+    each attempt). Any other unexpected status raises a TransferError.
+    """
+    data, _ = send_request_with_retries(method, url, body, headers, expected_status, max_retries, stats)
+    return data
+
+
+def send_request_with_retries(method, url, body=None, headers={}, expected_status=200,
+                              max_retries=DEFAULT_MAX_RETRIES, stats=None):
+    """
+    Same as send_request but returns a (response body, number of
+    retries) tuple. A request which had to be retried may have been
+    processed by the server even though no response was received.
+    """
+    url_parts = urllib.parse.urlsplit(url)
+    path = url_parts.path
+
+    if url_parts.query != "":
+        path += "?" + url_parts.query
+
+    status = None
+    message = ""
+
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            time.sleep(RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+
+        try:
+            connection = get_connection()
+            connection.request(method, path, body, headers)
+
+            response = connection.getresponse()
+            data = response.read()
+            status = response.status
+
+        except (http.client.HTTPException, OSError) as err:
+            # The server may have closed the keep-alive
+            # connection so reconnect on the next attempt
+            close_connection()
+            message = str(err)
+            continue
+
+        if status == expected_status:
+            if stats:
+                stats.add_request(len(data) + len(body or b""), attempt)
+
+            return (data, attempt)
+
+        message = "{} {} returned {}".format(method, path, status)
+
+        if status < 500:
+            break
+
+    if stats:
+        stats.add_failure(attempt)
+
+    raise TransferError(status, message)
+
+
+def map_in_order(func, items, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Applies func to each of the items on a pool of concurrency worker
+    threads and yields (item, result, error) tuples in the order of
+    the items. At most 2 * concurrency items are in flight at a time
+    so the items can be generated lazily (for example from a tar file).
+    """
+    max_in_flight = 2 * concurrency
+    in_flight = collections.deque()
+
+    # The persistent connections opened by the worker threads
+    pool_connections = set()
+
+    def init_worker():
+        connection_state.pool_connections = pool_connections
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency,
+                                                   initializer=init_worker) as executor:
+            for item in items:
+                in_flight.append((item, executor.submit(func, item)))
+
+                if len(in_flight) >= max_in_flight:
+                    yield get_future_result(*in_flight.popleft())
+
+            while len(in_flight) > 0:
+                yield get_future_result(*in_flight.popleft())
+
+    finally:
+        # The worker threads have exited (or are exiting) so
+        # their connections would otherwise never be closed
+        for connection in pool_connections:
+            connection.close()
+
+
+def get_future_result(item, future):
+    try:
+        return (item, future.result(), None)
+
+    except Exception as err:
+        return (item, None, err)
+
+
+def download_card(card_url, card_format="archive", max_retries=DEFAULT_MAX_RETRIES, stats=None):
+    query_string = urllib.parse.urlencode({"format": card_format})
+    url = card_url + "/?{}".format(query_string)
+
+    headers = {'Cookie': get_cookie_header(['sessionid'])}
+
+    return send_request("GET", url, headers=headers, max_retries=max_retries, stats=stats)
+
+
+def upload_card_batch(card_json_bytes, max_retries=DEFAULT_MAX_RETRIES, stats=None):
+    """
+    Uploads a batch of cards (each encoded as json bytes) with a
+    single request and returns the list of per card results. If the
+    request had to be retried then a card which already exists (409)
+    counts as uploaded (201) since an earlier attempt may have been
+    committed without a response.
+    """
+    url = BASE_API_URL + "card-batches/"
+    ndjson_bytes = b"\n".join([json_bytes.strip() for json_bytes in card_json_bytes])
+
+    headers = {
+        'Content-Type': 'application/x-ndjson; charset=utf-8',
+        'Content-Length': len(ndjson_bytes),
+        'X-CSRFToken': csrf_token,
+        'Cookie': get_cookie_header(['csrftoken', 'sessionid'])
+    }
+
+    data, num_retries = send_request_with_retries("POST", url, ndjson_bytes, headers,
+                                                  max_retries=max_retries, stats=stats)
+    results = json.loads(data)['results']
+
+    if num_retries > 0:
+        for result in results:
+            if result['status'] == 409:
+                result['status'] = 201
+
+    return results
+
+
 def new_card_from_values(card_values):
     json_data = json.dumps(card_values, cls=DjangoJSONEncoder)
     json_bytes = json_data.encode('utf-8')
@@ -223,7 +483,8 @@ def new_card_from_json_bytes(json_bytes, num_bytes=None):
     return new_card_added
 
 
-def create_card_archive(file_path, filter_overrides={}):
+def create_card_archive(file_path, filter_overrides={}, concurrency=DEFAULT_CONCURRENCY,
+                        max_retries=DEFAULT_MAX_RETRIES):
     data = get_cards(filter_overrides={}, card_format='links')
     data = json.loads(data)
 
@@ -234,12 +495,10 @@ def create_card_archive(file_path, filter_overrides={}):
         return 0
 
     num_cards_archived = 0
-
-    tf = tarfile.open(file_path, 'w:gz')
+    card_urls = []
 
     for card in data['cards']:
         card_url = ""
-        card_uuid = card['uuid']
 
         for link in card['links']:
             if link['rel'] == 'self':
@@ -249,7 +508,20 @@ def create_card_archive(file_path, filter_overrides={}):
             print("ERROR: could not find self link for card {}".format(card['uuid']))
             continue
 
-        card_bytes = get_card(card_url, card_format='archive')
+        card_urls.append((card['uuid'], card_url))
+
+    stats = TransferStats()
+
+    def download_func(item):
+        return download_card(item[1], card_format='archive', max_retries=max_retries, stats=stats)
+
+    tf = tarfile.open(file_path, 'w:gz')
+
+    for (card_uuid, card_url), card_bytes, err in map_in_order(download_func, card_urls, concurrency):
+        if err:
+            print("\nERROR: could not download card {}: {}".format(card_uuid, err))
+            continue
+
         byte_stream = io.BytesIO(card_bytes)
 
         tarinfo = tarfile.TarInfo(name=card_uuid)
@@ -261,24 +533,299 @@ def create_card_archive(file_path, filter_overrides={}):
         print('.', end='', flush=True)
 
     tf.close()
+
+    print("\n" + stats.get_summary())
     return num_cards_archived
 
 
-def upload_card_archive(file_path):
+def upload_card_archive(file_path, concurrency=DEFAULT_CONCURRENCY, batch_size=UPLOAD_BATCH_SIZE,
+                        max_retries=DEFAULT_MAX_RETRIES):
     num_cards_uploaded = 0
+    stats = TransferStats()
+
+    def read_batches(tf):
+        # The members are read in full since
+        # failed uploads may have to be resent
+        names = []
+        card_json_bytes = []
+
+        for tarinfo in tf:
+            names.append(tarinfo.name)
+            card_json_bytes.append(tf.extractfile(tarinfo).read())
+
+            if len(names) >= batch_size:
+                yield (names, card_json_bytes)
+                names = []
+                card_json_bytes = []
+
+        if len(names) > 0:
+            yield (names, card_json_bytes)
+
+    def upload_func(item):
+        return upload_card_batch(item[1], max_retries=max_retries, stats=stats)
 
     tf = tarfile.open(file_path, 'r:gz')
-    for tarinfo in tf:
-        buffered_reader = tf.extractfile(tarinfo)
 
-        if new_card_from_json_bytes(buffered_reader, tarinfo.size):
-            num_cards_uploaded += 1
-            print('.', end='', flush=True)
+    for (names, _), results, err in map_in_order(upload_func, read_batches(tf), concurrency):
+        if err:
+            print("\nERROR: could not upload cards {} to {}: {}".format(names[0], names[-1], err))
+            continue
+
+        for name, result in zip(names, results):
+            if result['status'] == 201:
+                num_cards_uploaded += 1
+                print('.', end='', flush=True)
+
+            else:
+                print("\nERROR: could not upload card {}: {}".format(name, result.get('message', "")))
 
     tf.close()
+
+    print("\n" + stats.get_summary())
     return num_cards_uploaded
 
 
+# Incremental backups
+#
+# An incremental backup is a directory containing a chain of card
+# archives (00001.car, 00002.car, ...) and a manifest.json file. Each
+# run appends a new (delta) archive which only contains the cards that
+# changed since the previous run. The changes are retrieved from the
+# changes api so only the changed cards are listed. The manifest maps
+# each card uuid to its sha_512 hash and the archive which contains
+# the latest version of the card. The file attachments of a changed
+# card are only downloaded again if its hash changed, otherwise they
+# are copied from the previous archive. Every archive in the chain is
+# a regular card archive which can be uploaded with --upload. The
+# chain can be compacted into a single archive with --compact.
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def get_backup_archive_name(index):
+    return "{:05d}.car".format(index)
+
+
+def load_manifest(backup_dir):
+    manifest_path = os.path.join(backup_dir, MANIFEST_FILE_NAME)
+
+    if not os.path.exists(manifest_path):
+        return {'version': 1, 'since': 0, 'next_archive_index': 1, 'archives': [], 'cards': {}}
+
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(backup_dir, manifest):
+    # Write to a temporary file first so a failed
+    # write does not leave a corrupted manifest
+    manifest_path = os.path.join(backup_dir, MANIFEST_FILE_NAME)
+    temp_path = manifest_path + ".tmp"
+
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    os.replace(temp_path, manifest_path)
+
+
+def remove_links(obj):
+    if isinstance(obj, dict):
+        return {key: remove_links(value) for key, value in obj.items() if key != 'links'}
+
+    elif isinstance(obj, list):
+        return [remove_links(value) for value in obj]
+
+    return obj
+
+
+def read_archive_cards(archive_path, uuids):
+    """
+    Returns a dictionary containing the card objects in
+    the archive for each of the uuids that it contains.
+    """
+    cards = {}
+
+    with tarfile.open(archive_path, 'r:gz') as tf:
+        for tarinfo in tf:
+            if tarinfo.name in uuids:
+                cards[tarinfo.name] = json.load(tf.extractfile(tarinfo))
+
+    return cards
+
+
+def add_card_to_archive(tf, card_uuid, card_obj):
+    card_bytes = json.dumps(card_obj, cls=DjangoJSONEncoder).encode('utf-8')
+
+    tarinfo = tarfile.TarInfo(name=card_uuid)
+    tarinfo.size = len(card_bytes)
+
+    tf.addfile(tarinfo=tarinfo, fileobj=io.BytesIO(card_bytes))
+
+
+def get_changed_cards(since):
+    changed_cards = {}
+    deleted_uuids = set()
+
+    while True:
+        data = json.loads(get_changes(since))
+
+        if data['version'] != 1:
+            raise RuntimeError("Unsupported changes version")
+
+        for change in data['changes']:
+            # A card can appear again in a later batch if it
+            # was changed while the batches were retrieved
+            changed_cards.pop(change['uuid'], None)
+            deleted_uuids.discard(change['uuid'])
+
+            if change['deleted']:
+                deleted_uuids.add(change['uuid'])
+            else:
+                changed_cards[change['uuid']] = change['card']
+
+        since = data['next_since']
+
+        if not data['has_more']:
+            break
+
+    return (changed_cards, deleted_uuids, since)
+
+
+def create_incremental_backup(backup_dir, concurrency=DEFAULT_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES):
+    """
+    Appends a delta archive containing the cards which changed since
+    the previous backup to the backup in backup_dir. Returns a tuple
+    with the number of cards archived and the number of cards deleted.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    manifest = load_manifest(backup_dir)
+
+    changed_cards, deleted_uuids, since = get_changed_cards(manifest['since'])
+
+    # The file attachments of the cards whose hash did not
+    # change are copied from the archives in the chain
+    copied_file_uuids = {}
+    downloaded_uuids = []
+
+    for card_uuid, card_obj in changed_cards.items():
+        if len(card_obj.get('files', [])) == 0:
+            continue
+
+        manifest_entry = manifest['cards'].get(card_uuid)
+
+        if manifest_entry and (manifest_entry['sha_512'] == card_obj['sha_512']):
+            copied_file_uuids.setdefault(manifest_entry['archive'], set()).add(card_uuid)
+        else:
+            downloaded_uuids.append(card_uuid)
+
+    card_files = {}
+    for archive_name, uuids in copied_file_uuids.items():
+        archived_cards = read_archive_cards(os.path.join(backup_dir, archive_name), uuids)
+        card_files.update({card_uuid: card_obj['files'] for card_uuid, card_obj in archived_cards.items()})
+
+    archive_name = get_backup_archive_name(manifest['next_archive_index'])
+    archive_path = os.path.join(backup_dir, archive_name)
+
+    stats = TransferStats()
+
+    def get_archive_card_obj(item):
+        card_uuid, card_obj = item
+
+        if card_uuid in card_files:
+            card_obj = remove_links(card_obj)
+            card_obj['files'] = card_files[card_uuid]
+
+        elif card_uuid in downloaded_uuids:
+            card_url = BASE_API_URL + "cards/" + card_uuid
+            card_obj = json.loads(download_card(card_url, card_format='archive',
+                                                max_retries=max_retries, stats=stats))
+
+        else:
+            card_obj = remove_links(card_obj)
+
+        return card_obj
+
+    if len(changed_cards) > 0:
+        archived_hashes = {}
+
+        tf = tarfile.open(archive_path + ".tmp", 'w:gz')
+
+        for (card_uuid, _), card_obj, err in map_in_order(get_archive_card_obj, changed_cards.items(), concurrency):
+            if err:
+                # The manifest is not updated so the
+                # changes are retrieved again next time
+                tf.close()
+                os.remove(archive_path + ".tmp")
+                raise err
+
+            add_card_to_archive(tf, card_uuid, card_obj)
+            archived_hashes[card_uuid] = card_obj['sha_512']
+            print('.', end='', flush=True)
+
+        tf.close()
+        os.replace(archive_path + ".tmp", archive_path)
+
+        manifest['archives'].append(archive_name)
+        manifest['next_archive_index'] += 1
+
+        for card_uuid, sha_512 in archived_hashes.items():
+            manifest['cards'][card_uuid] = {'sha_512': sha_512, 'archive': archive_name}
+
+        if len(downloaded_uuids) > 0:
+            print("\n" + stats.get_summary())
+
+    for card_uuid in deleted_uuids:
+        manifest['cards'].pop(card_uuid, None)
+
+    manifest['since'] = since
+    save_manifest(backup_dir, manifest)
+
+    return (len(changed_cards), len(deleted_uuids))
+
+
+def compact_backup(backup_dir):
+    """
+    Replaces the chain of archives in backup_dir with a single archive
+    containing the latest version of each of the cards which have not
+    been deleted. Returns the number of cards in the new archive.
+    """
+    manifest = load_manifest(backup_dir)
+
+    archive_name = get_backup_archive_name(manifest['next_archive_index'])
+    archive_path = os.path.join(backup_dir, archive_name)
+    num_cards_archived = 0
+
+    tf = tarfile.open(archive_path + ".tmp", 'w:gz')
+
+    for chain_archive_name in manifest['archives']:
+        with tarfile.open(os.path.join(backup_dir, chain_archive_name), 'r:gz') as chain_tf:
+            for tarinfo in chain_tf:
+                manifest_entry = manifest['cards'].get(tarinfo.name)
+
+                # Skip deleted cards and older versions of the cards
+                if manifest_entry and (manifest_entry['archive'] == chain_archive_name):
+                    tf.addfile(tarinfo=tarinfo, fileobj=chain_tf.extractfile(tarinfo))
+                    num_cards_archived += 1
+
+    tf.close()
+    os.replace(archive_path + ".tmp", archive_path)
+
+    old_archive_names = manifest['archives']
+
+    manifest['archives'] = [archive_name]
+    manifest['next_archive_index'] += 1
+
+    for manifest_entry in manifest['cards'].values():
+        manifest_entry['archive'] = archive_name
+
+    save_manifest(backup_dir, manifest)
+
+    for old_archive_name in old_archive_names:
+        os.remove(os.path.join(backup_dir, old_archive_name))
+
+    return num_cards_archived
+
+
 def parse_command_line():
     arg_parser = argparse.ArgumentParser(description="Interact with a notecards server from the command line.")
 
@@ -309,6 +856,30 @@ def parse_command_line():
                        type=str, 
                        metavar="FILE")
 
+    group.add_argument("-i",
+                       "--incremental",
+                       help="Download the cards which changed since the previous incremental backup in to a new card archive in the backup directory.",
+                       type=str,
+                       metavar="DIRECTORY")
+
+    group.add_argument("-c",
+                       "--compact",
+                       help="Combine the card archives of an incremental backup directory in to a single card archive.",
+                       type=str,
+                       metavar="DIRECTORY")
+
+    arg_parser.add_argument("-j",
+                            "--concurrency",
+                            help="Number of cards to download or upload concurrently.",
+                            type=int,
+                            default=DEFAULT_CONCURRENCY)
+
+    arg_parser.add_argument("-r",
+                            "--retries",
+                            help="Number of times a failed card download or upload is retried.",
+                            type=int,
+                            default=DEFAULT_MAX_RETRIES)
+
     args = arg_parser.parse_args()
     return args
 
@@ -335,7 +906,9 @@ set_urls(args.server, args.port)
 
 if args.download:
     def session_func():
-        num_cards_archived = create_card_archive(args.download)
+        num_cards_archived = create_card_archive(args.download,
+                                                 concurrency=args.concurrency,
+                                                 max_retries=args.retries)
         if num_cards_archived > 0:
             print("\nSuccessfully archived {} cards".format(num_cards_archived))
 
@@ -346,7 +919,9 @@ if args.download:
 
 elif args.upload:
     def session_func():
-        num_cards_uploaded = upload_card_archive(args.upload)
+        num_cards_uploaded = upload_card_archive(args.upload,
+                                                 concurrency=args.concurrency,
+                                                 max_retries=args.retries)
         if num_cards_uploaded > 0:
             print("\nSuccessfully uploaded {} cards".format(num_cards_uploaded))
 
@@ -355,3 +930,16 @@ elif args.upload:
 
     run_session(session_func)
 
+elif args.incremental:
+    def session_func():
+        num_cards_archived, num_cards_deleted = create_incremental_backup(args.incremental,
+                                                                           concurrency=args.concurrency,
+                                                                           max_retries=args.retries)
+        print("\nArchived {} changed cards ({} cards deleted)".format(num_cards_archived, num_cards_deleted))
+
+    run_session(session_func)
+
+elif args.compact:
+    num_cards_archived = compact_backup(args.compact)
+    print("Compacted backup contains {} cards".format(num_cards_archived))
+
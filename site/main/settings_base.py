@@ -102,3 +102,58 @@ STATIC_URL = '/static/'
 
 MEDIA_URL = "/media/"
 
+
+# Number of background worker threads used to run long running
+# tasks like card archive imports. If set to 0 the tasks are run
+# synchronously as part of the request which created them.
+
+NOTECARDS_TASK_WORKERS = int(os.environ.get('NOTECARDS_TASK_WORKERS', 1))
+
+
+# Number of seconds after the last progress update of a running task
+# (ie. of a server process which exited during an import) after which
+# the task is queued again. Must be longer than importing one batch.
+
+NOTECARDS_STALE_TASK_SECONDS = int(os.environ.get('NOTECARDS_STALE_TASK_SECONDS', 600))
+
+
+
+# Number of worker processes used to decode the cards (json parsing,
+# base64 decoding and hashing of file attachments) when importing a
+# card archive. If set to 0 the cards are decoded by the thread which
+# writes them to the database.
+
+NOTECARDS_ARCHIVE_IMPORT_WORKERS = int(os.environ.get('NOTECARDS_ARCHIVE_IMPORT_WORKERS', 0))
+
+
+
+# Embed the first card list of the index page in the page (for logged
+# in users) so it is shown without requesting it from the cards api.
+
+NOTECARDS_EMBED_INDEX_CARD_LIST = bool(int(os.environ.get('NOTECARDS_EMBED_INDEX_CARD_LIST', 1)))
+
+
+
+# Cache of the encoded card lists returned by the cards api (see
+# notecards/card_list_cache.py). The local memory backend is per
+# process and evicts the least recently used lists once it holds
+# MAX_ENTRIES lists. Any other cache backend can be used by setting
+# NOTECARDS_CARD_LIST_CACHE_BACKEND and NOTECARDS_CARD_LIST_CACHE_LOCATION
+# (for example django.core.cache.backends.filebased.FileBasedCache
+# with a directory, or a Redis/memcached backend with its server
+# address) to share the cache between processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'card_lists': {
+        'BACKEND': os.environ.get('NOTECARDS_CARD_LIST_CACHE_BACKEND',
+                                  'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('NOTECARDS_CARD_LIST_CACHE_LOCATION', 'notecards-card-lists'),
+        'TIMEOUT': int(os.environ.get('NOTECARDS_CARD_LIST_CACHE_TIMEOUT', 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('NOTECARDS_CARD_LIST_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
@@ -5,7 +5,9 @@ from datetime import timedelta
 from django.http import JsonResponse
 from django.urls import re_path
 from django.db import transaction
+from django.db.models import F
 from notecards import utils
+from notecards.models import Card
 
 import json
 
@@ -45,15 +47,24 @@ def advance_review_date(request):
     # Not just the cards for the current page
     filter_params['page'] = 1
     filter_params['cards_per_page'] = 0
+    filter_params.pop('cursor', None)
 
     cards = utils.get_filtered_cards(filter_params, request.user)
 
+    # Update all of the cards with a single UPDATE statement. The
+    # filtered ids are used as a subquery because the filtered
+    # queryset may contain joins and a distinct() (tags filter).
+    card_ids = cards.order_by().values('pk')
+
     with transaction.atomic():
-        for card in cards:
-            card.next_retrieval_date = card.next_retrieval_date + timedelta(days=int(num_days))
-            card.save()
+        card_uuids = list(Card.objects.filter(pk__in=card_ids).values_list('uuid', flat=True))
+
+        num_cards_updated = Card.objects.filter(pk__in=card_ids).update(
+            next_retrieval_date=F('next_retrieval_date') + timedelta(days=num_days))
+
+        utils.record_card_changes(request.user.pk, card_uuids)
 
-    return JsonResponse({}, status=200)
+    return JsonResponse({'num_cards_updated': num_cards_updated}, status=200)
 
 
 url_name = 'notecards-api-advance-review-date-tasks'
@@ -5,6 +5,7 @@ from django.http import JsonResponse
 from django.urls import re_path
 from django.utils import timezone
 from notecards import utils
+from notecards import content_hash
 from notecards.models import Card, FileAttachment
 
 import json
@@ -32,16 +33,23 @@ def process_request(request, card_uuid):
 
 
 def get_card(request, card):
+    etag = utils.get_card_etag(card)
+    if utils.is_not_modified(request, etag):
+        return utils.create_304_response(etag)
+
     card_output_format = request.GET.get('format', "")
 
     card_obj = utils.create_card_object(card, card_output_format)
-    return JsonResponse(card_obj, status=200)
+    return utils.set_etag(utils.create_json_response(card_obj, status=200), etag)
 
 
 def update_card(request, card):
     if request.content_type != "application/json-patch+json":
         return utils.create_415_json_response()
 
+    if utils.is_precondition_failed(request, utils.get_card_etag(card)):
+        return utils.create_412_json_response()
+
     patch_data = json.loads(request.body)
 
     if not isinstance(patch_data, list):
@@ -65,14 +73,19 @@ def update_card(request, card):
                 card.active = op['value']
 
     card.last_modified_date = timezone.now()
-    card.sha_512 = utils.compute_card_sha_512(card)
+    content_hash.update_card_text_hash(card)
+    utils.update_card_query_html(card)
     card.save()
+    utils.record_card_change(card)
 
     card_obj = utils.create_card_object(card)
-    return JsonResponse(card_obj, status=200)
+    return utils.set_etag(utils.create_json_response(card_obj, status=200), utils.get_card_etag(card))
 
 
 def delete_card(request, card):
+    if utils.is_precondition_failed(request, utils.get_card_etag(card)):
+        return utils.create_412_json_response()
+
     utils.delete_card(card)
     return JsonResponse({'message': 'Card successfully deleted'}, status=200)
 
@@ -0,0 +1,33 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.http import JsonResponse
+from django.urls import re_path
+from notecards import utils
+from notecards.models import CardArchiveImportTask
+
+
+def process_request(request, task_id):
+    if not request.user.is_authenticated:
+        return utils.create_401_json_response()
+
+    task = CardArchiveImportTask.from_id(task_id, request.user)
+    if not task:
+        return utils.create_404_json_response("Task")
+
+    if request.method == 'GET':
+        return get_card_archive_import_task(request, task)
+
+    else:
+        return utils.create_405_json_response(allow="GET")
+
+
+def get_card_archive_import_task(request, task):
+    task_obj = utils.create_card_archive_import_task_obj(task)
+    return JsonResponse(task_obj, status=200)
+
+
+url_name = 'notecards-api-card-archive-import-task'
+url_path = re_path(r'^card-archive-import-tasks/(?P<task_id>[0-9]+)/$',
+                   process_request,
+                   name=url_name)
@@ -3,28 +3,40 @@
 
 from django.http import JsonResponse
 from django.urls import re_path
-from notecards import utils
+from notecards import utils, tasks
+from notecards.models import CardArchiveImportTask
 
 
 def process_request(request):
     if request.method == 'POST':
-        if not request.user.is_authenticated:
-            return utils.create_401_json_response()
+        return new_card_archive_import_task(request)
 
-        if (len(request.FILES) > 0) and ('archive_file' in request.FILES):
-            num_cards_imported = utils.import_card_archive(request.FILES['archive_file'],
-                                                           request.user)
-            return JsonResponse({'num_cards_imported': num_cards_imported}, status=200)
+    else:
+        return utils.create_405_json_response(allow="POST")
+
+
+def new_card_archive_import_task(request):
+    if not request.user.is_authenticated:
+        return utils.create_401_json_response()
 
-        else:
-            return utils.create_400_json_response('No archive file found')
+    if (len(request.FILES) > 0) and ('archive_file' in request.FILES):
+        task = CardArchiveImportTask(user=request.user,
+                                     archive_file=request.FILES['archive_file'])
+        task.save()
+
+        tasks.enqueue_card_archive_import_task(task)
+        task.refresh_from_db()
+
+        task_obj = utils.create_card_archive_import_task_obj(task)
+        response = JsonResponse(task_obj, status=202)
+        response['Location'] = task_obj['links'][0]['href']
+        return response
 
     else:
-        return utils.create_405_json_response(allow="POST")
+        return utils.create_400_json_response('No archive file found')
 
 
 url_name = 'notecards-api-card-archive-import-tasks'
 url_path = re_path(r'^card-archive-import-tasks/$',
                    process_request,
                    name=url_name)
-
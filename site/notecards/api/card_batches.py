@@ -0,0 +1,114 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.http import JsonResponse
+from django.urls import re_path
+from notecards import utils
+
+import json
+
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+def process_request(request):
+    if request.method == 'POST':
+        return new_card_batch(request)
+
+    else:
+        return utils.create_405_json_response(allow="POST")
+
+
+def parse_ndjson_card_objects(body):
+    """
+    Returns a list containing the card object on each of the non
+    empty lines of body and a set with the indexes of the lines
+    which could not be parsed (stored as None in the list).
+    """
+    card_objects = []
+    invalid_indexes = set()
+
+    for line in body.splitlines():
+        if len(line.strip()) == 0:
+            continue
+
+        try:
+            card_objects.append(json.loads(line))
+
+        except ValueError:
+            invalid_indexes.add(len(card_objects))
+            card_objects.append(None)
+
+    return (card_objects, invalid_indexes)
+
+
+def create_card_batch_result_obj(card_obj, result):
+    result_obj = {'status': result[0]}
+
+    if result[0] == 201:
+        result_obj['uuid'] = result[1].uuid
+        result_obj['links'] = [
+            {'rel': 'self', 'href': '/cards/api/v1/cards/' + str(result[1].uuid)}
+        ]
+
+    else:
+        if isinstance(card_obj, dict) and ('uuid' in card_obj):
+            result_obj['uuid'] = card_obj['uuid']
+
+        result_obj['message'] = result[1]
+
+    return result_obj
+
+
+def new_card_batch(request):
+    if request.content_type not in ["application/json", NDJSON_CONTENT_TYPE]:
+        return utils.create_415_json_response()
+
+    if len(request.body) == 0:
+        message = "Missing request body"
+        return utils.create_400_json_response(message)
+
+    if not request.user.is_authenticated:
+        return utils.create_401_json_response()
+
+    invalid_indexes = set()
+
+    try:
+        if request.content_type == NDJSON_CONTENT_TYPE:
+            card_objects, invalid_indexes = parse_ndjson_card_objects(request.body.decode('utf-8'))
+
+        else:
+            card_objects = json.loads(request.body)
+
+    except ValueError:
+        return utils.create_400_json_response("Invalid json")
+
+    if not isinstance(card_objects, list):
+        message = "Invalid json format. Root must be an array"
+        return utils.create_400_json_response(message)
+
+    if len(card_objects) > utils.MAX_CARD_BATCH_SIZE:
+        message = "A card batch can contain at most {} cards".format(utils.MAX_CARD_BATCH_SIZE)
+        return utils.create_400_json_response(message)
+
+    atomic = request.GET.get('atomic', "0") == "1"
+
+    results = utils.import_card_batch(card_objects, request.user, atomic)
+
+    for index in invalid_indexes:
+        results[index] = (400, "Invalid json")
+
+    batch_obj = {
+        'version': 1,
+        'num_cards_imported': len([result for result in results if result[0] == 201]),
+        'results': [create_card_batch_result_obj(card_obj, result)
+                    for card_obj, result in zip(card_objects, results)]
+    }
+
+    return JsonResponse(batch_obj, status=200)
+
+
+url_name = 'notecards-api-card-batches'
+url_path = re_path(r'^card-batches/$',
+                   process_request,
+                   name=url_name)
@@ -5,6 +5,7 @@ from django.http import JsonResponse
 from django.urls import re_path
 from django.utils import timezone
 from notecards import utils
+from notecards import content_hash
 from notecards.models import Card, FileAttachment
 
 
@@ -47,8 +48,9 @@ def delete_card_file_attachment(request, file_attachment):
     file_attachment.delete()
 
     card.last_modified_date = timezone.now()
-    card.sha_512 = utils.compute_card_sha_512(card)
+    content_hash.update_card_hashes(card)
     card.save()
+    utils.record_card_change(card)
 
     message = "File successfully deleted"
     return JsonResponse({'message': message}, status=200)
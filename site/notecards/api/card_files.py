@@ -6,6 +6,7 @@ from django.urls import re_path
 from django.utils import timezone
 from django.conf import settings
 from notecards import utils
+from notecards import content_hash
 from notecards.models import Card, FileAttachment
 
 
@@ -49,8 +50,9 @@ def new_card_file_attachment(request, card):
         file_attachment.save()
 
         card.last_modified_date = timezone.now()
-        card.sha_512 = utils.compute_card_sha_512(card)
+        content_hash.add_card_file_hash(card, file_attachment.sha_512)
         card.save()
+        utils.record_card_change(card)
 
         file_attachment_obj = utils.create_file_attachment_obj(file_attachment)
         return JsonResponse(file_attachment_obj, status=201)
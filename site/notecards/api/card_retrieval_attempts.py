@@ -3,10 +3,8 @@
 
 from django.http import JsonResponse
 from django.urls import re_path
-from django.utils import timezone
-from datetime import timedelta
 from notecards import utils
-from notecards.models import Card, RetrievalAttempt
+from notecards.models import Card
 
 import json
 
@@ -15,7 +13,9 @@ def process_request(request, card_uuid):
     if not request.user.is_authenticated:
         return utils.create_401_json_response()
 
-    card = Card.from_uuid(card_uuid, request.user)
+    # The scheduler setting is used to schedule new retrieval attempts
+    card = Card.objects.select_related('user__schedulersetting') \
+                       .filter(uuid=card_uuid, user=request.user).first()
     if not card:
         return utils.create_404_json_response("Card")
 
@@ -52,52 +52,19 @@ def new_card_retrieval_attempt(request, card):
 
 
 def advance_card_bin(card):
-    bins = {
-        1: 1,
-        2: 3,
-        3: 7,
-        4: 13,
-        5: 19,
-        6: 29,
-        7: 37
-    }
-
-    retrieval_attempt = RetrievalAttempt(
-        card=card,
-        retrieval_date = timezone.now(),
-        retrieved = True,
-        spacing_bin = card.spacing_bin)
-    retrieval_attempt.save()
-
-    if card.spacing_bin in bins:
-        card.spacing_bin = card.spacing_bin + 1
-
-    if card.spacing_bin in bins:
-        days_till_next_retrieval = bins[card.spacing_bin]
-        card.next_retrieval_date = timezone.now() + timedelta(days=days_till_next_retrieval)
-
-    else:
-        # The card has run through all the bins.
-        card.next_retrieval_date = timezone.now() + timedelta(days=365*10)
-        card.active = False
+    return save_retrieval_attempt(card, True)
 
-    card.save()
 
-    ra_obj = utils.create_retrieval_attempt_obj(retrieval_attempt)
-    return JsonResponse(ra_obj, status=200)
+def reset_card_bin(card):
+    return save_retrieval_attempt(card, False)
 
 
-def reset_card_bin(card):
-    retrieval_attempt = RetrievalAttempt(
-        card=card,
-        retrieval_date = timezone.now(),
-        retrieved = False,
-        spacing_bin = card.spacing_bin)
+def save_retrieval_attempt(card, retrieved):
+    retrieval_attempt = utils.apply_retrieval_attempt(card, retrieved)
     retrieval_attempt.save()
 
-    card.spacing_bin = 1
-    card.next_retrieval_date = timezone.now() + timedelta(days=1)
     card.save()
+    utils.record_card_change(card)
 
     ra_obj = utils.create_retrieval_attempt_obj(retrieval_attempt)
     return JsonResponse(ra_obj, status=200)
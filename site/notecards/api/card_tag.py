@@ -35,6 +35,7 @@ def process_request(request, card_uuid, tag_id):
 
 def delete_card_tag(request, card, tag):
     card.tags.remove(tag)
+    utils.record_card_change(card)
 
     message = "Tag successfully removed from card"
     return JsonResponse({'message': message}, status=200)
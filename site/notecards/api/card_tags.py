@@ -48,6 +48,7 @@ def new_card_tag(request, card):
 
         if tag:
             card.tags.add(tag)
+            utils.record_card_change(card)
             tag_obj = utils.create_tag_obj(tag, card=card)
             response = JsonResponse(tag_obj, status=200)
 
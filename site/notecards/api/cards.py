@@ -1,10 +1,11 @@
 # Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
 # Licensed under the terms of the MIT license.
 
-from django.http import JsonResponse, FileResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.urls import re_path
 from datetime import datetime
 from notecards import utils
+from notecards import card_list_cache
 
 import json
 
@@ -23,23 +24,40 @@ def process_request(request):
 def get_cards(request):
     if not request.user.is_authenticated:
         card_list = utils.create_card_list([])
-        return JsonResponse(card_list, status=200)
+        return utils.create_json_response(card_list, status=200)
 
     filter_params = utils.parse_card_filter(request.GET)
-    cards = utils.get_filtered_cards(filter_params, request.user)
-
     card_output_format = request.GET.get('format', 'index')
 
-    if card_output_format == 'archive':
-        tmp_file = utils.create_card_archive(cards)
+    if card_output_format != 'archive':
+        try:
+            etag, content = card_list_cache.get_encoded_card_list(request.user, filter_params,
+                                                                  card_output_format)
+        except ValueError as err:
+            return utils.create_400_json_response(str(err))
 
-        now = datetime.utcnow()
-        filename = now.strftime('%Y%m%d.%H%M%S.car')
-        return FileResponse(tmp_file, as_attachment=True, filename=filename)
+        return create_card_list_response(request, etag, content)
 
-    else:
-        card_list = utils.create_card_list(cards, card_output_format, filter_params=filter_params)
-        return JsonResponse(card_list, status=200)
+    try:
+        cards = utils.get_filtered_cards(filter_params, request.user, card_output_format)
+    except ValueError as err:
+        return utils.create_400_json_response(str(err))
+
+    now = datetime.utcnow()
+    filename = now.strftime('%Y%m%d.%H%M%S.car')
+
+    response = StreamingHttpResponse(utils.generate_card_archive(cards),
+                                     content_type="application/octet-stream")
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def create_card_list_response(request, etag, content):
+    if utils.is_not_modified(request, etag):
+        return utils.create_304_response(etag)
+
+    response = HttpResponse(content, status=200, content_type='application/json')
+    return utils.set_etag(response, etag)
 
 
 def new_card(request):
@@ -61,7 +79,7 @@ def new_card(request):
 
         if result[0] == 201:
             card_obj = utils.create_card_object(result[1])
-            response = JsonResponse(card_obj, status=201)
+            response = utils.create_json_response(card_obj, status=201)
 
         elif result[0] == 409:
             response = utils.create_409_json_response(result[1])
@@ -0,0 +1,61 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.urls import re_path
+from django.utils.http import urlencode
+from notecards import utils
+
+
+DEFAULT_CHANGES_LIMIT = 100
+MAX_CHANGES_LIMIT = 1000
+
+
+def process_request(request):
+    if not request.user.is_authenticated:
+        return utils.create_401_json_response()
+
+    if request.method == 'GET':
+        return get_changes(request)
+
+    else:
+        return utils.create_405_json_response(allow="GET")
+
+
+def get_changes(request):
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = int(request.GET.get('limit', DEFAULT_CHANGES_LIMIT))
+    except ValueError:
+        return utils.create_400_json_response("since and limit must be integers")
+
+    if (since < 0) or (limit < 1) or (limit > MAX_CHANGES_LIMIT):
+        message = "since must be >= 0 and limit must be between 1 and {}".format(MAX_CHANGES_LIMIT)
+        return utils.create_400_json_response(message)
+
+    output_format = request.GET.get('format', "")
+
+    changes, has_more = utils.get_card_changes(request.user, since, limit, output_format)
+
+    next_since = since
+    if len(changes) > 0:
+        next_since = changes[-1]['sequence']
+
+    query = urlencode({'since': next_since, 'limit': limit, 'format': output_format})
+
+    changes_obj = {
+        'version': 1,
+        'changes': changes,
+        'next_since': next_since,
+        'has_more': has_more,
+        'links': [
+            {'rel': 'next', 'href': '/cards/api/v1/changes/?' + query}
+        ]
+    }
+
+    return utils.create_json_response(changes_obj, status=200)
+
+
+url_name = 'notecards-api-changes'
+url_path = re_path(r'^changes/$',
+                   process_request,
+                   name=url_name)
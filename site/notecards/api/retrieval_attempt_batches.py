@@ -0,0 +1,77 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.http import JsonResponse
+from django.urls import re_path
+from notecards import utils
+
+import json
+
+
+def process_request(request):
+    if request.method == 'POST':
+        return new_retrieval_attempt_batch(request)
+
+    else:
+        return utils.create_405_json_response(allow="POST")
+
+
+def create_retrieval_attempt_batch_result_obj(result_obj, result):
+    batch_result_obj = {'status': result[0]}
+
+    if isinstance(result_obj, dict) and ('uuid' in result_obj):
+        batch_result_obj['uuid'] = result_obj['uuid']
+
+    if result[0] == 201:
+        # The schedule of the card after this attempt (rather than
+        # after the last attempt of the card in the batch)
+        batch_result_obj['retrieval_attempt'] = utils.create_retrieval_attempt_obj(result[1])
+        batch_result_obj.update(result[2])
+
+    else:
+        batch_result_obj['message'] = result[1]
+
+    return batch_result_obj
+
+
+def new_retrieval_attempt_batch(request):
+    if request.content_type != "application/json":
+        return utils.create_415_json_response()
+
+    if len(request.body) == 0:
+        message = "Missing request body"
+        return utils.create_400_json_response(message)
+
+    if not request.user.is_authenticated:
+        return utils.create_401_json_response()
+
+    try:
+        result_objects = json.loads(request.body)
+    except ValueError:
+        return utils.create_400_json_response("Invalid json")
+
+    if not isinstance(result_objects, list):
+        message = "Invalid json format. Root must be an array"
+        return utils.create_400_json_response(message)
+
+    if len(result_objects) > utils.MAX_RETRIEVAL_ATTEMPT_BATCH_SIZE:
+        message = "A retrieval attempt batch can contain at most {} results".format(
+            utils.MAX_RETRIEVAL_ATTEMPT_BATCH_SIZE)
+        return utils.create_400_json_response(message)
+
+    results = utils.import_retrieval_results(result_objects, request.user)
+
+    batch_obj = {
+        'version': 1,
+        'num_retrieval_attempts_created': len([result for result in results if result[0] == 201]),
+        'results': [create_retrieval_attempt_batch_result_obj(result_obj, result)
+                    for result_obj, result in zip(result_objects, results)]
+    }
+
+    return JsonResponse(batch_obj, status=200)
+
+
+url_name = 'notecards-api-retrieval-attempt-batches'
+url_path = re_path(r'^retrieval-attempt-batches/$',
+                   process_request,
+                   name=url_name)
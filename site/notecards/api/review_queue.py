@@ -0,0 +1,57 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.urls import re_path
+from notecards import utils
+
+
+def process_request(request):
+    if not request.user.is_authenticated:
+        return utils.create_401_json_response()
+
+    if request.method == 'GET':
+        return get_review_queue(request)
+
+    else:
+        return utils.create_405_json_response(allow="GET")
+
+
+def get_review_queue(request):
+    try:
+        limit = int(request.GET.get('limit', utils.DEFAULT_REVIEW_QUEUE_LIMIT))
+    except ValueError:
+        return utils.create_400_json_response("limit must be an integer")
+
+    if (limit < 1) or (limit > utils.MAX_REVIEW_QUEUE_LIMIT):
+        message = "limit must be between 1 and {}".format(utils.MAX_REVIEW_QUEUE_LIMIT)
+        return utils.create_400_json_response(message)
+
+    due_cards = utils.get_due_cards(request.user)
+
+    # The tags and file attachments of all of
+    # the cards are loaded with one query each
+    card_list = utils.create_card_list(due_cards[:limit], "review")
+    num_cards = len(card_list['cards'])
+
+    # Only count the due cards if there are more than were returned
+    total_num_due_cards = num_cards
+    if num_cards == limit:
+        total_num_due_cards = due_cards.count()
+
+    review_queue = {
+        'version': 1,
+        'cards': card_list['cards'],
+        'num_cards': num_cards,
+        'total_num_due_cards': total_num_due_cards,
+        'links': [
+            {'rel': 'retrieval-attempt-batches', 'href': '/cards/api/v1/retrieval-attempt-batches/'}
+        ]
+    }
+
+    return utils.create_json_response(review_queue, status=200)
+
+
+url_name = 'notecards-api-review-queue'
+url_path = re_path(r'^review-queue/$',
+                   process_request,
+                   name=url_name)
@@ -2,7 +2,22 @@
 # Licensed under the terms of the MIT license.
 
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.models.signals import post_migrate
 
 
 class NotecardsConfig(AppConfig):
     name = 'notecards'
+
+    def ready(self):
+        from . import tasks
+        from . import search
+
+        # The task workers are started by the first request rather than
+        # here so management commands do not run the queued tasks
+        request_started.connect(tasks.start_workers, dispatch_uid="notecards-start-task-workers")
+
+        # Migrations which alter the card table drop the triggers of the
+        # SQLite search index, they are created again after migrating
+        post_migrate.connect(search.restore_search_index, sender=self,
+                             dispatch_uid="notecards-restore-search-index")
@@ -0,0 +1,413 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.db import transaction, connection
+from django.db.models import Q, prefetch_related_objects
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import Client
+from django import urls
+
+from notecards.models import Card, FileAttachment, RetrievalAttempt
+from notecards import utils, scheduler, card_list_cache
+
+from datetime import timedelta
+
+import io
+import random
+import json
+import time
+import base64
+import tarfile
+import contextlib
+
+
+# To run a benchmark, execute the following on the command
+# line (replacing the function name as needed):
+#
+#    $ python manage.py shell --command='from notecards import benchmarks; benchmarks.run_archive_import_benchmark()'
+#
+# All of the database changes made by a benchmark are rolled
+# back when it completes so it is safe to run these against
+# an existing database.
+
+
+@contextlib.contextmanager
+def benchmark_users(count=1):
+    with transaction.atomic():
+        users = []
+        for index in range(count):
+            username = "notecards_benchmark_user{}".format(index)
+            users.append(User.objects.create_user(username, "", None))
+
+        try:
+            yield users
+
+        finally:
+            file_attachments = FileAttachment.objects.filter(card__user__in=users)
+            for file_attachment in file_attachments:
+                file_attachment.file.delete(save=False)
+
+            transaction.set_rollback(True)
+
+
+@contextlib.contextmanager
+def timer(name, results):
+    start = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - start
+
+
+def print_results(title, results, num_items):
+    print(title)
+
+    for name, seconds in results.items():
+        print("    {:<24} {:>10.3f}s {:>12.1f} items/s".format(name, seconds, num_items / seconds))
+
+
+def create_benchmark_card_objects(num_cards, num_tags=20, file_size=2048):
+    file_data = base64.b64encode(b"x" * file_size).decode('utf-8')
+    card_objects = []
+
+    for index in range(num_cards):
+        card_objects.append({
+            'title': "title {}".format(index),
+            'query': "query {} ".format(index) * 20,
+            'answer': "answer {} ".format(index) * 20,
+            'next_retrieval_date': "2018-05-21T17:10:17.732Z",
+            'tags': [{'label': "tag{}".format(index % num_tags)}, {'label': "common"}],
+            'retrieval_attempts': [
+                {'retrieval_date': "2018-03-03T03:56:18.713Z", 'retrieved': True, 'spacing_bin': 1},
+                {'retrieval_date': "2018-03-07T00:57:34.041Z", 'retrieved': True, 'spacing_bin': 2}
+            ],
+            'files': [{'name': "file.txt", 'media_type': "text/plain", 'data': file_data}]
+        })
+
+    return card_objects
+
+
+def create_benchmark_archive(card_objects):
+    archive_bytes = io.BytesIO()
+    tf = tarfile.open(fileobj=archive_bytes, mode='w:gz')
+
+    for index, card_obj in enumerate(card_objects):
+        data = json.dumps(card_obj).encode('utf-8')
+        tarinfo = tarfile.TarInfo(name=str(index))
+        tarinfo.size = len(data)
+        tf.addfile(tarinfo=tarinfo, fileobj=io.BytesIO(data))
+
+    tf.close()
+    return archive_bytes.getvalue()
+
+
+def run_archive_import_benchmark(num_cards=2000, num_workers=4, file_size=2048):
+    """
+    Compares importing a card archive one card at a time
+    (utils.import_card) with the bulk import engine
+    (utils.import_card_archive) with and without the
+    worker processes used to decode the archive members.
+    """
+    card_objects = create_benchmark_card_objects(num_cards, file_size=file_size)
+    archive = create_benchmark_archive(card_objects)
+    results = {}
+
+    with benchmark_users(3) as users:
+        with timer("per card import", results):
+            tf = tarfile.open(fileobj=io.BytesIO(archive), mode='r:gz')
+
+            with transaction.atomic():
+                for tarinfo in tf:
+                    utils.import_card(json.load(tf.extractfile(tarinfo)), users[0])
+
+        with timer("bulk import", results):
+            utils.import_card_archive(io.BytesIO(archive), users[1], num_workers=0)
+
+        with timer("bulk import ({} workers)".format(num_workers), results):
+            utils.import_card_archive(io.BytesIO(archive), users[2], num_workers=num_workers)
+
+    print_results("Archive import ({} cards)".format(num_cards), results, num_cards)
+
+
+def run_text_search_benchmark(num_cards=100000, num_searches=20):
+    """
+    Compares searching the title, query and answer of the cards
+    with substring matching (the way title_filter searches the
+    titles) and with the full text search index (text_filter).
+    """
+    rng = random.Random(0)
+    words = ["word{}".format(index) for index in range(5000)]
+    search_words = rng.sample(words, num_searches)
+    results = {}
+
+    with benchmark_users() as users:
+        now = timezone.now()
+        cards = []
+
+        for index in range(num_cards):
+            cards.append(Card(user=users[0],
+                              title=" ".join(rng.sample(words, 4)),
+                              query=" ".join(rng.sample(words, 40)),
+                              answer=" ".join(rng.sample(words, 40)),
+                              last_modified_date=now,
+                              next_retrieval_date=now))
+
+        Card.objects.bulk_create(cards, batch_size=utils.CARD_CHUNK_SIZE)
+
+        with timer("substring match", results):
+            for word in search_words:
+                cards = Card.objects.filter(user=users[0])
+                cards = cards.filter(Q(title__icontains=word) |
+                                     Q(query__icontains=word) |
+                                     Q(answer__icontains=word))
+                len(cards)
+
+        for order_by, name in [(0, "text_filter"), (2, "text_filter (ranked)")]:
+            with timer(name, results):
+                for word in search_words:
+                    filter_params = {'text_filter': word, 'order_by': order_by}
+                    len(utils.get_filtered_cards(filter_params, users[0]))
+
+    print_results("Text search ({} cards, {} searches)".format(num_cards, num_searches),
+                  results, num_searches)
+
+
+def run_reschedule_benchmark(num_cards=100000, max_num_attempts=10):
+    """
+    Compares rescheduling a whole deck (after switching schedulers)
+    by replaying the retrieval histories one card at a time with
+    replaying them with numpy (if it is installed).
+    """
+    rng = random.Random(0)
+    results = {}
+
+    with benchmark_users() as users:
+        now = timezone.now()
+        cards = []
+
+        for index in range(num_cards):
+            cards.append(Card(user=users[0],
+                              title="title {}".format(index),
+                              last_modified_date=now,
+                              next_retrieval_date=now))
+
+        Card.objects.bulk_create(cards, batch_size=utils.CARD_CHUNK_SIZE)
+
+        retrieval_attempts = []
+        for card_id in Card.objects.filter(user=users[0]).values_list('id', flat=True):
+            for attempt in range(rng.randint(0, max_num_attempts)):
+                retrieval_attempts.append(RetrievalAttempt(card_id=card_id,
+                                                           retrieval_date=now - timedelta(days=100 - attempt),
+                                                           retrieved=rng.random() < 0.8))
+
+        RetrievalAttempt.objects.bulk_create(retrieval_attempts, batch_size=utils.CARD_CHUNK_SIZE)
+
+        cards = Card.objects.filter(user=users[0])
+
+        for name in scheduler.SCHEDULERS:
+            card_scheduler = scheduler.create_scheduler(name)
+
+            with timer("{} (python)".format(name), results):
+                scheduler.reschedule_cards(card_scheduler, cards, vectorized=False)
+
+            if scheduler.numpy is not None:
+                with timer("{} (numpy)".format(name), results):
+                    scheduler.reschedule_cards(card_scheduler, cards, vectorized=True)
+
+    print_results("Reschedule ({} cards, {} retrieval attempts)".format(num_cards, len(retrieval_attempts)),
+                  results, num_cards)
+
+
+def create_card_object_with_options(card, output_format=""):
+    """
+    Creates the card object the way utils.create_card_object did
+    before the CardSerializer: the output options are resolved for
+    every card and each key is checked against them. The related
+    object lists are created with the current utils functions.
+    """
+    options = utils.get_card_output_options(output_format)
+
+    card_obj = {'version': 1}
+    card_obj['uuid'] = card.uuid
+
+    if options['include_title']:
+        card_obj['title'] = card.title
+
+    if options['include_query']:
+        if options['max_query_length'] >= 0:
+            card_obj['query'] = utils.truncate_text(card.query, options['max_query_length'])
+        else:
+            card_obj['query'] = card.query
+
+    if options['include_query_html']:
+        card_obj['query_html'] = card.query_html or None
+
+    if options['include_answer']:
+        if options['max_answer_length'] >= 0:
+            card_obj['answer'] = utils.truncate_text(card.answer, options['max_answer_length'])
+        else:
+            card_obj['answer'] = card.answer
+
+    if options['include_creation_date']:
+        card_obj['creation_date'] = card.creation_date
+
+    if options['include_last_modified_date']:
+        card_obj['last_modified_date'] = card.last_modified_date
+
+    if options['include_next_retrieval_date']:
+        card_obj['next_retrieval_date'] = card.next_retrieval_date
+
+    if options['include_retrieval_attempts']:
+        card_obj.update(utils.create_card_retrieval_attempt_list(card, options['retrieval_attempt_output_format']))
+
+    if options['include_spacing_bin']:
+        card_obj['spacing_bin'] = card.spacing_bin
+
+    if options['include_active']:
+        card_obj['active'] = card.active
+
+    if options['include_hash']:
+        card_obj['sha_512'] = card.sha_512
+
+    if options['include_tags']:
+        card_obj.update(utils.create_card_tag_list(card, options['tag_output_format']))
+
+    if options['include_file_attachments']:
+        card_obj.update(utils.create_card_file_attachment_list(card, options['file_attachment_output_format']))
+
+    if options['include_links']:
+        card_obj['links'] = [
+            { 'rel': 'self', 'href': '/cards/api/v1/cards/' + str(card.uuid)},
+            { 'rel': 'edit-page', 'href': '/cards/edit/' + str(card.uuid)},
+            { 'rel': 'review-page', 'href': '/cards/review/' + str(card.uuid)},
+            { 'rel': 'tags', 'href': '/cards/api/v1/cards/' + str(card.uuid) + '/tags'},
+            { 'rel': 'files', 'href': '/cards/api/v1/cards/' + str(card.uuid) + '/files'},
+            { 'rel': 'retrieval-attempts', 'href': '/cards/api/v1/cards/' + str(card.uuid) + '/retrieval-attempts'}
+        ]
+
+    return card_obj
+
+
+def run_card_list_serialization_benchmark(num_cards=10000):
+    """
+    Measures creating the card lists returned by the api (for each
+    output format) with the per card output options (the old
+    create_card_object) and with the compiled CardSerializer, and
+    encoding them as json with DjangoJSONEncoder (the encoder used
+    by JsonResponse) and with utils.encode_json. The related objects
+    are loaded before the timers are started.
+    """
+    card_objects = create_benchmark_card_objects(num_cards, file_size=16)
+
+    with benchmark_users() as users:
+        utils.import_cards(card_objects, users[0])
+
+        cards = list(Card.objects.filter(user=users[0]).order_by('id'))
+        prefetch_related_objects(cards, 'tags', 'fileattachment_set', 'retrievalattempt_set')
+
+        for output_format in ["", "index", "archive", "links"]:
+            results = {}
+
+            with timer("options per card", results):
+                card_objects = [create_card_object_with_options(card, output_format) for card in cards]
+
+            with timer("CardSerializer", results):
+                card_list = utils.create_card_list(cards, output_format)
+
+            assert card_objects == card_list['cards']
+
+            with timer("DjangoJSONEncoder", results):
+                json.dumps(card_list, cls=DjangoJSONEncoder).encode('utf-8')
+
+            with timer("utils.encode_json", results):
+                utils.encode_json(card_list)
+
+            print_results("Card list serialization ('{}' format, {} cards)".format(output_format, num_cards),
+                          results, num_cards)
+
+
+def get_num_bytes_fetched(cards):
+    sql, params = cards.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return sum(len(str(value).encode('utf-8')) for row in cursor.fetchall() for value in row)
+
+
+def run_card_page_projection_benchmark(num_cards=5000, cards_per_page=100, text_length=4000):
+    """
+    Compares the number of bytes fetched from the database per page
+    of cards (and the time needed to create all of the pages) when
+    all of the columns are loaded with loading only the columns
+    used by the output format (get_filtered_cards with an output
+    format).
+    """
+    with benchmark_users() as users:
+        now = timezone.now()
+        cards = []
+
+        for index in range(num_cards):
+            cards.append(Card(user=users[0],
+                              title="title {}".format(index),
+                              query="q" * text_length,
+                              answer="a" * text_length,
+                              last_modified_date=now,
+                              next_retrieval_date=now))
+
+        Card.objects.bulk_create(cards, batch_size=utils.CARD_CHUNK_SIZE)
+
+        num_pages = num_cards // cards_per_page
+        filter_params = {'page': 1, 'cards_per_page': cards_per_page, 'order_by': 0}
+
+        print("Card pages ({} cards per page, {} pages)".format(cards_per_page, num_pages))
+
+        for output_format in ["index", "links"]:
+            for name, projection_format in [("all columns", None), ("projected", output_format)]:
+                page = utils.get_filtered_cards(filter_params, users[0], projection_format)
+                num_bytes = get_num_bytes_fetched(page.object_list)
+
+                start = time.perf_counter()
+
+                for page_number in range(1, num_pages + 1):
+                    filter_params['page'] = page_number
+                    page = utils.get_filtered_cards(filter_params, users[0], projection_format)
+                    utils.create_card_list(page, output_format)
+
+                seconds = time.perf_counter() - start
+                filter_params['page'] = 1
+
+                print("    {:<24} {:>10} bytes/page {:>10.3f}s".format(
+                      "{} ({})".format(output_format, name), num_bytes, seconds))
+
+
+def run_card_list_cache_benchmark(num_cards=5000, cards_per_page=100, num_requests=50):
+    """
+    Compares requesting the same page of the cards api (index format)
+    when the encoded card list is recreated for every request (the
+    cache is cleared before each request) with returning the cached
+    card list.
+    """
+    results = {}
+
+    with benchmark_users() as users:
+        card_objects = create_benchmark_card_objects(num_cards, file_size=16)
+        utils.import_cards(card_objects, users[0])
+
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(users[0])
+
+        url = urls.reverse('notecards-api-cards')
+        params = {'review_status': 1, 'cards_per_page': cards_per_page, 'page': 1}
+
+        with timer("uncached", results):
+            for index in range(num_requests):
+                card_list_cache.get_cache().clear()
+                client.get(url, params)
+
+        client.get(url, params)
+
+        with timer("cached", results):
+            for index in range(num_requests):
+                client.get(url, params)
+
+    print_results("Card list requests ({} cards per page)".format(cards_per_page), results, num_requests)
@@ -0,0 +1,50 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+# This module must not import Django (directly or indirectly)
+# because it is loaded by the worker processes which decode
+# card archive members during parallel archive imports.
+
+import json
+import base64
+import hashlib
+import binascii
+
+
+def get_bytes_sha_512(data):
+    sha_512 = hashlib.sha512()
+    sha_512.update(data)
+
+    digest = sha_512.digest()
+    b64_digest = base64.b64encode(digest)
+    return b64_digest.decode()
+
+
+def decode_card_archive_member(data):
+    """
+    Parses the json data of a card archive member and decodes the
+    base64 data of its file attachments. The decoded bytes and their
+    hash replace the 'data' field of each file object and are stored
+    in the 'decoded_data' and 'decoded_sha_512' fields. Returns None
+    if the member does not contain valid json.
+    """
+    try:
+        card_obj = json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+
+    if isinstance(card_obj, dict) and isinstance(card_obj.get('files'), list):
+        for fa_obj in card_obj['files']:
+            if not (isinstance(fa_obj, dict) and isinstance(fa_obj.get('data'), str)):
+                continue
+
+            try:
+                file_bytes = base64.b64decode(fa_obj['data'])
+            except (binascii.Error, ValueError):
+                continue
+
+            fa_obj['decoded_data'] = file_bytes
+            fa_obj['decoded_sha_512'] = get_bytes_sha_512(file_bytes)
+            del fa_obj['data']
+
+    return card_obj
@@ -0,0 +1,131 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.core.cache import caches
+
+from .models import CardChangeSequence
+from . import utils
+
+import json
+import hashlib
+import threading
+
+
+# The encoded card lists (and their ETags) are cached per user and
+# deck version. The deck version of a user is the sequence number of
+# the latest committed change to one of the user's cards. Every card,
+# tag, file attachment and retrieval attempt write is recorded as a
+# card change (see utils.record_card_changes) so a write makes all of
+# the cached lists of the user unreachable. They are never explicitly
+# deleted, the cache backend evicts them (the local memory backend
+# evicts the least recently used entries once it is full).
+#
+# The deck version is read before the cards. Since the sequence
+# numbers are assigned in commit order (see CardChangeSequence) a list
+# is never cached with a deck version newer than its cards.
+#
+# CACHE_FORMAT_VERSION is part of the cache key. Increment it when the
+# encoded card lists change (ie. new card fields) or when a migration
+# changes the cards without recording card changes, otherwise a
+# persistent cache backend keeps serving the old lists.
+#
+# The backend is configured with the 'card_lists' entry of the CACHES
+# setting (see settings_base.py).
+
+CACHE_ALIAS = 'card_lists'
+
+CACHE_KEY_PREFIX = "notecards-card-list"
+
+CACHE_FORMAT_VERSION = 2
+
+
+class CacheStats:
+    """
+    Number of cache hits and misses of this process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_summary(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def reset(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_deck_version(user):
+    sequence = CardChangeSequence.objects.filter(user=user).values_list('last_sequence', flat=True).first()
+    return sequence or 0
+
+
+def get_cache_key(user, deck_version, filter_params, output_format):
+    params = dict(filter_params)
+
+    # The due cards change at midnight without a change to the deck
+    if params.get('review_status') == 0:
+        params['due_date'] = utils.get_utc_datetime_for_local_midnight().isoformat()
+
+    data = json.dumps([params, output_format], sort_keys=True).encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+
+    return "{}:{}:{}:{}:{}".format(CACHE_KEY_PREFIX, CACHE_FORMAT_VERSION, user.pk, deck_version, digest)
+
+
+def get_card_list(key):
+    """
+    Returns the cached (etag, content) tuple of the
+    card list with the cache key or None.
+    """
+    value = get_cache().get(key)
+    stats.record(value is not None)
+
+    return value
+
+
+def set_card_list(key, etag, content):
+    get_cache().set(key, (etag, content))
+
+
+def get_encoded_card_list(user, filter_params, output_format):
+    """
+    Returns the (etag, content) tuple of the card list response of the
+    cards api for the filter params, from the cache if possible (and
+    caches it otherwise). Raises a ValueError if the filter params are
+    invalid.
+    """
+    # Read before the cards so a concurrent change is
+    # never cached as part of the older deck version
+    deck_version = get_deck_version(user)
+    key = get_cache_key(user, deck_version, filter_params, output_format)
+
+    cached_card_list = get_card_list(key)
+    if cached_card_list is not None:
+        return cached_card_list
+
+    cards = utils.get_filtered_cards(filter_params, user, output_format)
+    etag = utils.get_card_list_etag(cards)
+
+    card_list = utils.create_card_list(cards, output_format, filter_params=filter_params)
+    content = utils.encode_json(card_list)
+    set_card_list(key, etag, content)
+
+    return etag, content
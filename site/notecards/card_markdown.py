@@ -0,0 +1,282 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+import functools
+
+try:
+    from markdown_it import MarkdownIt
+    from markdown_it.common.utils import escapeHtml
+    from mdit_py_plugins.deflist import deflist_plugin
+except ImportError:
+    MarkdownIt = None
+
+
+# Server side version of the markdown renderer of the card pages (see
+# static/notecards/markdown_utils.js and the math delimiters plugin).
+# It is used to render the query snippets of the card list so the
+# browser does not have to run markdown-it over every card of a page.
+#
+# The output differs from the browser renderer in two ways:
+#
+#   - File attachment urls (@file_name) are not resolved because
+#     they depend on the file attachments rather than the text. The
+#     browser replaces them with the file urls of the card.
+#   - The contents of the math spans are html escaped (the text seen
+#     by MathJax is the same).
+#
+# The markdown-it-py and mdit-py-plugins packages are optional. If they
+# are not installed no snippets are rendered (render returns None)
+# and the browser renders the query itself.
+#
+# RENDERER_VERSION is part of the stored snippet hash. Increment it
+# when the output changes. The snippets are rendered again when the
+# queries change or by the render_query_snippets command (run it
+# after incrementing the version or installing markdown-it-py).
+
+RENDERER_VERSION = 1
+
+
+def asciimath_delimiter(state, silent):
+    return math_delimiter(state, silent, '$[', ']$', 'asciimath_delimiter')
+
+
+def texinline_delimiter(state, silent):
+    return math_delimiter(state, silent, '$$', '$$', 'texinline_delimiter')
+
+
+def math_delimiter(state, silent, open_markup, close_markup, token_type):
+    start = state.pos
+
+    if not state.src.startswith(open_markup, start):
+        return False
+
+    # Don't run any pairs in validation mode
+    if silent:
+        return False
+
+    if start + 4 >= state.posMax:
+        return False
+
+    start += len(open_markup)
+    pos = state.src.find(close_markup, start)
+
+    if pos == -1:
+        return False
+
+    content = state.src[start:pos]
+
+    if len(content) > 0:
+        token = state.push(token_type + '_open', 'span', 1)
+        token.markup = open_markup
+        token.content = content
+
+        token = state.push(token_type + '_close', 'span', -1)
+        token.markup = close_markup
+
+    state.pos = pos + len(close_markup)
+    return True
+
+
+def render_asciimath(self, tokens, idx, options, env):
+    if tokens[idx].nesting == 1:
+        return '<span class="asciimath-container">$[{}]$'.format(escapeHtml(tokens[idx].content))
+
+    return '</span>'
+
+
+def render_texinline(self, tokens, idx, options, env):
+    if tokens[idx].nesting == 1:
+        return '<span class="tex-inline-equation-container">$$ {} $$'.format(escapeHtml(tokens[idx].content))
+
+    return '</span>'
+
+
+def math_delimiters_plugin(md):
+    md.inline.ruler.after('emphasis', 'asciimath_delimiter', asciimath_delimiter)
+    md.add_render_rule('asciimath_delimiter_open', render_asciimath)
+    md.add_render_rule('asciimath_delimiter_close', render_asciimath)
+
+    md.inline.ruler.after('asciimath_delimiter', 'texinline_delimiter', texinline_delimiter)
+    md.add_render_rule('texinline_delimiter_open', render_texinline)
+    md.add_render_rule('texinline_delimiter_close', render_texinline)
+
+
+def raw_container_plugin(md, name, marker, validate, render):
+    """
+    Block container whose content is not parsed (the same as
+    markdown-it-container with the parseContent option disabled).
+    The raw lines of the container are the content of the open token.
+    """
+    min_markers = 3
+
+    def count_markers(src, start, end):
+        pos = start
+        while pos < end and src[pos] == marker[(pos - start) % len(marker)]:
+            pos += 1
+
+        return pos
+
+    def container(state, start_line, end_line, silent):
+        auto_closed = False
+        start = state.bMarks[start_line] + state.tShift[start_line]
+        max_pos = state.eMarks[start_line]
+
+        # Check out the first character quickly,
+        # this filters out most of non-containers
+        if not state.src.startswith(marker[0], start):
+            return False
+
+        pos = count_markers(state.src, start, max_pos)
+
+        marker_count = (pos - start) // len(marker)
+        if marker_count < min_markers:
+            return False
+
+        pos -= (pos - start) % len(marker)
+
+        markup = state.src[start:pos]
+        params = state.src[pos:max_pos]
+        if not validate(params):
+            return False
+
+        # Since start is found, success can be reported in validation mode
+        if silent:
+            return True
+
+        # Search for the end of the block
+        next_line = start_line
+
+        while True:
+            next_line += 1
+            if next_line >= end_line:
+                # An unclosed block is autoclosed by the end of the document
+                # (or by the end of the parent)
+                break
+
+            start = state.bMarks[next_line] + state.tShift[next_line]
+            max_pos = state.eMarks[next_line]
+
+            if start < max_pos and state.sCount[next_line] < state.blkIndent:
+                # A non-empty line with negative indent stops the list
+                break
+
+            if not state.src.startswith(marker[0], start):
+                continue
+
+            if state.sCount[next_line] - state.blkIndent >= 4:
+                # The closing fence has to be indented less than 4 spaces
+                continue
+
+            pos = count_markers(state.src, start, max_pos)
+
+            # The closing fence has to be at least as long as the opening one
+            if (pos - start) // len(marker) < marker_count:
+                continue
+
+            # The tail may only contain spaces
+            pos -= (pos - start) % len(marker)
+            pos = state.skipSpaces(pos)
+
+            if pos < max_pos:
+                continue
+
+            auto_closed = True
+            break
+
+        old_parent = state.parentType
+        old_line_max = state.lineMax
+        state.parentType = 'container'
+
+        # Prevents lazy continuations from ever going past the end marker
+        state.lineMax = next_line
+
+        token = state.push('container_' + name + '_open', 'div', 1)
+        token.markup = markup
+        token.block = True
+        token.info = params
+        token.map = [start_line, next_line]
+        token.content = state.getLines(start_line + 1, next_line, 0, True)
+
+        token = state.push('container_' + name + '_close', 'div', -1)
+        token.markup = state.src[start:pos]
+        token.block = True
+
+        state.parentType = old_parent
+        state.lineMax = old_line_max
+        state.line = next_line + (1 if auto_closed else 0)
+
+        return True
+
+    md.block.ruler.before('fence', 'container_' + name, container,
+                          {'alt': ['paragraph', 'reference', 'blockquote', 'list']})
+    md.add_render_rule('container_' + name + '_open', render)
+    md.add_render_rule('container_' + name + '_close', render)
+
+
+def get_cgraph_version(params):
+    words = params.split()
+
+    if len(words) == 2 and words[0] == 'cgraph' and words[1].isdigit():
+        return words[1]
+
+    return None
+
+
+def render_cgraph(self, tokens, idx, options, env):
+    if tokens[idx].nesting == 1:
+        version = get_cgraph_version(tokens[idx].info)
+        return '<div data-content-type="cgraph_{}">\n{}'.format(version, escapeHtml(tokens[idx].content))
+
+    return '</div>\n'
+
+
+def render_tex_display_equation(self, tokens, idx, options, env):
+    if tokens[idx].nesting == 1:
+        return '<div class="tex-display-equation-container">\n$$$\n{}'.format(escapeHtml(tokens[idx].content))
+
+    return ' $$$</div>\n'
+
+
+def render_link_open(self, tokens, idx, options, env):
+    tokens[idx].attrSet('target', '_blank')
+    return self.renderToken(tokens, idx, options, env)
+
+
+def render_table_open(self, tokens, idx, options, env):
+    tokens[idx].attrSet('class', 'ui-table md-table')
+    return self.renderToken(tokens, idx, options, env)
+
+
+def create_renderer():
+    md = MarkdownIt('js-default').use(deflist_plugin).use(math_delimiters_plugin)
+
+    raw_container_plugin(md, 'cgraph', ':',
+                         lambda params: get_cgraph_version(params) is not None,
+                         render_cgraph)
+    raw_container_plugin(md, 'tex_display_equation', '$',
+                         lambda params: True,
+                         render_tex_display_equation)
+
+    md.add_render_rule('link_open', render_link_open)
+    md.add_render_rule('table_open', render_table_open)
+
+    return md
+
+
+renderer = create_renderer() if MarkdownIt is not None else None
+
+
+def is_available():
+    return renderer is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def render(text):
+    """
+    Returns the html of the markdown text or None if
+    the markdown renderer is not installed.
+    """
+    if renderer is None:
+        return None
+
+    return renderer.render(text)
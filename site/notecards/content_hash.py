@@ -0,0 +1,155 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.db import transaction
+
+from .models import FileAttachment
+
+import base64
+import collections
+import hashlib
+
+
+# The hash of a card is made up of two component digests which
+# are stored with the card:
+#
+#     text_sha_512:  digest of the title, query and answer
+#     files_sha_512: digest chain over the hashes of the file
+#                    attachments (in the order they were added)
+#
+# The card hash is the digest of the two components so a change to
+# the text or the addition of a file only requires the affected
+# component to be updated (no file attachments have to be queried).
+# Only removing a file requires the file chain to be rebuilt from the
+# remaining file attachment hashes.
+
+
+def get_sha_512(*values):
+    sha_512 = hashlib.sha512()
+
+    for value in values:
+        sha_512.update(value.encode())
+
+    digest = sha_512.digest()
+    b64_digest = base64.b64encode(digest)
+    return b64_digest.decode()
+
+
+def get_text_sha_512(title, query, answer):
+    return get_sha_512(title, query, answer)
+
+
+def append_files_sha_512(files_sha_512, file_hash):
+    return get_sha_512(files_sha_512, file_hash)
+
+
+def get_files_sha_512(file_hashes):
+    files_sha_512 = ""
+
+    for file_hash in file_hashes:
+        files_sha_512 = append_files_sha_512(files_sha_512, file_hash)
+
+    return files_sha_512
+
+
+def combine_card_sha_512(text_sha_512, files_sha_512):
+    return get_sha_512(text_sha_512, files_sha_512)
+
+
+def get_card_file_hashes(card):
+    return list(FileAttachment.objects.filter(card=card)
+                                      .order_by('id')
+                                      .values_list('sha_512', flat=True))
+
+
+def update_card_text_hash(card):
+    """
+    Updates the hashes of the card after its title,
+    query or answer have been changed.
+    """
+    card.text_sha_512 = get_text_sha_512(card.title, card.query, card.answer)
+    card.sha_512 = combine_card_sha_512(card.text_sha_512, card.files_sha_512)
+
+
+def add_card_file_hash(card, file_hash):
+    """
+    Updates the hashes of the card after a file
+    attachment (with file_hash) has been added.
+    """
+    card.files_sha_512 = append_files_sha_512(card.files_sha_512, file_hash)
+    card.sha_512 = combine_card_sha_512(card.text_sha_512, card.files_sha_512)
+
+
+def update_card_hashes(card, file_hashes=None):
+    """
+    Recomputes all of the hashes of the card. If file_hashes is
+    None, the file attachment hashes are queried from the database.
+    """
+    if file_hashes is None:
+        file_hashes = get_card_file_hashes(card)
+
+    card.text_sha_512 = get_text_sha_512(card.title, card.query, card.answer)
+    card.files_sha_512 = get_files_sha_512(file_hashes)
+    card.sha_512 = combine_card_sha_512(card.text_sha_512, card.files_sha_512)
+
+
+def verify_card_hashes(cards, file_attachments=None, rebuild=False, chunk_size=500):
+    """
+    Compares the stored hashes of the cards with hashes recomputed
+    from the card contents and file attachments. The cards are
+    processed in chunks of chunk_size with one file attachment
+    query per chunk. If rebuild is True the cards with incorrect
+    hashes are updated (with one bulk update per chunk) and recorded
+    as card changes so the cached card lists of their users are not
+    used anymore.
+
+    Returns a tuple containing the number of cards which were
+    checked and a list with the uuids of the incorrect cards.
+    """
+    # utils imports this module
+    from .utils import record_card_changes
+
+    if file_attachments is None:
+        file_attachments = FileAttachment.objects.all()
+
+    num_cards_checked = 0
+    mismatched_uuids = []
+    last_card_id = 0
+
+    while True:
+        chunk = list(cards.filter(id__gt=last_card_id).order_by('id')[:chunk_size])
+        if len(chunk) == 0:
+            break
+
+        last_card_id = chunk[-1].id
+
+        file_hashes = {card.id: [] for card in chunk}
+        for card_id, file_hash in file_attachments.filter(card_id__in=list(file_hashes.keys())) \
+                                                  .order_by('card_id', 'id') \
+                                                  .values_list('card_id', 'sha_512'):
+            file_hashes[card_id].append(file_hash)
+
+        cards_to_update = []
+        for card in chunk:
+            stored_hashes = (card.sha_512, card.text_sha_512, card.files_sha_512)
+            update_card_hashes(card, file_hashes[card.id])
+
+            if stored_hashes != (card.sha_512, card.text_sha_512, card.files_sha_512):
+                mismatched_uuids.append(card.uuid)
+                cards_to_update.append(card)
+
+        if rebuild and (len(cards_to_update) > 0):
+            uuids_by_user = collections.defaultdict(list)
+            for card in cards_to_update:
+                uuids_by_user[card.user_id].append(card.uuid)
+
+            with transaction.atomic():
+                cards.model.objects.bulk_update(cards_to_update,
+                                                ['sha_512', 'text_sha_512', 'files_sha_512'])
+
+                for user_id, uuids in uuids_by_user.items():
+                    record_card_changes(user_id, uuids)
+
+        num_cards_checked += len(chunk)
+
+    return (num_cards_checked, mismatched_uuids)
@@ -14,7 +14,12 @@ from notecards.tests.test_api_card_retrieval_attempts import RetrievalAttemptsAp
 from notecards.tests.test_api_card_retrieval_attempt import RetrievalAttemptApiTests
 from notecards.tests.test_api_tags import TagsApiTests
 from notecards.tests.test_api_card_archive_import_tasks import CardArchiveImportTasksApiTests
+from notecards.tests.test_api_card_archive_import_task import CardArchiveImportTaskApiTests
 from notecards.tests.test_api_advance_review_date_tasks import AdvanceReviewDateTasksApiTests
+from notecards.tests.test_api_changes import ChangesApiTests
+from notecards.tests.test_api_card_batches import CardBatchesApiTests
+from notecards.tests.test_api_retrieval_attempt_batches import RetrievalAttemptBatchesApiTests
+from notecards.tests.test_api_review_queue import ReviewQueueApiTests
 
 
 # To create the api documentation, execute
@@ -116,7 +121,12 @@ def export_api_doc():
         RetrievalAttemptApiTests,
         TagsApiTests,
         CardArchiveImportTasksApiTests,
-        AdvanceReviewDateTasksApiTests
+        CardArchiveImportTaskApiTests,
+        AdvanceReviewDateTasksApiTests,
+        ChangesApiTests,
+        CardBatchesApiTests,
+        RetrievalAttemptBatchesApiTests,
+        ReviewQueueApiTests
     ]
 
     result = []
@@ -0,0 +1,35 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from notecards.models import Card
+from notecards import card_markdown, utils
+
+
+class Command(BaseCommand):
+    help = "Renders the query snippets of the cards which are out of date"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help="Only render the snippets of the cards of these users (default: all users)")
+
+    def handle(self, *args, **options):
+        if not card_markdown.is_available():
+            raise CommandError("The markdown renderer (markdown-it-py and mdit-py-plugins) is not installed")
+
+        cards = Card.objects.all()
+
+        if len(options['usernames']) > 0:
+            users = User.objects.filter(username__in=options['usernames'])
+
+            missing_usernames = set(options['usernames']) - set(user.username for user in users)
+            if len(missing_usernames) > 0:
+                raise CommandError("Unknown user(s): " + ", ".join(sorted(missing_usernames)))
+
+            cards = cards.filter(user__in=users)
+
+        num_cards_checked, updated_uuids = utils.render_query_snippets(cards)
+
+        self.stdout.write("{} cards checked, {} snippets rendered".format(num_cards_checked, len(updated_uuids)))
@@ -0,0 +1,40 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from notecards import scheduler, utils
+
+import json
+
+
+class Command(BaseCommand):
+    help = "Changes the card scheduler of a user and reschedules all of the cards of the user"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('name', choices=sorted(scheduler.SCHEDULERS.keys()),
+                            help="The name of the scheduler")
+        parser.add_argument('--parameters', default="{}",
+                            help="The scheduler parameters as a json object (ie. '{\"growth\": 2.0}')")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError("Unknown user: " + options['username'])
+
+        try:
+            parameters = json.loads(options['parameters'])
+        except ValueError:
+            raise CommandError("The parameters must be a json object")
+
+        if not isinstance(parameters, dict):
+            raise CommandError("The parameters must be a json object")
+
+        try:
+            num_cards_rescheduled = utils.set_card_scheduler(user, options['name'], parameters)
+        except ValueError as err:
+            raise CommandError(str(err))
+
+        self.stdout.write("{} cards rescheduled".format(num_cards_rescheduled))
@@ -0,0 +1,45 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from notecards.models import Card
+from notecards import content_hash, utils
+
+
+class Command(BaseCommand):
+    help = "Verifies (and optionally rebuilds) the stored card hashes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help="Only check the cards of these users (default: all users)")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Update the cards whose stored hashes are incorrect")
+
+    def handle(self, *args, **options):
+        cards = Card.objects.all()
+
+        if len(options['usernames']) > 0:
+            users = User.objects.filter(username__in=options['usernames'])
+
+            missing_usernames = set(options['usernames']) - set(user.username for user in users)
+            if len(missing_usernames) > 0:
+                raise CommandError("Unknown user(s): " + ", ".join(sorted(missing_usernames)))
+
+            cards = cards.filter(user__in=users)
+
+        num_cards_checked, mismatched_uuids = \
+            content_hash.verify_card_hashes(cards,
+                                            rebuild=options['rebuild'],
+                                            chunk_size=utils.CARD_CHUNK_SIZE)
+
+        for uuid in mismatched_uuids:
+            self.stdout.write("Incorrect hash: " + uuid)
+
+        if options['rebuild']:
+            message = "{} cards checked, {} hashes rebuilt"
+        else:
+            message = "{} cards checked, {} incorrect hashes"
+
+        self.stdout.write(message.format(num_cards_checked, len(mismatched_uuids)))
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.12 on 2026-10-17 17:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import notecards.models.card_archive_import_task
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notecards', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardArchiveImportTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive_file', models.FileField(upload_to=notecards.models.card_archive_import_task.get_archive_file_path)),
+                ('status', models.CharField(default='queued', max_length=16)),
+                ('num_cards_processed', models.IntegerField(default=0)),
+                ('num_cards_imported', models.IntegerField(default=0)),
+                ('num_cards_conflicted', models.IntegerField(default=0)),
+                ('errors', models.TextField(default='[]')),
+                ('message', models.CharField(default='', max_length=256)),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date created')),
+                ('start_date', models.DateTimeField(null=True)),
+                ('completion_date', models.DateTimeField(null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
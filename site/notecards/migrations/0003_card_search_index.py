@@ -0,0 +1,92 @@
+from django.db import migrations
+
+
+# Same as the statements of notecards.search (as of this migration)
+
+POSTGRES_TSVECTOR = "to_tsvector('english', title || ' ' || query || ' ' || answer)"
+
+SQLITE_CREATE_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS notecards_card_fts USING fts5(
+           title, query, answer,
+           content='notecards_card', content_rowid='id',
+           tokenize='porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS notecards_card_fts_ai AFTER INSERT ON notecards_card BEGIN
+           INSERT INTO notecards_card_fts(rowid, title, query, answer)
+           VALUES (new.id, new.title, new.query, new.answer);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS notecards_card_fts_ad AFTER DELETE ON notecards_card BEGIN
+           INSERT INTO notecards_card_fts(notecards_card_fts, rowid, title, query, answer)
+           VALUES ('delete', old.id, old.title, old.query, old.answer);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS notecards_card_fts_au AFTER UPDATE OF title, query, answer ON notecards_card BEGIN
+           INSERT INTO notecards_card_fts(notecards_card_fts, rowid, title, query, answer)
+           VALUES ('delete', old.id, old.title, old.query, old.answer);
+           INSERT INTO notecards_card_fts(rowid, title, query, answer)
+           VALUES (new.id, new.title, new.query, new.answer);
+       END""",
+    "INSERT INTO notecards_card_fts(notecards_card_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_STATEMENTS = [
+    "DROP TRIGGER IF EXISTS notecards_card_fts_ai",
+    "DROP TRIGGER IF EXISTS notecards_card_fts_ad",
+    "DROP TRIGGER IF EXISTS notecards_card_fts_au",
+    "DROP TABLE IF EXISTS notecards_card_fts",
+]
+
+POSTGRES_CREATE_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS notecards_card_search_idx ON notecards_card USING GIN ({})".format(POSTGRES_TSVECTOR),
+]
+
+POSTGRES_DROP_STATEMENTS = [
+    "DROP INDEX IF EXISTS notecards_card_search_idx",
+]
+
+
+def sqlite_supports_fts5(db_connection):
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        statements = POSTGRES_CREATE_STATEMENTS
+
+    elif vendor == 'sqlite' and sqlite_supports_fts5(schema_editor.connection):
+        statements = SQLITE_CREATE_STATEMENTS
+
+    else:
+        statements = []
+
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        statements = POSTGRES_DROP_STATEMENTS
+
+    elif vendor == 'sqlite':
+        statements = SQLITE_DROP_STATEMENTS
+
+    else:
+        statements = []
+
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notecards', '0002_card_archive_import_task'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.12 on 2026-10-17 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notecards', '0003_card_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['user', 'active', 'next_retrieval_date'], name='card_user_active_next_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['user', 'next_retrieval_date'], name='card_user_next_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['user', 'creation_date'], name='card_user_creation_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 2.2.12 on 2026-10-17 17:32
+
+from django.db import migrations, models
+
+import base64
+import hashlib
+
+
+CHUNK_SIZE = 500
+
+
+# Same as notecards.content_hash (as of this migration)
+def get_sha_512(*values):
+    sha_512 = hashlib.sha512()
+
+    for value in values:
+        sha_512.update(value.encode())
+
+    return base64.b64encode(sha_512.digest()).decode()
+
+
+def rebuild_card_hashes(apps, schema_editor):
+    Card = apps.get_model('notecards', 'Card')
+    FileAttachment = apps.get_model('notecards', 'FileAttachment')
+
+    last_card_id = 0
+
+    while True:
+        chunk = list(Card.objects.filter(id__gt=last_card_id).order_by('id')[:CHUNK_SIZE])
+        if len(chunk) == 0:
+            break
+
+        last_card_id = chunk[-1].id
+
+        file_hashes = {card.id: [] for card in chunk}
+        for card_id, file_hash in FileAttachment.objects.filter(card_id__in=list(file_hashes.keys())) \
+                                                        .order_by('card_id', 'id') \
+                                                        .values_list('card_id', 'sha_512'):
+            file_hashes[card_id].append(file_hash)
+
+        for card in chunk:
+            card.text_sha_512 = get_sha_512(card.title, card.query, card.answer)
+
+            card.files_sha_512 = ""
+            for file_hash in file_hashes[card.id]:
+                card.files_sha_512 = get_sha_512(card.files_sha_512, file_hash)
+
+            card.sha_512 = get_sha_512(card.text_sha_512, card.files_sha_512)
+
+        Card.objects.bulk_update(chunk, ['sha_512', 'text_sha_512', 'files_sha_512'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notecards', '0004_card_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='files_sha_512',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='text_sha_512',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.RunPython(rebuild_card_hashes, migrations.RunPython.noop),
+    ]
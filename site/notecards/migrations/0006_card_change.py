@@ -0,0 +1,51 @@
+# Generated by Django 2.2.12 on 2026-10-17 17:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_card_changes(apps, schema_editor):
+    # Record a change for each of the existing cards (oldest first)
+    # so the first sync (since=0) returns all of the existing cards.
+    Card = apps.get_model('notecards', 'Card')
+    CardChange = apps.get_model('notecards', 'CardChange')
+
+    card_values = Card.objects.order_by('last_modified_date', 'id') \
+                              .values_list('user_id', 'uuid', 'last_modified_date')
+
+    card_changes = [CardChange(user_id=user_id, card_uuid=uuid, change_date=last_modified_date)
+                    for user_id, uuid, last_modified_date in card_values.iterator()]
+
+    CardChange.objects.bulk_create(card_changes, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notecards', '0005_card_content_hashes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_uuid', models.CharField(max_length=22)),
+                ('deleted', models.BooleanField(default=False)),
+                ('change_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date changed')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='cardchange',
+            index=models.Index(fields=['user', 'id'], name='cardchange_user_sequence_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='cardchange',
+            unique_together={('user', 'card_uuid')},
+        ),
+        migrations.RunPython(create_card_changes, migrations.RunPython.noop),
+    ]
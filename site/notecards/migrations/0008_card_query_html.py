@@ -0,0 +1,28 @@
+# Generated by Django 2.2.12 on 2026-10-17 18:30
+
+from django.db import migrations, models
+
+
+# The query snippets of the existing cards are left empty (the browser
+# renders the queries of those cards). They are rendered by the
+# render_query_snippets command since the renderer is not part of the
+# historical models.
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notecards', '0007_scheduler_setting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='query_html',
+            field=models.TextField(default=''),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='query_html_sha_512',
+            field=models.CharField(default='', max_length=100),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.12 on 2026-10-17 18:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def number_existing_changes(apps, schema_editor):
+    # The existing changes keep their ids as sequence numbers
+    CardChange = apps.get_model('notecards', 'CardChange')
+    CardChangeSequence = apps.get_model('notecards', 'CardChangeSequence')
+
+    CardChange.objects.update(sequence=models.F('id'))
+
+    last_sequences = CardChange.objects.values('user_id').annotate(last_sequence=models.Max('sequence'))
+    CardChangeSequence.objects.bulk_create([CardChangeSequence(user_id=value['user_id'],
+                                                               last_sequence=value['last_sequence'])
+                                            for value in last_sequences], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notecards', '0008_card_query_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardChangeSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_sequence', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='cardchange',
+            name='cardchange_user_sequence_idx',
+        ),
+        migrations.AddField(
+            model_name='cardchange',
+            name='sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='cardchange',
+            index=models.Index(fields=['user', 'sequence'], name='cardchange_user_sequence_idx'),
+        ),
+        migrations.AddField(
+            model_name='cardchangesequence',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(number_existing_changes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.12 on 2026-10-17 19:00
+
+from django.db import migrations, models
+
+
+def set_heartbeat_dates(apps, schema_editor):
+    # Running tasks become stale relative to their start date
+    CardArchiveImportTask = apps.get_model('notecards', 'CardArchiveImportTask')
+    CardArchiveImportTask.objects.filter(status="running").update(heartbeat_date=models.F('start_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notecards', '0009_card_change_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardarchiveimporttask',
+            name='heartbeat_date',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(set_heartbeat_dates, migrations.RunPython.noop),
+    ]
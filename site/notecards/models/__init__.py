@@ -5,4 +5,6 @@ from .card import Card
 from .file_attachment import FileAttachment
 from .retrieval_attempt import RetrievalAttempt
 from .tag import Tag
-
+from .card_archive_import_task import CardArchiveImportTask
+from .card_change import CardChange, CardChangeSequence
+from .scheduler_setting import SchedulerSetting
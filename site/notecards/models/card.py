@@ -31,9 +31,18 @@ class Card(models.Model):
     active = models.BooleanField(default=True)
     tags = models.ManyToManyField(Tag)
     sha_512 = models.CharField(max_length=100)
+    text_sha_512 = models.CharField(max_length=100, default="")
+    files_sha_512 = models.CharField(max_length=100, default="")
+    query_html = models.TextField(default="")
+    query_html_sha_512 = models.CharField(max_length=100, default="")
 
     class Meta:
         unique_together = ("user", "uuid")
+        indexes = [
+            models.Index(fields=["user", "active", "next_retrieval_date"], name="card_user_active_next_idx"),
+            models.Index(fields=["user", "next_retrieval_date"], name="card_user_next_idx"),
+            models.Index(fields=["user", "creation_date"], name="card_user_creation_idx"),
+        ]
 
     def __str__(self):
         return "id:" + str(self.pk) \
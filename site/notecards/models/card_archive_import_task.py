@@ -0,0 +1,49 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.db import models
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+
+def get_archive_file_path(instance, filename):
+    return "tasks/card-archive-imports/{}/{}".format(instance.user.pk, filename)
+
+
+class CardArchiveImportTask(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    archive_file = models.FileField(upload_to=get_archive_file_path)
+    status = models.CharField(max_length=16, default=STATUS_QUEUED)
+    num_cards_processed = models.IntegerField(default=0)
+    num_cards_imported = models.IntegerField(default=0)
+    num_cards_conflicted = models.IntegerField(default=0)
+    errors = models.TextField(default="[]") # json list of the cards not imported
+    message = models.CharField(max_length=256, default="")
+    creation_date = models.DateTimeField('date created', default=timezone.now)
+    start_date = models.DateTimeField(null=True)
+    heartbeat_date = models.DateTimeField(null=True) # last progress update of a running task
+    completion_date = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return "id:" + str(self.pk) \
+            + " status:" + self.status \
+            + " processed:" + str(self.num_cards_processed) \
+            + " imported:" + str(self.num_cards_imported)
+
+    def is_finished(self):
+        return ((self.status == CardArchiveImportTask.STATUS_COMPLETED) or
+                (self.status == CardArchiveImportTask.STATUS_FAILED))
+
+    @staticmethod
+    def from_id(task_id, user):
+        try:
+            task = CardArchiveImportTask.objects.get(pk__exact=task_id, user=user)
+        except:
+            task = None
+
+        return task
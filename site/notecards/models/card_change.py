@@ -0,0 +1,49 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.db import models
+from django.utils import timezone
+from django.contrib.auth.models import User
+
+
+class CardChange(models.Model):
+    """
+    The most recent change to each of the cards of a user. A change
+    replaces the previous change of the same card and is numbered with
+    the next change sequence number of the user (see CardChangeSequence).
+    Deleted cards are kept as tombstones (deleted=True).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    card_uuid = models.CharField(max_length=22)
+    sequence = models.BigIntegerField(default=0)
+    deleted = models.BooleanField(default=False)
+    change_date = models.DateTimeField('date changed', default=timezone.now)
+
+    class Meta:
+        unique_together = ("user", "card_uuid")
+        indexes = [
+            models.Index(fields=["user", "sequence"], name="cardchange_user_sequence_idx"),
+        ]
+
+    def __str__(self):
+        return "id:" + str(self.pk) \
+            + " sequence:" + str(self.sequence) \
+            + " card_uuid:" + self.card_uuid \
+            + " deleted:" + str(self.deleted)
+
+
+class CardChangeSequence(models.Model):
+    """
+    The last change sequence number of a user. The row is locked (with
+    select_for_update) by the transaction which records changes until
+    that transaction commits, so the changes of a user are committed in
+    the order of their sequence numbers. A client which has seen a
+    sequence number can therefore never miss a change with a lower one.
+    Unlike auto incremented ids, which are assigned on insert and can be
+    committed out of order by long running transactions.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    last_sequence = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return "user:" + str(self.user_id) + " last_sequence:" + str(self.last_sequence)
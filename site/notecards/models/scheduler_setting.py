@@ -0,0 +1,21 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.db import models
+from django.contrib.auth.models import User
+
+
+class SchedulerSetting(models.Model):
+    """
+    The scheduler (see notecards.scheduler) used to compute the next
+    retrieval dates of the cards of a user. The parameters are stored
+    as a json object. Users without a setting use the default scheduler.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=32)
+    parameters = models.TextField(default="{}")
+
+    def __str__(self):
+        return "id:" + str(self.pk) \
+            + " name:" + self.name \
+            + " parameters:" + self.parameters
@@ -0,0 +1,411 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.utils import timezone
+
+from .models import Card, RetrievalAttempt, SchedulerSetting
+
+from datetime import datetime, timedelta
+
+import collections
+import json
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Schedulers compute the spacing bin and the next retrieval date of
+# a card after each retrieval attempt. The state of a card is:
+#
+#     spacing_bin: 1 + the number of consecutive successful retrievals
+#     ease:        growth factor of the interval (only used by SM-2)
+#     interval:    number of days until the next retrieval
+#     retired:     True if the card is no longer reviewed (inactive)
+#
+# The review() method of each scheduler only uses the functions of the
+# `ops` argument for conditionals so the same code updates the state of
+# a single card (with python values) or the states of many cards at
+# once (with numpy arrays) when a whole deck is rescheduled.
+#
+# Schedulers which replay the history compute the state of a card from
+# all of its retrieval attempts. The fixed bin scheduler only uses the
+# spacing bin stored with the card (imported cards do not necessarily
+# have a retrieval history).
+
+DEFAULT_SCHEDULER_NAME = "fixed_bins"
+
+# Interval of the cards which have run through all of the bins
+RETIRED_INTERVAL_DAYS = 365 * 10
+
+# Number of cards rescheduled at a time
+RESCHEDULE_CHUNK_SIZE = 10000
+
+# Number of cards per UPDATE statement of update_card_schedules (each
+# card adds 7 query parameters, SQLite allows 999 parameters per query)
+UPDATE_BATCH_SIZE = 100
+
+ScheduleState = collections.namedtuple('ScheduleState', ['spacing_bin', 'ease', 'interval', 'retired'])
+
+
+class ScalarOps:
+    @staticmethod
+    def where(condition, x, y):
+        return x if condition else y
+
+    @staticmethod
+    def take(table, index):
+        return table[index]
+
+    maximum = staticmethod(max)
+    minimum = staticmethod(min)
+    power = staticmethod(pow)
+
+
+if numpy is not None:
+    class NumpyOps:
+        @staticmethod
+        def take(table, index):
+            return numpy.asarray(table)[index]
+
+        where = staticmethod(numpy.where)
+        maximum = staticmethod(numpy.maximum)
+        minimum = staticmethod(numpy.minimum)
+        power = staticmethod(numpy.power)
+
+
+class Scheduler:
+    name = ""
+    replays_history = True
+    initial_ease = 0.0
+
+    def get_initial_state(self, card):
+        return ScheduleState(1, self.initial_ease, 0.0, not card.active)
+
+    def get_card_state(self, card):
+        return self.get_initial_state(card)
+
+    def review(self, state, retrieved, ops=ScalarOps):
+        raise NotImplementedError()
+
+
+class FixedBinScheduler(Scheduler):
+    """
+    Each successful retrieval moves the card to the next bin which has
+    a fixed number of days until the next retrieval. A card which is
+    retrieved from the last bin is retired. A failed retrieval moves
+    the card back to the first bin.
+    """
+    name = "fixed_bins"
+    replays_history = False
+
+    def __init__(self, bin_days=(1, 3, 7, 13, 19, 29, 37)):
+        self.bin_days = list(bin_days)
+        self.day_table = [0] + self.bin_days
+
+    def get_card_state(self, card):
+        return ScheduleState(card.spacing_bin, 0.0, 0.0, not card.active)
+
+    def review(self, state, retrieved, ops=ScalarOps):
+        last_bin = len(self.bin_days)
+
+        in_bins = (state.spacing_bin >= 1) & (state.spacing_bin <= last_bin)
+        next_bin = ops.where(in_bins, state.spacing_bin + 1, state.spacing_bin)
+        retired = (next_bin < 1) | (next_bin > last_bin)
+
+        next_interval = ops.where(retired,
+                                  RETIRED_INTERVAL_DAYS,
+                                  ops.take(self.day_table, ops.minimum(ops.maximum(next_bin, 1), last_bin)))
+
+        return ScheduleState(spacing_bin=ops.where(retrieved, next_bin, 1),
+                             ease=state.ease,
+                             interval=ops.where(retrieved, next_interval, self.bin_days[0]),
+                             retired=state.retired | (retrieved & retired))
+
+
+class SM2Scheduler(Scheduler):
+    """
+    The SuperMemo 2 algorithm. The first two successful retrievals are
+    followed by intervals of 1 and 6 days after which the interval is
+    multiplied by the ease of the card. The ease is adjusted after each
+    retrieval using the quality values of successful and failed
+    retrievals (0-5).
+    """
+    name = "sm2"
+
+    def __init__(self, initial_ease=2.5, min_ease=1.3, success_quality=4, failure_quality=1,
+                 max_interval=RETIRED_INTERVAL_DAYS):
+        self.initial_ease = initial_ease
+        self.min_ease = min_ease
+        self.success_ease_delta = self.get_ease_delta(success_quality)
+        self.failure_ease_delta = self.get_ease_delta(failure_quality)
+        self.max_interval = max_interval
+
+    @staticmethod
+    def get_ease_delta(quality):
+        return 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+
+    def review(self, state, retrieved, ops=ScalarOps):
+        next_bin = state.spacing_bin + 1
+
+        next_interval = ops.where(next_bin == 2, 1.0,
+                                  ops.where(next_bin == 3, 6.0, state.interval * state.ease))
+        next_interval = ops.minimum(next_interval, self.max_interval)
+
+        ease = state.ease + ops.where(retrieved, self.success_ease_delta, self.failure_ease_delta)
+
+        return ScheduleState(spacing_bin=ops.where(retrieved, next_bin, 1),
+                             ease=ops.maximum(ease, self.min_ease),
+                             interval=ops.where(retrieved, next_interval, 1.0),
+                             retired=state.retired)
+
+
+class ExponentialScheduler(Scheduler):
+    """
+    The interval after n consecutive successful retrievals is
+    base_days * growth^(n - 1) (up to max_days). A failed retrieval
+    is followed by an interval of failure_days.
+    """
+    name = "exponential"
+
+    def __init__(self, base_days=1.0, growth=2.5, failure_days=1.0, max_days=RETIRED_INTERVAL_DAYS):
+        self.base_days = base_days
+        self.growth = growth
+        self.failure_days = failure_days
+        self.max_days = max_days
+
+    def review(self, state, retrieved, ops=ScalarOps):
+        next_bin = state.spacing_bin + 1
+
+        next_interval = self.base_days * ops.power(float(self.growth), next_bin - 2)
+        next_interval = ops.minimum(next_interval, self.max_days)
+
+        return ScheduleState(spacing_bin=ops.where(retrieved, next_bin, 1),
+                             ease=state.ease,
+                             interval=ops.where(retrieved, next_interval, self.failure_days),
+                             retired=state.retired)
+
+
+SCHEDULERS = {
+    FixedBinScheduler.name: FixedBinScheduler,
+    SM2Scheduler.name: SM2Scheduler,
+    ExponentialScheduler.name: ExponentialScheduler
+}
+
+
+def create_scheduler(name, parameters={}):
+    """
+    Returns a new scheduler or raises a ValueError if the
+    name or any of the parameters are not recognized.
+    """
+    if name not in SCHEDULERS:
+        raise ValueError("Unknown scheduler: " + str(name))
+
+    try:
+        return SCHEDULERS[name](**parameters)
+    except TypeError as err:
+        raise ValueError("Invalid scheduler parameters: " + str(err))
+
+
+def get_user_scheduler(user):
+    """
+    Returns the scheduler of the user. The scheduler is created once
+    per user object (ie. once per request for request.user) and the
+    setting is not loaded again if the user was selected with it
+    (select_related('user__schedulersetting')).
+    """
+    card_scheduler = getattr(user, '_card_scheduler', None)
+    if card_scheduler is not None:
+        return card_scheduler
+
+    try:
+        setting = user.schedulersetting
+    except SchedulerSetting.DoesNotExist:
+        setting = None
+
+    if setting is None:
+        card_scheduler = create_scheduler(DEFAULT_SCHEDULER_NAME)
+    else:
+        card_scheduler = create_scheduler(setting.name, json.loads(setting.parameters))
+
+    user._card_scheduler = card_scheduler
+    return card_scheduler
+
+
+def get_card_states(card_scheduler, cards):
+    """
+    Returns a dictionary containing the current schedule state of each
+    of the cards (by card id). The retrieval histories of all of the
+    cards are loaded with a single query if they are needed.
+    """
+    if not card_scheduler.replays_history:
+        return {card.pk: card_scheduler.get_card_state(card) for card in cards}
+
+    states = {card.pk: card_scheduler.get_initial_state(card) for card in cards}
+
+    retrieval_attempts = RetrievalAttempt.objects.filter(card_id__in=list(states.keys())) \
+                                                 .order_by('card_id', 'retrieval_date', 'id') \
+                                                 .values_list('card_id', 'retrieved')
+
+    for card_id, retrieved in retrieval_attempts:
+        states[card_id] = card_scheduler.review(states[card_id], retrieved)
+
+    return states
+
+
+def apply_state(card, state, retrieval_date):
+    card.spacing_bin = int(state.spacing_bin)
+    card.next_retrieval_date = retrieval_date + timedelta(days=float(state.interval))
+    card.active = not bool(state.retired)
+
+
+def review_card(card_scheduler, card, state, retrieved, retrieval_date):
+    """
+    Schedules the next retrieval of the card after a retrieval attempt.
+    Returns the new (unsaved) retrieval attempt and the new state of
+    the card. The card is updated but not saved.
+    """
+    retrieval_attempt = RetrievalAttempt(
+        card=card,
+        retrieval_date=retrieval_date,
+        retrieved=retrieved,
+        spacing_bin=card.spacing_bin)
+
+    state = card_scheduler.review(state, retrieved)
+    apply_state(card, state, retrieval_date)
+
+    return (retrieval_attempt, state)
+
+
+def replay_histories(card_scheduler, initial_states, card_positions, retrieved, timestamps):
+    """
+    Applies the retrieval attempts (sorted by card and date) to the
+    initial states of the cards. card_positions contains the index of
+    the card of each retrieval attempt. Returns the final states and
+    the timestamps of the last retrieval attempt of each card.
+    """
+    states = list(initial_states)
+    last_timestamps = [0.0] * len(states)
+
+    for position, attempt_retrieved, timestamp in zip(card_positions, retrieved, timestamps):
+        states[position] = card_scheduler.review(states[position], attempt_retrieved)
+        last_timestamps[position] = timestamp
+
+    return (states, last_timestamps)
+
+
+def replay_histories_vectorized(card_scheduler, initial_states, card_positions, retrieved, timestamps):
+    """
+    Vectorized version of replay_histories. The retrieval attempts are
+    arranged in a matrix with a row per card and the n-th attempt of
+    every card is applied at once so the number of (numpy) steps is the
+    length of the longest history instead of the number of attempts.
+    """
+    num_cards = len(initial_states)
+
+    card_positions = numpy.asarray(card_positions, dtype=numpy.int64)
+    counts = numpy.bincount(card_positions, minlength=num_cards)
+    ranks = numpy.arange(len(card_positions)) - (numpy.cumsum(counts) - counts)[card_positions]
+    max_length = int(counts.max()) if num_cards > 0 else 0
+
+    retrieved_matrix = numpy.zeros((num_cards, max_length), dtype=bool)
+    retrieved_matrix[card_positions, ranks] = retrieved
+
+    timestamp_matrix = numpy.zeros((num_cards, max_length))
+    timestamp_matrix[card_positions, ranks] = timestamps
+
+    state = ScheduleState(*[numpy.array(values) for values in zip(*initial_states)]) \
+        if num_cards > 0 else None
+    last_timestamps = numpy.zeros(num_cards)
+
+    for index in range(max_length):
+        mask = index < counts
+        reviewed_state = card_scheduler.review(state, retrieved_matrix[:, index], NumpyOps)
+
+        state = ScheduleState(*[numpy.where(mask, new_values, values)
+                                for new_values, values in zip(reviewed_state, state)])
+        last_timestamps = numpy.where(mask, timestamp_matrix[:, index], last_timestamps)
+
+    states = [ScheduleState(*values) for values in zip(*state)] if num_cards > 0 else []
+    return (states, last_timestamps.tolist())
+
+
+def update_card_schedules(cards):
+    """
+    Saves the spacing bins, next retrieval dates and active states of
+    the cards with one UPDATE statement per UPDATE_BATCH_SIZE cards.
+    """
+    Card.objects.bulk_update(cards, ['spacing_bin', 'next_retrieval_date', 'active'],
+                             batch_size=UPDATE_BATCH_SIZE)
+
+
+def reschedule_cards(card_scheduler, cards, chunk_size=RESCHEDULE_CHUNK_SIZE, vectorized=True):
+    """
+    Recomputes the spacing bins, next retrieval dates and active states
+    of the cards by replaying their retrieval histories (for example
+    after a user switches schedulers). The cards are processed in chunks
+    of chunk_size with one retrieval attempt query and one batch of
+    updates per chunk. Cards without retrieval attempts are not changed.
+    numpy is used to replay the histories if it is available and
+    vectorized is True.
+
+    Schedulers which do not replay the history use the state stored
+    with the cards so none of the cards are changed.
+
+    Returns a list containing the uuids of the rescheduled cards.
+    """
+    if not card_scheduler.replays_history:
+        return []
+
+    replay = replay_histories
+    if vectorized and (numpy is not None):
+        replay = replay_histories_vectorized
+
+    rescheduled_uuids = []
+    last_card_id = 0
+
+    while True:
+        chunk = list(cards.filter(id__gt=last_card_id)
+                          .order_by('id')
+                          .only('id', 'uuid', 'spacing_bin', 'next_retrieval_date', 'active')[:chunk_size])
+        if len(chunk) == 0:
+            break
+
+        last_card_id = chunk[-1].id
+        positions = {card.pk: position for position, card in enumerate(chunk)}
+
+        # Filtered with a range (instead of a list of
+        # ids) to keep the number of query parameters low
+        retrieval_attempts = RetrievalAttempt.objects.filter(card__in=cards.values('id'),
+                                                             card_id__gte=chunk[0].id,
+                                                             card_id__lte=last_card_id) \
+                                                     .order_by('card_id', 'retrieval_date', 'id') \
+                                                     .values_list('card_id', 'retrieval_date', 'retrieved')
+
+        card_positions = []
+        retrieved = []
+        timestamps = []
+
+        for card_id, retrieval_date, attempt_retrieved in retrieval_attempts:
+            card_positions.append(positions[card_id])
+            retrieved.append(attempt_retrieved)
+            timestamps.append(retrieval_date.timestamp())
+
+        initial_states = [card_scheduler.get_initial_state(card) for card in chunk]
+        states, last_timestamps = replay(card_scheduler, initial_states, card_positions, retrieved, timestamps)
+
+        rescheduled_positions = sorted(set(card_positions))
+        rescheduled_cards = []
+
+        for position in rescheduled_positions:
+            card = chunk[position]
+            retrieval_date = datetime.fromtimestamp(last_timestamps[position], tz=timezone.utc)
+
+            apply_state(card, states[position], retrieval_date)
+            rescheduled_cards.append(card)
+            rescheduled_uuids.append(card.uuid)
+
+        update_card_schedules(rescheduled_cards)
+
+    return rescheduled_uuids
@@ -0,0 +1,214 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.db import connection, connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Q, FloatField
+from django.db.models.expressions import RawSQL
+
+import re
+
+
+# Full text search over the title, query and answer of the cards.
+#
+# PostgreSQL: a GIN index on the tsvector expression below is created
+#     by migration 0003. The expression is computed from the card row
+#     itself so the index is always in sync with the card contents.
+#
+# SQLite: the notecards_card_fts FTS5 table (created by migration
+#     0003) indexes the card contents. It is an external content
+#     table which is kept in sync by triggers on notecards_card so
+#     every insert, update and delete (including bulk imports and
+#     PATCH requests) updates the index. SQLite migrations which alter
+#     notecards_card rebuild the table (which drops the triggers) so
+#     the triggers are created again by restore_search_index() after
+#     every migrate command (connected to the post_migrate signal).
+#
+# Other databases (or SQLite builds without FTS5) fall back to
+# unindexed substring matching which does not rank the results.
+
+FTS_TABLE_NAME = "notecards_card_fts"
+
+POSTGRES_TSVECTOR = "to_tsvector('english', title || ' ' || query || ' ' || answer)"
+
+SQLITE_CREATE_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS notecards_card_fts USING fts5(
+           title, query, answer,
+           content='notecards_card', content_rowid='id',
+           tokenize='porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS notecards_card_fts_ai AFTER INSERT ON notecards_card BEGIN
+           INSERT INTO notecards_card_fts(rowid, title, query, answer)
+           VALUES (new.id, new.title, new.query, new.answer);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS notecards_card_fts_ad AFTER DELETE ON notecards_card BEGIN
+           INSERT INTO notecards_card_fts(notecards_card_fts, rowid, title, query, answer)
+           VALUES ('delete', old.id, old.title, old.query, old.answer);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS notecards_card_fts_au AFTER UPDATE OF title, query, answer ON notecards_card BEGIN
+           INSERT INTO notecards_card_fts(notecards_card_fts, rowid, title, query, answer)
+           VALUES ('delete', old.id, old.title, old.query, old.answer);
+           INSERT INTO notecards_card_fts(rowid, title, query, answer)
+           VALUES (new.id, new.title, new.query, new.answer);
+       END""",
+    "INSERT INTO notecards_card_fts(notecards_card_fts) VALUES ('rebuild')",
+]
+
+SQLITE_TRIGGER_NAMES = ["notecards_card_fts_ai", "notecards_card_fts_ad", "notecards_card_fts_au"]
+
+SQLITE_DROP_STATEMENTS = [
+    "DROP TRIGGER IF EXISTS notecards_card_fts_ai",
+    "DROP TRIGGER IF EXISTS notecards_card_fts_ad",
+    "DROP TRIGGER IF EXISTS notecards_card_fts_au",
+    "DROP TABLE IF EXISTS notecards_card_fts",
+]
+
+POSTGRES_CREATE_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS notecards_card_search_idx ON notecards_card USING GIN ({})".format(POSTGRES_TSVECTOR),
+]
+
+POSTGRES_DROP_STATEMENTS = [
+    "DROP INDEX IF EXISTS notecards_card_search_idx",
+]
+
+
+def get_search_terms(text):
+    return re.findall(r'\w+', text)
+
+
+def create_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        statements = POSTGRES_CREATE_STATEMENTS
+
+    elif vendor == 'sqlite' and sqlite_supports_fts5(schema_editor.connection):
+        statements = SQLITE_CREATE_STATEMENTS
+
+    else:
+        statements = []
+
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        statements = POSTGRES_DROP_STATEMENTS
+
+    elif vendor == 'sqlite':
+        statements = SQLITE_DROP_STATEMENTS
+
+    else:
+        statements = []
+
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def restore_search_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Creates the SQLite search index triggers again (and rebuilds the
+    index) if a migration rebuilt the card table. Does nothing if the
+    triggers exist or if the search index was not created by migration
+    0003. Connected to the post_migrate signal.
+    """
+    db_connection = connections[using]
+
+    if db_connection.vendor != 'sqlite':
+        return
+
+    if FTS_TABLE_NAME not in db_connection.introspection.table_names():
+        return
+
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'notecards_card'")
+        trigger_names = set([row[0] for row in cursor.fetchall()])
+
+        if trigger_names.issuperset(SQLITE_TRIGGER_NAMES):
+            return
+
+        with transaction.atomic(using=using):
+            for statement in SQLITE_CREATE_STATEMENTS:
+                cursor.execute(statement)
+
+
+def sqlite_supports_fts5(db_connection):
+    with db_connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+# Whether the FTS table exists, per database. The table is created by
+# migration 0003 so the tables are only listed once per process.
+fts_tables = {}
+
+
+def has_fts_table():
+    key = (connection.alias, connection.settings_dict['NAME'])
+
+    if key not in fts_tables:
+        fts_tables[key] = FTS_TABLE_NAME in connection.introspection.table_names()
+
+    return fts_tables[key]
+
+
+def filter_cards_by_text(cards, text, ranked=False):
+    """
+    Returns the cards whose title, query or answer contain all of the
+    words in text (each word also matches as a prefix). If ranked is
+    True the returned queryset is annotated with a `search_rank` value
+    where a lower value is a better match.
+    """
+    terms = get_search_terms(text)
+    if len(terms) == 0:
+        return cards
+
+    # The conditions are added with extra() since a RawSQL value used
+    # with an __in lookup is wrapped in a second set of parentheses
+    # which SQLite interprets as a list containing a single value.
+    if connection.vendor == 'postgresql':
+        tsquery = " & ".join([term + ":*" for term in terms])
+
+        # Matches the expression of the GIN index
+        cards = cards.extra(
+            where=["{} @@ to_tsquery('english', %s)".format(POSTGRES_TSVECTOR)],
+            params=[tsquery])
+
+        if ranked:
+            # ts_rank is higher for better matches so it is negated
+            cards = cards.annotate(search_rank=RawSQL(
+                "-ts_rank({}, to_tsquery('english', %s))".format(POSTGRES_TSVECTOR),
+                [tsquery], output_field=FloatField()))
+
+    elif connection.vendor == 'sqlite' and has_fts_table():
+        # Quote each of the terms so they are not
+        # interpreted as part of the FTS5 query syntax
+        match = " ".join(['"' + term + '"*' for term in terms])
+
+        if ranked:
+            # Joining the search table (rather than using a correlated
+            # subquery for the rank) only evaluates the match once
+            cards = cards.extra(
+                select={'search_rank': "bm25(notecards_card_fts)"},
+                tables=["notecards_card_fts"],
+                where=["notecards_card_fts.rowid = notecards_card.id",
+                       "notecards_card_fts MATCH %s"],
+                params=[match])
+
+        else:
+            cards = cards.extra(
+                where=["notecards_card.id IN (SELECT rowid FROM notecards_card_fts "
+                       "WHERE notecards_card_fts MATCH %s)"],
+                params=[match])
+
+    else:
+        for term in terms:
+            cards = cards.filter(Q(title__icontains=term) |
+                                 Q(query__icontains=term) |
+                                 Q(answer__icontains=term))
+
+        if ranked:
+            cards = cards.annotate(search_rank=RawSQL("0", [], output_field=FloatField()))
+
+    return cards
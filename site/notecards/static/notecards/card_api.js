@@ -85,11 +85,25 @@ const CardApi = (function() {
             result.tags_filter = String(filter.tagsFilter);
         }
 
+        if ('tagsMatch' in filter)
+        {
+            let value = Number(filter.tagsMatch);
+            if (Number.isSafeInteger(value))
+            {
+                result.tags_match = value;
+            }
+        }
+
         if ('titleFilter' in filter)
         {
             result.title_filter = String(filter.titleFilter);
         }
 
+        if ('textFilter' in filter)
+        {
+            result.text_filter = String(filter.textFilter);
+        }
+
         if ('cardsPerPage' in filter)
         {
             let value = Number(filter.cardsPerPage);
@@ -153,6 +167,15 @@ const CardApi = (function() {
     }
 
 
+    function parseCardList(text)
+    {
+        var result = JSON.parse(text);
+        result.cards.forEach(card => enhanceCardObject(card));
+
+        return result;
+    }
+
+
     function getCards(filter, retrievedEventListener)
     {
         var filter = sanitizeFilter(filter);
@@ -172,10 +195,7 @@ const CardApi = (function() {
             xhr.addEventListener("load", function() {
                 if (retrievedEventListener !== undefined)
                 {
-                    var result = JSON.parse(this.responseText);
-                    result.cards.forEach(card => enhanceCardObject(card));
-
-                    retrievedEventListener(result);
+                    retrievedEventListener(parseCardList(this.responseText));
                 }
             });
 
@@ -506,12 +526,13 @@ const CardApi = (function() {
         var xhr = createXhrRequest();
 
         xhr.addEventListener("load", function() {
-            if (this.status == 200)
+            if (this.status == 202)
             {
-                if (importedEventListener !== undefined)
-                {
-                    importedEventListener();
-                }
+                // The archive is imported in the background
+                // so poll the task until it has finished.
+                var task = JSON.parse(this.responseText);
+                var link = task.links.find(link => link.rel == 'self');
+                pollCardArchiveImportTask(task, link.href, importedEventListener);
             }
             else
             {
@@ -524,6 +545,44 @@ const CardApi = (function() {
     }
 
 
+    function pollCardArchiveImportTask(task, taskUrl, importedEventListener)
+    {
+        if ((task.status == 'completed') || (task.status == 'failed'))
+        {
+            if (task.status == 'failed')
+            {
+                console.log(task.message);
+            }
+
+            if (importedEventListener !== undefined)
+            {
+                importedEventListener(task);
+            }
+
+            return;
+        }
+
+        setTimeout(function() {
+            var xhr = createXhrRequest();
+
+            xhr.addEventListener("load", function() {
+                if (this.status == 200)
+                {
+                    var task = JSON.parse(this.responseText);
+                    pollCardArchiveImportTask(task, taskUrl, importedEventListener);
+                }
+                else
+                {
+                    console.log(this.responseText);
+                }
+            });
+
+            xhr.open("GET", taskUrl);
+            xhr.send();
+        }, 1000);
+    }
+
+
     function advanceReviewDate(numDays, filter, advancedEventListener)
     {
         var xhr = createXhrRequest();
@@ -657,6 +716,10 @@ const CardApi = (function() {
         {
             getCards(filter, retrievedEventListener);
         },
+        parseCardList: function(text)
+        {
+            return parseCardList(text);
+        },
         abortPendingRequests: function()
         {
             abortPendingRequests();
@@ -75,6 +75,24 @@ const cardList = (function() {
     };
 
 
+    function createQuerySnippet(html, urlMap)
+    {
+        // The content of a template is inert so the images are
+        // only loaded after their file urls have been resolved.
+        var template = document.createElement('template');
+        template.innerHTML = html;
+
+        template.content.querySelectorAll('img[src^="@"], a[href^="@"]').forEach(element => {
+            var attributeName = (element.tagName === 'IMG') ? 'src' : 'href';
+            var key = element.getAttribute(attributeName).substring(1);
+
+            element.setAttribute(attributeName, urlMap.hasOwnProperty(key) ? urlMap[key] : "#");
+        });
+
+        return template.content;
+    }
+
+
     function createRow(card)
     {
         var row = createElement('tr', {});
@@ -92,7 +110,10 @@ const cardList = (function() {
             card.files.forEach(file => {urlMap[file.name] = file.url});
 
             var element = createElement('div', {class:"query-snippet"});
-            element.innerHTML = md.render(card.query, {urlMap: urlMap});
+
+            // Cards contain the rendered snippet if the server could render it
+            if (card.query_html) element.appendChild(createQuerySnippet(card.query_html, urlMap));
+            else element.innerHTML = md.render(card.query, {urlMap: urlMap});
 
             cell.appendChild(element);
         }
@@ -157,23 +178,35 @@ const cardList = (function() {
         reset();
 
         CardApi.abortPendingRequests();
-        CardApi.getCards(filter, function(result)
-        {
-            cards = result.cards;
-            pageInfo = result.page_info;
+        CardApi.getCards(filter, showCards);
+    }
 
-            for (var i=0; i < cards.length; i++)
-            {
-                var row = createRow(cards[i]);
-                tableBodyElement.appendChild(row);
-            }
 
-            processCGraphElements();
+    function show(result)
+    {
+        reset();
 
-            MathJax.Hub.Queue(["Typeset", MathJax.Hub, tableBodyElement]);
+        CardApi.abortPendingRequests();
+        showCards(result);
+    }
 
-            eventListeners.dispatchEvent({type: 'updated'});
-        });
+
+    function showCards(result)
+    {
+        cards = result.cards;
+        pageInfo = result.page_info;
+
+        for (var i=0; i < cards.length; i++)
+        {
+            var row = createRow(cards[i]);
+            tableBodyElement.appendChild(row);
+        }
+
+        processCGraphElements();
+
+        MathJax.Hub.Queue(["Typeset", MathJax.Hub, tableBodyElement]);
+
+        eventListeners.dispatchEvent({type: 'updated'});
     }
 
 
@@ -288,6 +321,7 @@ const cardList = (function() {
     return {
         init: function(tableBodyElement) { init(tableBodyElement); },
         update: function(json) { update(json); },
+        show: function(result) { show(result); },
         pageInfo: {
             get numCards() { return pageInfo.num_cards; },
             get totalNumCards() { return pageInfo.total_num_cards; },
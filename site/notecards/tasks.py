@@ -0,0 +1,186 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from notecards.models import CardArchiveImportTask
+from notecards import utils
+
+import json
+import threading
+
+
+# Long running tasks (ie. card archive imports) are stored in the
+# database and processed by a pool of worker threads which run in
+# the web server process. No external message broker is required.
+# The number of threads is set with NOTECARDS_TASK_WORKERS. If it
+# is set to 0 the tasks are run synchronously when they are queued.
+#
+# The workers of a process are started by its first request (see
+# NotecardsConfig.ready) and run the tasks which are still queued.
+# Running tasks record a heartbeat after each batch of cards. Tasks
+# whose worker stopped (ie. the server process exited) stop sending
+# heartbeats and are queued again once their last heartbeat is older
+# than NOTECARDS_STALE_TASK_SECONDS.
+
+executor = None
+executor_lock = threading.Lock()
+workers_started = False
+
+
+def get_num_task_workers():
+    return getattr(settings, 'NOTECARDS_TASK_WORKERS', 1)
+
+
+def get_stale_task_timeout():
+    return timedelta(seconds=getattr(settings, 'NOTECARDS_STALE_TASK_SECONDS', 600))
+
+
+def get_executor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=get_num_task_workers(),
+                                          thread_name_prefix="notecards-task")
+
+    return executor
+
+
+def shutdown(wait=True):
+    global executor, workers_started
+
+    with executor_lock:
+        if executor is not None:
+            executor.shutdown(wait=wait)
+            executor = None
+
+        workers_started = False
+
+
+def start_workers(**kwargs):
+    """
+    Runs the queued tasks (and the stale tasks) in the background the
+    first time it is called. Connected to the request_started signal.
+    """
+    global workers_started
+
+    if get_num_task_workers() < 1:
+        return
+
+    with executor_lock:
+        if workers_started:
+            return
+
+        workers_started = True
+
+    get_executor().submit(process_queued_tasks)
+
+
+def enqueue_card_archive_import_task(task):
+    if get_num_task_workers() < 1:
+        run_card_archive_import_task(task.pk)
+
+    else:
+        # Wait for the task to be committed so the worker can see it
+        transaction.on_commit(lambda: get_executor().submit(process_queued_tasks))
+
+
+def requeue_stale_tasks():
+    """
+    Queues the running tasks whose last heartbeat is older than
+    the stale task timeout again. Returns the number of tasks.
+    """
+    cutoff_date = timezone.now() - get_stale_task_timeout()
+    stale_tasks = CardArchiveImportTask.objects.filter(status=CardArchiveImportTask.STATUS_RUNNING,
+                                                       heartbeat_date__lt=cutoff_date)
+
+    # Checked first so there is no write unless there are stale tasks
+    if not stale_tasks.exists():
+        return 0
+
+    return stale_tasks.update(status=CardArchiveImportTask.STATUS_QUEUED,
+                              start_date=None,
+                              heartbeat_date=None)
+
+
+def process_queued_tasks():
+    """
+    Runs all of the queued tasks (oldest first). This also picks up
+    tasks which were queued by a server process which exited before
+    the tasks could be run and the stale tasks of a server process
+    which exited while they were running.
+    """
+    try:
+        requeue_stale_tasks()
+
+        while True:
+            task_ids = CardArchiveImportTask.objects.filter(status=CardArchiveImportTask.STATUS_QUEUED) \
+                                                    .order_by('creation_date', 'id') \
+                                                    .values_list('id', flat=True)[:1]
+            if len(task_ids) == 0:
+                break
+
+            run_card_archive_import_task(task_ids[0])
+
+    finally:
+        # Worker threads get their own database connection
+        connection.close()
+
+
+def claim_task(task_id):
+    # Only one worker can move the task from queued to running
+    now = timezone.now()
+    num_updated = CardArchiveImportTask.objects.filter(pk=task_id,
+                                                      status=CardArchiveImportTask.STATUS_QUEUED) \
+                                              .update(status=CardArchiveImportTask.STATUS_RUNNING,
+                                                      start_date=now,
+                                                      heartbeat_date=now)
+    if num_updated == 0:
+        return None
+
+    return CardArchiveImportTask.objects.get(pk=task_id)
+
+
+def run_card_archive_import_task(task_id):
+    task = claim_task(task_id)
+    if task is None:
+        return
+
+    def update_progress(summary):
+        task.heartbeat_date = timezone.now()
+
+        CardArchiveImportTask.objects.filter(pk=task.pk).update(
+            num_cards_processed=summary['num_cards_processed'],
+            num_cards_imported=summary['num_cards_imported'],
+            num_cards_conflicted=summary['num_cards_conflicted'],
+            heartbeat_date=task.heartbeat_date)
+
+        task.num_cards_processed = summary['num_cards_processed']
+        task.num_cards_imported = summary['num_cards_imported']
+        task.num_cards_conflicted = summary['num_cards_conflicted']
+        task.errors = json.dumps(summary['errors'])
+
+    try:
+        with task.archive_file.open('rb') as archive_file:
+            # Commit each batch so the progress can be polled
+            summary = utils.import_card_archive(archive_file, task.user,
+                                                single_transaction=False,
+                                                progress_callback=update_progress)
+        update_progress(summary)
+        task.status = CardArchiveImportTask.STATUS_COMPLETED
+
+    except Exception as err:
+        task.status = CardArchiveImportTask.STATUS_FAILED
+        task.message = str(err)[:256]
+
+    finally:
+        task.archive_file.delete(save=False)
+
+    task.completion_date = timezone.now()
+    task.save()
@@ -5,6 +5,11 @@ from django import urls
 from django.test import tag
 from django.utils import dateparse
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from notecards.models import Card
+from notecards import utils as nc_utils
 
 from datetime import timedelta
 
@@ -70,7 +75,8 @@ class AdvanceReviewDateTasksApiTests(utils.CardApiTestCase):
         }
         ```
 
-        A successfull post returns a 200 response code.
+        A successfull post returns a 200 response code and the number
+        of cards which were updated in the `num_cards_updated` field.
         """
         utils.login(self)
 
@@ -88,6 +94,7 @@ class AdvanceReviewDateTasksApiTests(utils.CardApiTestCase):
 
         response = utils.post_json(self, 'notecards-api-advance-review-date-tasks', request_body)
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['num_cards_updated'], 1)
 
         # Advance the expected value next_retrieval_date
         # by the specified amount of days
@@ -156,3 +163,54 @@ class AdvanceReviewDateTasksApiTests(utils.CardApiTestCase):
         content = json.loads(response.content)
         utils.assertCardListsMatch(self, content['cards'], card_objects)
 
+
+    def test_post_with_tags_filter_updates_cards_with_a_single_query(self):
+        """
+        Method: POST
+        All of the filtered cards are updated with a single database
+        update (instead of one update per card). Cards which match more
+        than one of the tags in the `tags_filter` are only advanced once.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        for card_obj in card_objects:
+            card_obj['tags'] = []
+
+        user = utils.get_user()
+        tags = nc_utils.import_tags_from_list([{'label': 'math'}, {'label': 'mathematics'}], user)
+        for card_obj in card_objects[:2]:
+            card = Card.from_uuid(card_obj['uuid'], user)
+            card.tags.add(*tags)
+            card_obj['tags'] = [{'label': tag.label} for tag in tags]
+
+        num_days = 5
+
+        request_body = {
+            'num_days': num_days,
+            'filter': {
+                'tags_filter': "math",
+                'tags_match': 2,
+                'review_status': 1
+            }
+        }
+
+        with CaptureQueriesContext(connection) as context:
+            response = utils.post_json(self, 'notecards-api-advance-review-date-tasks', request_body)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['num_cards_updated'], 2)
+
+        update_queries = [q for q in context.captured_queries if q['sql'].startswith('UPDATE "notecards_card" ')]
+        self.assertEqual(len(update_queries), 1)
+
+        for card_obj in card_objects[:2]:
+            next_retrieval_date = dateparse.parse_datetime(card_obj['next_retrieval_date'])
+            next_retrieval_date += timedelta(days=num_days)
+            card_obj['next_retrieval_date'] = json.loads(
+                json.dumps(next_retrieval_date, cls=DjangoJSONEncoder)
+            )
+
+        response = self.client.get(urls.reverse('notecards-api-cards'), {'review_status': 1})
+        content = json.loads(response.content)
+        utils.assertCardListsMatch(self, content['cards'], card_objects)
@@ -4,9 +4,15 @@
 from django.test import tag
 from django import urls
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from notecards.models import Card, FileAttachment
+from notecards import utils as nc_utils
 
 from . import utils
 
+import io
 import json
 
 
@@ -135,6 +141,137 @@ class CardApiTests(utils.CardApiTestCase):
         content = json.loads(response.content)
         utils.assertCardListsMatch(self, content['cards'], card_objects)
 
+    def test_card_hash_is_updated_incrementally(self):
+        """
+        Method: PATCH
+        The `sha_512` hash of a card is made up of a digest of the
+        title/query/answer and a digest chain over the file attachment
+        hashes. Patching the text of a card only recomputes the text
+        digest so the file attachments do not have to be queried.
+        """
+        utils.login(self)
+
+        card_obj = utils.get_default_card_objects(1)[0]
+        card_obj['title'] = "title"
+        utils.attach_text_to_card_obj_as_file(card_obj, "file one", "one.txt")
+        utils.attach_text_to_card_obj_as_file(card_obj, "file two", "two.txt")
+
+        card = utils.import_card(card_obj)
+        self.assertEqual(card.sha_512, nc_utils.compute_card_sha_512(card))
+
+        patch_json = json.dumps([{'op': 'replace', 'path': '/title', 'value': "patched title"}])
+        url = urls.reverse('notecards-api-card', kwargs={'card_uuid': card.uuid})
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(url, patch_json, content_type='application/json-patch+json')
+            self.assertEqual(response.status_code, 200)
+
+        queries = [query['sql'] for query in context.captured_queries]
+        update_index = [index for index, sql in enumerate(queries) if sql.startswith('UPDATE')][0]
+
+        for sql in queries[:update_index + 1]:
+            self.assertNotIn("notecards_fileattachment", sql)
+
+        card = Card.objects.get(pk=card.pk)
+        self.assertEqual(card.sha_512, nc_utils.compute_card_sha_512(card))
+        self.assertEqual(json.loads(response.content)['sha_512'], card.sha_512)
+
+        files_url = urls.reverse('notecards-api-card-files', kwargs={'card_uuid': card.uuid})
+        response = self.client.post(files_url, {'file_attachment': io.BytesIO(b"file three")})
+        self.assertEqual(response.status_code, 201)
+
+        card = Card.objects.get(pk=card.pk)
+        self.assertEqual(card.sha_512, nc_utils.compute_card_sha_512(card))
+
+        file_attachment = FileAttachment.objects.filter(card=card).order_by('id')[0]
+        url = urls.reverse('notecards-api-card-file', kwargs={'card_uuid': card.uuid,
+                                                              'file_id': file_attachment.pk})
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, 200)
+
+        card = Card.objects.get(pk=card.pk)
+        self.assertEqual(card.sha_512, nc_utils.compute_card_sha_512(card))
+
+    def test_get_card_with_if_none_match(self):
+        """
+        Method: GET
+        Card responses include a strong `ETag` header which is derived from
+        the card hash, dates, spacing bin, active state and tags. Sending the
+        ETag back in an `If-None-Match` header returns an empty 304 (Not
+        Modified) response if the card has not changed since.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        url = urls.reverse('notecards-api-card', kwargs={'card_uuid': card_objects[0]['uuid']})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b"")
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"other", ' + etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Adding a tag changes the ETag
+        tags_url = urls.reverse('notecards-api-card-tags', kwargs={'card_uuid': card_objects[0]['uuid']})
+        response = self.client.post(tags_url, {'label': "new_tag"}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        patch_json = json.dumps([{'op': 'replace', 'path': '/answer', 'value': "patched"}])
+        response = self.client.patch(url, patch_json, content_type='application/json-patch+json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['answer'], "patched")
+
+    def test_patch_and_delete_with_if_match(self):
+        """
+        Method: PATCH
+        PATCH and DELETE requests with an `If-Match` header are only applied
+        if the header matches the current ETag of the card. Otherwise the card
+        is left unchanged and a 412 (Precondition Failed) response is returned.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        url = urls.reverse('notecards-api-card', kwargs={'card_uuid': card_objects[0]['uuid']})
+
+        etag = self.client.get(url)['ETag']
+
+        patch_json = json.dumps([{'op': 'replace', 'path': '/title', 'value': "first"}])
+        response = self.client.patch(url, patch_json, content_type='application/json-patch+json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        new_etag = response['ETag']
+
+        # The client's copy of the card is out of date
+        patch_json = json.dumps([{'op': 'replace', 'path': '/title', 'value': "second"}])
+        response = self.client.patch(url, patch_json, content_type='application/json-patch+json',
+                                     HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Card.objects.get(uuid=card_objects[0]['uuid']).title, "first")
+
+        response = self.client.delete(url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        utils.assertNumCardsEquals(self, len(card_objects))
+
+        response = self.client.delete(url, HTTP_IF_MATCH=new_etag)
+        self.assertEqual(response.status_code, 200)
+        utils.assertNumCardsEquals(self, len(card_objects) - 1)
+
     def test_last_modified_date_is_set_correctly_when_updating_a_card(self):
         """
         Method: PATCH
@@ -0,0 +1,93 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django import urls
+from django.test import tag
+
+from notecards.models import CardArchiveImportTask
+
+from . import utils
+
+import io
+import json
+
+
+@tag('card-api', 'integration')
+class CardArchiveImportTaskApiTests(utils.CardApiTestCase):
+    """
+    ## /api/v1/card-archive-import-tasks/{task_id}/
+
+    ### GET
+
+    Retrieves the card archive import task specified by {task_id}.
+    The `status` field is one of `queued`, `running`, `completed`
+    or `failed` and the `num_cards_processed`, `num_cards_imported`
+    and `num_cards_conflicted` fields are updated as the import
+    progresses.
+
+    (see GET tests below for details)
+    """
+
+    def create_task(self):
+        utils.add_card_set_1_to_database(self)
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'format': 'archive'})
+        file_like_object = io.BytesIO(b"".join(response.streaming_content))
+
+        response = self.client.post(urls.reverse('notecards-api-card-archive-import-tasks'),
+                                    {'archive_file': file_like_object})
+        self.assertEqual(response.status_code, 202)
+        return response['Location']
+
+    def test_anonymous_users_can_not_view_tasks(self):
+        """
+        Method: GET
+        Anonymous users can not view any card archive import tasks.
+        """
+        utils.login(self)
+        url = self.create_task()
+        utils.logout(self)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 401)
+
+    def test_users_can_only_view_their_own_tasks(self):
+        """
+        Method: GET
+        Tasks can only be viewed by the user who created them. Requesting
+        a task created by another user returns a 404 error.
+        """
+        utils.login(self, utils.test_user1)
+        url = self.create_task()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        utils.logout(self)
+        utils.login(self, utils.test_user2)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_task_reports_progress(self):
+        """
+        Method: GET
+        A finished task contains the number of cards processed, imported
+        and conflicted. The uploaded archive file is removed once the
+        task has finished.
+        """
+        utils.login(self)
+        url = self.create_task()
+
+        response = self.client.get(url)
+        content = json.loads(response.content)
+
+        self.assertEqual(content['status'], 'completed')
+        self.assertEqual(content['num_cards_processed'], 5)
+        self.assertEqual(content['num_cards_imported'], 0)
+        self.assertEqual(content['num_cards_conflicted'], 5)
+        self.assertEqual(len(content['errors']), 5)
+        self.assertTrue(content['completion_date'] is not None)
+
+        task = CardArchiveImportTask.objects.get(pk=content['id'])
+        self.assertFalse(task.archive_file)
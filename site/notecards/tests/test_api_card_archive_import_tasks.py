@@ -2,10 +2,19 @@
 # Licensed under the terms of the MIT license.
 
 from django import urls
-from django.test import tag
+from django.test import tag, override_settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from notecards.models import Card, Tag, CardArchiveImportTask
+from notecards import utils as nc_utils
+from notecards import tasks
+
+from datetime import timedelta
 
 import io
 import json
+import tarfile
 
 from . import utils
 
@@ -21,6 +30,12 @@ class CardArchiveImportTasksApiTests(utils.CardApiTestCase):
     the cards which are contained in a card archive. A card
     archive is generated when cards are exported from the system.
 
+    The archive is imported in the background. The response has a
+    202 status code and contains the task (see
+    /api/v1/card-archive-import-tasks/{task_id}/) whose url is also
+    returned in the Location header. The task can be polled to
+    follow the progress of the import.
+
     (see POST tests below for details)
     """
     def test_anonymous_users_can_not_import_card_archives(self):
@@ -56,11 +71,216 @@ class CardArchiveImportTasksApiTests(utils.CardApiTestCase):
         utils.clear_database()
 
         utils.assertNumCardsEquals(self, 0)
-        self.client.post(urls.reverse('notecards-api-card-archive-import-tasks'),
-                         {'archive_file': file_like_object})
+        response = self.client.post(urls.reverse('notecards-api-card-archive-import-tasks'),
+                                    {'archive_file': file_like_object})
+        self.assertEqual(response.status_code, 202)
         utils.assertNumCardsEquals(self, len(card_objects))
 
+        content = json.loads(response.content)
+        self.assertEqual(content['status'], 'completed')
+        self.assertEqual(content['num_cards_imported'], len(card_objects))
+        self.assertEqual(response['Location'], utils.get_rest_link(content['links'], 'self'))
+
         response = self.client.get(urls.reverse('notecards-api-cards'), {'review_status': 1})
         content = json.loads(response.content)
         utils.assertCardListsMatch(self, content['cards'], card_objects)
 
+
+    def test_post_archive_reports_conflicts(self):
+        """
+        Method: POST
+        The cards in the archive are imported in bulk. Cards whose uuid
+        already exists are not imported and are reported as conflicts.
+        The task contains the number of cards processed, imported
+        and conflicted along with an `errors` list which contains the
+        uuid, status code and message for each card not imported.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(4)
+        for index, card_obj in enumerate(card_objects):
+            card_obj['uuid'] = 'kJOgWtagTqOt0hTfEnswv' + str(index)
+            card_obj['title'] = 'title ' + str(index)
+            card_obj['tags'] = [{'label': 'common'}, {'label': 'tag' + str(index)}]
+            card_obj['retrieval_attempts'] = [
+                {'retrieval_date': '2018-03-03T03:56:18.713Z', 'retrieved': True, 'spacing_bin': 1}
+            ]
+            utils.attach_text_to_card_obj_as_file(card_obj, "text " + str(index), "file.txt")
+
+        archive_bytes = io.BytesIO()
+        tf = tarfile.open(fileobj=archive_bytes, mode='w:gz')
+
+        for card_obj in card_objects:
+            data = json.dumps(card_obj).encode('utf-8')
+            tarinfo = tarfile.TarInfo(name=card_obj['uuid'])
+            tarinfo.size = len(data)
+            tf.addfile(tarinfo=tarinfo, fileobj=io.BytesIO(data))
+
+        tf.close()
+
+        utils.import_card({'uuid': card_objects[1]['uuid'], 'tags': [{'label': 'common'}]})
+        utils.assertNumCardsEquals(self, 1)
+
+        archive_bytes.seek(0)
+        response = self.client.post(urls.reverse('notecards-api-card-archive-import-tasks'),
+                                    {'archive_file': archive_bytes})
+        self.assertEqual(response.status_code, 202)
+
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content)
+        self.assertEqual(content['status'], 'completed')
+        self.assertEqual(content['num_cards_processed'], 4)
+        self.assertEqual(content['num_cards_imported'], 3)
+        self.assertEqual(content['num_cards_conflicted'], 1)
+        self.assertEqual(len(content['errors']), 1)
+        self.assertEqual(content['errors'][0]['uuid'], card_objects[1]['uuid'])
+        self.assertEqual(content['errors'][0]['status'], 409)
+
+        utils.assertNumCardsEquals(self, 4)
+        self.assertEqual(Tag.objects.filter(label='common').count(), 1)
+
+        for index in [0, 2, 3]:
+            url = urls.reverse('notecards-api-card', kwargs={'card_uuid': card_objects[index]['uuid']})
+            response = self.client.get(url, {'format': 'archive'})
+            content = json.loads(response.content)
+
+            utils.assertCardFieldsMatch(self, content, card_objects[index])
+            self.assertEqual(content['files'][0]['data'], card_objects[index]['files'][0]['data'])
+
+            card = Card.from_uuid(card_objects[index]['uuid'], utils.get_user())
+            self.assertEqual(card.sha_512, nc_utils.compute_card_sha_512(card))
+
+    @override_settings(NOTECARDS_ARCHIVE_IMPORT_WORKERS=2)
+    def test_post_archive_with_parallel_decoding(self):
+        """
+        Method: POST
+        When the NOTECARDS_ARCHIVE_IMPORT_WORKERS setting is greater than zero
+        the cards in the archive are decoded (json parsing, base64 decoding
+        and hashing of the file attachments) by a pool of worker processes.
+        The cards are still imported in the same order as in the archive.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(12)
+        for index, card_obj in enumerate(card_objects):
+            card_obj['title'] = 'title ' + str(index)
+            card_obj['tags'] = [{'label': 'tag' + str(index % 3)}]
+            utils.attach_text_to_card_obj_as_file(card_obj, "text " + str(index), "file.txt")
+            utils.import_card(card_obj)
+
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'order_by': 1, 'format': 'archive'})
+        file_like_object = io.BytesIO(b"".join(response.streaming_content))
+
+        expected_hashes = list(Card.objects.order_by('creation_date', 'id').values_list('sha_512', flat=True))
+        utils.clear_database()
+
+        response = self.client.post(urls.reverse('notecards-api-card-archive-import-tasks'),
+                                    {'archive_file': file_like_object})
+        self.assertEqual(response.status_code, 202)
+
+        content = json.loads(response.content)
+        self.assertEqual(content['status'], 'completed')
+        self.assertEqual(content['num_cards_imported'], len(card_objects))
+
+        # Cards are created in archive order
+        self.assertEqual(list(Card.objects.order_by('id').values_list('sha_512', flat=True)),
+                         expected_hashes)
+
+        response = self.client.get(urls.reverse('notecards-api-cards'), {'review_status': 1})
+        content = json.loads(response.content)
+        utils.assertCardListsMatch(self, content['cards'], card_objects, sort_key='title')
+
+
+@tag('card-api', 'integration')
+@override_settings(NOTECARDS_TASK_WORKERS=1)
+class CardArchiveImportTasksWorkerTests(utils.CardApiTransactionTestCase):
+    def tearDown(self):
+        tasks.shutdown()
+        super().tearDown()
+
+    def get_card_archive(self):
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'format': 'archive'})
+        return b"".join(response.streaming_content)
+
+    def test_post_archive_is_imported_by_a_worker_thread(self):
+        """
+        With NOTECARDS_TASK_WORKERS set, the posted archive is imported by
+        a background worker thread once the request has been committed.
+        The task is queued or running until the import has finished.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'format': 'archive'})
+        file_like_object = io.BytesIO(b"".join(response.streaming_content))
+
+        utils.clear_database()
+
+        response = self.client.post(urls.reverse('notecards-api-card-archive-import-tasks'),
+                                    {'archive_file': file_like_object})
+        self.assertEqual(response.status_code, 202)
+
+        content = json.loads(response.content)
+        self.assertTrue(content['status'] in ['queued', 'running', 'completed'])
+
+        # Wait for the worker thread to finish the import
+        tasks.shutdown()
+
+        response = self.client.get(response['Location'])
+        content = json.loads(response.content)
+        self.assertEqual(content['status'], 'completed')
+        self.assertEqual(content['num_cards_processed'], len(card_objects))
+        self.assertEqual(content['num_cards_imported'], len(card_objects))
+        utils.assertNumCardsEquals(self, len(card_objects))
+
+    def test_queued_and_stale_tasks_are_run_when_the_workers_start(self):
+        """
+        The task workers are started by the first request of a process.
+        They run the tasks which are still queued and queue the running
+        tasks without a recent heartbeat (ie. the tasks of a server
+        process which exited during the import) again.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        archive_bytes = self.get_card_archive()
+        utils.clear_database()
+
+        user = utils.get_user()
+        stale_date = timezone.now() - timedelta(hours=1)
+
+        queued_task = CardArchiveImportTask(user=user)
+        queued_task.archive_file.save("queued.car", ContentFile(archive_bytes))
+
+        stale_task = CardArchiveImportTask(user=user, status=CardArchiveImportTask.STATUS_RUNNING,
+                                           start_date=stale_date, heartbeat_date=stale_date)
+        stale_task.archive_file.save("stale.car", ContentFile(archive_bytes))
+
+        running_task = CardArchiveImportTask(user=user, status=CardArchiveImportTask.STATUS_RUNNING,
+                                             start_date=stale_date, heartbeat_date=timezone.now())
+        running_task.archive_file.save("running.car", ContentFile(archive_bytes))
+
+        tasks.shutdown()
+        self.client.get(urls.reverse('notecards-api-tags'))
+
+        # Wait for the worker thread to run the tasks
+        tasks.shutdown()
+
+        queued_task.refresh_from_db()
+        self.assertEqual(queued_task.status, CardArchiveImportTask.STATUS_COMPLETED)
+        self.assertEqual(queued_task.num_cards_imported, len(card_objects))
+
+        stale_task.refresh_from_db()
+        self.assertEqual(stale_task.status, CardArchiveImportTask.STATUS_COMPLETED)
+        self.assertEqual(stale_task.num_cards_processed, len(card_objects))
+        self.assertEqual(stale_task.num_cards_conflicted, len(card_objects))
+
+        running_task.refresh_from_db()
+        self.assertEqual(running_task.status, CardArchiveImportTask.STATUS_RUNNING)
+
+        utils.assertNumCardsEquals(self, len(card_objects))
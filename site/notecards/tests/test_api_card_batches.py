@@ -0,0 +1,241 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django import urls
+from django.test import tag
+from django.core.serializers.json import DjangoJSONEncoder
+
+from notecards.models import FileAttachment
+from notecards import utils as nc_utils
+
+from . import utils
+
+import json
+
+
+@tag('card-api', 'integration')
+class CardBatchesApiTests(utils.CardApiTestCase):
+    """
+    ## /api/v1/card-batches/
+
+    ### POST
+
+    Create many new cards with a single request. The cards are
+    imported in one transaction and the response contains the
+    result of each card (in the same order as the request).
+
+    (see POST tests below for details)
+    """
+
+    def post_ndjson(self, card_objects):
+        lines = [json.dumps(card_obj, cls=DjangoJSONEncoder) for card_obj in card_objects]
+        return self.client.post(urls.reverse('notecards-api-card-batches'),
+                                "\n".join(lines),
+                                content_type='application/x-ndjson')
+
+    def test_anonymous_users_can_not_create_card_batches(self):
+        """
+        Method: POST
+        Anonymous users do not have POST access to this resource.
+        """
+        card_objects = utils.get_default_card_objects(2)
+
+        response = utils.post_json(self, 'notecards-api-card-batches', card_objects)
+        self.assertEqual(response.status_code, 401)
+        utils.assertNumCardsEquals(self, 0)
+
+    def test_post_card_batch(self):
+        """
+        Method: POST
+        The accepted content is either of type `application/json` with
+        an array of card objects (the same objects accepted by
+        `/api/v1/cards/`) or of type `application/x-ndjson` with one
+        card object per line. At most 1000 cards can be sent at a time.
+
+        A successfull post returns a 200 response code. The `results`
+        list contains a `status` for each of the cards: 201 for created
+        cards (along with the `uuid` and a `self` link), 409 for cards
+        whose uuid already exists and 400 for invalid cards (along with
+        a `message`). The valid cards are created even if some of the
+        other cards could not be imported.
+
+        ``` javascript
+        {
+            version: 1,
+            num_cards_imported: 1,
+            results: [
+                {status: 201, uuid: "...", links: [{rel: "self", href: "..."}]},
+                {status: 409, uuid: "...", message: "Card with uuid already exists."}
+            ]
+        }
+        ```
+        """
+        utils.login(self)
+
+        user = utils.get_user()
+        existing_card = nc_utils.import_card(utils.get_default_card_objects(1)[0], user)[1]
+
+        card_objects = utils.get_default_card_objects(4)
+        for index, card_obj in enumerate(card_objects):
+            card_obj['title'] = "batch card {}".format(index)
+
+        utils.attach_text_to_card_obj_as_file(card_objects[0], "file text", "file.txt")
+        card_objects[1]['uuid'] = existing_card.uuid
+        card_objects[2]['files'] = [{'name': "invalid.txt"}]
+
+        response = utils.post_json(self, 'notecards-api-card-batches', card_objects)
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content)
+        self.assertEqual(content['num_cards_imported'], 2)
+        self.assertEqual([result['status'] for result in content['results']], [201, 409, 400, 201])
+        self.assertEqual(content['results'][1]['uuid'], existing_card.uuid)
+
+        for index in [0, 3]:
+            self.assertEqual(utils.get_rest_link(content['results'][index]['links'], 'self'),
+                             '/cards/api/v1/cards/' + content['results'][index]['uuid'])
+
+            url = urls.reverse('notecards-api-card', kwargs={'card_uuid': content['results'][index]['uuid']})
+            response = self.client.get(url, {'format': 'archive'})
+            self.assertEqual(response.status_code, 200)
+            card_obj = json.loads(response.content)
+            utils.assertCardFieldsMatch(self, card_obj, card_objects[index])
+            self.assertEqual(len(card_obj['files']), len(card_objects[index]['files']))
+
+        utils.assertNumCardsEquals(self, 3)
+
+    def test_post_ndjson_card_batch(self):
+        """
+        Method: POST
+        Lines of an `application/x-ndjson` body which are not valid
+        json are reported with a 400 status.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(2)
+
+        response = self.client.post(urls.reverse('notecards-api-card-batches'),
+                                    "\n".join([json.dumps(card_objects[0]), "{invalid", "",
+                                               json.dumps(card_objects[1])]),
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content)
+        self.assertEqual([result['status'] for result in content['results']], [201, 400, 201])
+        self.assertEqual(content['results'][1]['message'], "Invalid json")
+        utils.assertNumCardsEquals(self, 2)
+
+    def test_post_card_batch_with_invalid_field_values(self):
+        """
+        Method: POST
+        Cards with field values which can not be converted (ie. dates
+        which can not be parsed) are reported with a 400 status and a
+        `message`. The other cards of the batch are still created.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(4)
+        card_objects[1]['next_retrieval_date'] = "garbage"
+        card_objects[2]['spacing_bin'] = "x"
+        card_objects[3]['retrieval_attempts'] = [{'retrieval_date': "garbage", 'retrieved': True}]
+
+        response = utils.post_json(self, 'notecards-api-card-batches', card_objects)
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content)
+        self.assertEqual(content['num_cards_imported'], 1)
+        self.assertEqual([result['status'] for result in content['results']], [201, 400, 400, 400])
+        self.assertTrue(all(['message' in result for result in content['results'][1:]]))
+        utils.assertNumCardsEquals(self, 1)
+
+        response = utils.post_json(self, 'notecards-api-cards', card_objects[1])
+        self.assertEqual(response.status_code, 400)
+        utils.assertNumCardsEquals(self, 1)
+
+    def test_post_card_batch_with_invalid_items(self):
+        """
+        Method: POST
+        Cards with null values and cards whose `tags`, `files` or
+        `retrieval_attempts` are not lists of objects are reported with
+        a 400 status and a `message`. The other cards are still created.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(8)
+        card_objects[1]['spacing_bin'] = None
+        card_objects[2]['retrieval_attempts'] = [5]
+        card_objects[3]['tags'] = [5]
+        card_objects[4]['files'] = "abc"
+        card_objects[5]['tags'] = "abc"
+        card_objects[6]['retrieval_attempts'] = [{'retrieval_date': "2019-05-01T10:00:00Z",
+                                                  'retrieved': True, 'spacing_bin': None}]
+        card_objects[7]['active'] = None
+
+        response = utils.post_json(self, 'notecards-api-card-batches', card_objects)
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content)
+        self.assertEqual(content['num_cards_imported'], 1)
+        self.assertEqual([result['status'] for result in content['results']], [201] + [400] * 7)
+        self.assertTrue(all(['message' in result for result in content['results'][1:]]))
+        utils.assertNumCardsEquals(self, 1)
+
+        for card_obj in card_objects[1:]:
+            response = utils.post_json(self, 'notecards-api-cards', card_obj)
+            self.assertEqual(response.status_code, 400)
+
+        utils.assertNumCardsEquals(self, 1)
+
+    def test_post_atomic_card_batch(self):
+        """
+        Method: POST
+        If the `atomic` query parameter is `1` then either all of the
+        cards are created or none of them are. When one of the cards
+        can not be imported the status of the other cards is `424`.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(3)
+        utils.attach_text_to_card_obj_as_file(card_objects[0], "file text", "file.txt")
+        card_objects[2] = "not a card"
+
+        url = urls.reverse('notecards-api-card-batches') + "?atomic=1"
+        response = self.client.post(url, json.dumps(card_objects), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content)
+        self.assertEqual(content['num_cards_imported'], 0)
+        self.assertEqual([result['status'] for result in content['results']], [424, 424, 400])
+        utils.assertNumCardsEquals(self, 0)
+        self.assertEqual(FileAttachment.objects.count(), 0)
+
+        response = self.post_ndjson(card_objects[:2])
+        content = json.loads(response.content)
+        self.assertEqual(content['num_cards_imported'], 2)
+        utils.assertNumCardsEquals(self, 2)
+
+    def test_post_card_batch_with_invalid_body(self):
+        """
+        Method: POST
+        A body which is not a json array (or is larger than the
+        maximum batch size) returns a 400 response code and no
+        cards are created. Other content types return a 415.
+        """
+        utils.login(self)
+
+        response = utils.post_json(self, 'notecards-api-card-batches', utils.get_default_card_objects(1)[0])
+        self.assertEqual(response.status_code, 400)
+
+        card_objects = utils.get_default_card_objects(nc_utils.MAX_CARD_BATCH_SIZE + 1)
+        response = utils.post_json(self, 'notecards-api-card-batches', card_objects)
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(urls.reverse('notecards-api-card-batches'),
+                                    "[", content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(urls.reverse('notecards-api-card-batches'),
+                                    "title", content_type='text/plain')
+        self.assertEqual(response.status_code, 415)
+
+        utils.assertNumCardsEquals(self, 0)
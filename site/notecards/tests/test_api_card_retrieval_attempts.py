@@ -3,6 +3,8 @@
 
 from django.test import tag
 from django import urls
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import dateparse, timezone
 
 from . import utils
@@ -285,3 +287,22 @@ class RetrievalAttemptsApiTests(utils.CardApiTestCase):
         delta = abs(timezone.now() - next_retrieval_date)
         self.assertTrue(delta.days, (365*10 - 1))
 
+    def test_new_retrieval_attempt_loads_the_scheduler_with_the_card(self):
+        """
+        Method: POST
+        The scheduler setting of the user is loaded with the card and
+        the retrieval history is not loaded by the default scheduler.
+        """
+        card = utils.import_card(utils.get_default_card_objects(1)[0])
+        utils.login(self)
+
+        url = urls.reverse('notecards-api-card-retrieval-attempts',
+                           kwargs={'card_uuid': card.uuid})
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, {'success': True}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        for query in context.captured_queries:
+            self.assertNotIn('FROM "notecards_schedulersetting"', query['sql'])
+            self.assertNotIn('FROM "notecards_retrievalattempt"', query['sql'])
@@ -1,17 +1,25 @@
 # Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
 # Licensed under the terms of the MIT license.
 
-from unittest import skip
+from unittest import skip, skipUnless, mock
 
 from django.test import tag
 from django import urls
-from django.db import transaction
+from django.db import transaction, connection
+from django.test.utils import CaptureQueriesContext
+from django.core.serializers.json import DjangoJSONEncoder
+
+from notecards.models import Card, Tag
+from notecards import utils as nc_utils
+from notecards import card_list_cache
+from notecards import card_markdown
 
 from . import utils
 
 import io
 import json
 import tarfile
+import itertools
 
 
 @tag('card-api', 'integration')
@@ -75,6 +83,82 @@ class CardsApiTests(utils.CardApiTestCase):
 
         utils.assertCardListsMatch(self, response_card_list, card_objects)
 
+    def test_get_archive_with_file_attachments(self):
+        """
+        Method: GET
+        The archive is streamed to the client as the cards are serialized.
+        File attachments are read from disk in chunks and base64 encoded
+        in to the `data` field of each file in the card's json data.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(3)
+        for index, card_obj in enumerate(card_objects):
+            card_obj['uuid'] = 'GLhV7iK2Rm6qyOjbPaHIO' + str(index)
+            card_obj['query'] = 'query with "quotes" and unicode \u00e9 ' + str(index)
+
+            for file_index in range(index):
+                # Large enough to span multiple read chunks
+                text = (str(file_index) * 300000) + "end"
+                utils.attach_text_to_card_obj_as_file(card_obj, text, "file{}.txt".format(file_index))
+
+            utils.import_card(card_obj)
+
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'format': 'archive'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        file_like_object = io.BytesIO(b"".join(response.streaming_content))
+        tf = tarfile.open(fileobj=file_like_object, mode='r:gz')
+
+        response_card_list = []
+
+        for tarinfo in tf:
+            obj = json.load(tf.extractfile(tarinfo))
+            response_card_list.append(obj)
+
+        utils.assertCardListsMatch(self, response_card_list, card_objects)
+
+        for obj in response_card_list:
+            expected = [c for c in card_objects if c['uuid'] == obj['uuid']][0]
+            self.assertEqual([f['data'] for f in obj['files']],
+                             [f['data'] for f in expected['files']])
+
+    def test_get_archive_query_count_is_independent_of_number_of_cards(self):
+        """
+        Method: GET
+        When all of the cards are requested (ie. `cards_per_page=0`) the cards
+        are not loaded in to memory all at once. They are streamed from the
+        database in chunks and the related tags, files and retrieval attempts
+        are loaded per chunk so the number of queries needed to create an
+        archive does not depend on the number of cards.
+        """
+        utils.login(self)
+
+        num_queries = []
+
+        for start, count in [(0, 2), (2, 6)]:
+            card_objects = utils.get_default_card_objects(count)
+            for index, card_obj in enumerate(card_objects, start=start):
+                card_obj['tags'] = [{'label': 'tag' + str(index)}]
+                card_obj['retrieval_attempts'] = [{'retrieved': True, 'spacing_bin': 1}]
+                utils.import_card(card_obj)
+
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(urls.reverse('notecards-api-cards'),
+                                           {'review_status': 1, 'page': 1,
+                                            'cards_per_page': 0, 'format': 'archive'})
+
+            self.assertEqual(response.status_code, 200)
+            num_queries.append(len(context.captured_queries))
+
+            file_like_object = io.BytesIO(b"".join(response.streaming_content))
+            tf = tarfile.open(fileobj=file_like_object, mode='r:gz')
+            self.assertEqual(len(tf.getmembers()), start + count)
+
+        self.assertEqual(num_queries[0], num_queries[1])
+
     def test_get_cards_returns_empty_list_for_anonymous_users(self):
         """
         Method: GET
@@ -144,6 +228,615 @@ class CardsApiTests(utils.CardApiTestCase):
         self.assertEqual(len(content['cards']), 1)
         self.assertEqual(content['cards'][0]['uuid'], card_values2['uuid'])
 
+    def test_get_cards_query_count_is_independent_of_page_size(self):
+        """
+        Method: GET
+        The tags, files and retrieval attempts for all of the cards in
+        a page are loaded together so the number of database queries
+        needed to return a list of cards does not depend on the number
+        of cards in the page.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(5)
+        for index, card_obj in enumerate(card_objects):
+            card_obj['tags'] = [{'label': 'tag' + str(index)}, {'label': 'label' + str(index)}]
+            utils.attach_text_to_card_obj_as_file(card_obj, "file text", "file.txt")
+            card_obj['retrieval_attempts'] = [{'retrieved': True, 'spacing_bin': 1}]
+            utils.import_card(card_obj)
+
+        utils.assertNumCardsEquals(self, len(card_objects))
+
+        for card_output_format in ['', 'index']:
+            num_queries = []
+
+            for cards_per_page in [1, len(card_objects)]:
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(urls.reverse('notecards-api-cards'),
+                                               {'review_status': 1,
+                                                'cards_per_page': cards_per_page,
+                                                'format': card_output_format})
+
+                self.assertEqual(response.status_code, 200)
+                content = json.loads(response.content)
+                self.assertEqual(len(content['cards']), cards_per_page)
+
+                for card_obj in content['cards']:
+                    self.assertEqual(len(card_obj['tags']), 2)
+                    self.assertEqual(len(card_obj['files']), 1)
+
+                    if card_output_format == '':
+                        self.assertEqual(len(card_obj['retrieval_attempts']), 1)
+
+                num_queries.append(len(context.captured_queries))
+
+            self.assertEqual(num_queries[0], num_queries[1])
+
+    def test_get_cards_encodes_the_same_values_as_django(self):
+        """
+        Method: GET
+        The card lists are encoded with a faster json encoder when it is
+        available. The encoded cards (including the date formats and the
+        order of the keys) are the same as the ones encoded with the
+        DjangoJSONEncoder.
+        """
+        utils.login(self)
+
+        card_obj = utils.get_default_card_objects(1)[0]
+        card_obj['query'] = "long query " * 20
+        card_obj['tags'] = [{'label': 'tag'}]
+        card_obj['retrieval_attempts'] = [{'retrieved': True, 'spacing_bin': 1}]
+        utils.attach_text_to_card_obj_as_file(card_obj, "file text", "file.txt")
+        utils.import_card(card_obj)
+        utils.add_card_set_1_to_database(self)
+
+        cards = {card.uuid: card for card in Card.objects.all()}
+
+        for card_output_format in ['', 'index', 'links']:
+            response = self.client.get(urls.reverse('notecards-api-cards'),
+                                       {'review_status': 1, 'format': card_output_format})
+            self.assertEqual(response.status_code, 200)
+
+            content = json.loads(response.content)
+            self.assertEqual(len(content['cards']), len(cards))
+
+            for card_obj in content['cards']:
+                expected_card_obj = nc_utils.create_card_object(cards[card_obj['uuid']], card_output_format)
+                expected_card_obj = json.loads(json.dumps(expected_card_obj, cls=DjangoJSONEncoder))
+                self.assertEqual(list(card_obj.items()), list(expected_card_obj.items()))
+
+    def test_get_cards_only_loads_the_columns_of_the_output_format(self):
+        """
+        Method: GET
+        Only the card columns which are part of the output format are
+        loaded from the database. With `format=index` only the first
+        160 characters of the query are loaded (and the answer is not
+        loaded at all). With `format=links` only the uuid is loaded.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(3)
+        card_objects[0]['query'] = "é" * 159
+        card_objects[1]['query'] = "é" * 160
+        card_objects[2]['query'] = "é" * 161
+
+        for card_obj in card_objects:
+            card_obj['answer'] = "answer " * 100
+            utils.import_card(card_obj)
+
+        for card_output_format in ['index', 'links']:
+            for params in [{'page': 1}, {'cursor': ''}]:
+                params.update({'review_status': 1, 'order_by': 1, 'format': card_output_format})
+
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(urls.reverse('notecards-api-cards'), params)
+
+                self.assertEqual(response.status_code, 200)
+
+                # The last card query loads the cards (the ETag
+                # of a page is computed with a separate query)
+                card_query = [q['sql'] for q in context.captured_queries
+                              if q['sql'].startswith('SELECT "notecards_card"."id"')][-1]
+                self.assertFalse('"notecards_card"."answer"' in card_query)
+                self.assertFalse('"notecards_card"."query"' in card_query.split('SUBSTR(')[0])
+
+                content = json.loads(response.content)
+                self.assertEqual(len(content['cards']), 3)
+
+                if card_output_format == 'index':
+                    self.assertEqual([card_obj['query'] for card_obj in content['cards']],
+                                     ["é" * 159, "é" * 160, "é" * 157 + "..."])
+
+                else:
+                    self.assertFalse('"notecards_card"."title"' in card_query)
+                    self.assertEqual([len(card_obj) for card_obj in content['cards']], [3, 3, 3])
+
+    @skipUnless(card_markdown.is_available(), "markdown-it-py is not installed")
+    def test_get_cards_index_format_contains_the_rendered_query_snippet(self):
+        """
+        Method: GET
+        With `format=index` each card contains `query_html`, the html of
+        its (truncated) query rendered from markdown when the card was
+        created, imported or patched. It is `null` if the snippet could
+        not be rendered on the server. File attachment urls (`@name`)
+        are not resolved in the snippet.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(2)
+        card_objects[0]['query'] = "**bold** $$x^2$$ ![image](@file.png)"
+        card_objects[1]['query'] = "*a* " * 100
+
+        card = utils.import_card(card_objects[0])
+        nc_utils.import_cards([card_objects[1]], utils.get_user())
+
+        def get_query_snippets():
+            response = self.client.get(urls.reverse('notecards-api-cards'),
+                                       {'review_status': 1, 'order_by': 1, 'format': 'index'})
+            return [card_obj['query_html'] for card_obj in json.loads(response.content)['cards']]
+
+        query_snippets = get_query_snippets()
+        self.assertEqual(query_snippets[0],
+                         '<p><strong>bold</strong> <span class="tex-inline-equation-container">$$ x^2 $$</span> '
+                         '<img src="@file.png" alt="image"></p>\n')
+        self.assertEqual(query_snippets[1], card_markdown.render(nc_utils.truncate_text(card_objects[1]['query'], 160)))
+
+        url = urls.reverse('notecards-api-card', kwargs={'card_uuid': card.uuid})
+        patch_doc = [{'op': 'replace', 'path': '/query', 'value': "patched *query*"}]
+        response = self.client.patch(url, json.dumps(patch_doc), content_type='application/json-patch+json')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(get_query_snippets()[0], "<p>patched <em>query</em></p>\n")
+
+        # The snippets are only rendered again if the query changed
+        card_markdown.render.cache_clear()
+
+        patch_doc = [{'op': 'replace', 'path': '/title', 'value': "patched title"}]
+        response = self.client.patch(url, json.dumps(patch_doc), content_type='application/json-patch+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(card_markdown.render.cache_info().misses, 0)
+
+    def test_get_cards_with_cursor(self):
+        """
+        Method: GET
+        A GET request with a `cursor` query parameter uses keyset pagination
+        instead of page numbers. An empty cursor returns the first page and
+        the `next` link (and `page_info.next_cursor`) contains the cursor for
+        the following page. The cards are ordered by the `order_by` date and
+        then by card id so each page costs the same to retrieve regardless
+        of how deep into the list it is.
+
+        The total number of cards is not computed in this mode unless the
+        `include_total=1` query parameter is also specified. An invalid
+        cursor, or a cursor combined with an `order_by` other than 0 or 1
+        (ie. ranked text search results), returns a 400 error.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+
+        for order_by, field in [(0, 'next_retrieval_date'), (1, 'creation_date')]:
+            expected_uuids = list(Card.objects.order_by(field, 'id').values_list('uuid', flat=True))
+
+            uuids = []
+            url = urls.reverse('notecards-api-cards')
+            params = {'review_status': 1, 'order_by': order_by,
+                      'cards_per_page': 2, 'cursor': ''}
+
+            while url:
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+
+                content = json.loads(response.content)
+                self.assertTrue(len(content['cards']) <= 2)
+                self.assertFalse('total_num_cards' in content['page_info'])
+
+                uuids.extend([card_obj['uuid'] for card_obj in content['cards']])
+                url = utils.get_rest_link(content['page_info']['links'], 'next')
+                params = {}
+
+            self.assertEqual(uuids, expected_uuids)
+
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'cards_per_page': 2,
+                                    'cursor': '', 'include_total': 1})
+        content = json.loads(response.content)
+        self.assertEqual(content['page_info']['total_num_cards'], len(card_objects))
+        self.assertTrue(content['page_info']['has_next'])
+
+        # An empty text filter is not part of the links
+        next_url = utils.get_rest_link(content['page_info']['links'], 'next')
+        self.assertNotIn('text_filter', next_url)
+
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'cards_per_page': 2,
+                                    'cursor': '', 'text_filter': "answer"})
+        next_url = utils.get_rest_link(json.loads(response.content)['page_info']['links'], 'next')
+        self.assertIn('text_filter=answer', next_url)
+
+        # A cursor created with one ordering can not be used with another
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'order_by': 1, 'cards_per_page': 2,
+                                    'cursor': content['page_info']['next_cursor']})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(urls.reverse('notecards-api-cards'),
+                                   {'review_status': 1, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+        for order_by in [2, 3]:
+            response = self.client.get(urls.reverse('notecards-api-cards'),
+                                       {'review_status': 1, 'order_by': order_by, 'cursor': '',
+                                        'text_filter': "answer"})
+            self.assertEqual(response.status_code, 400)
+
+    def test_get_cards_with_text_filter(self):
+        """
+        Method: GET
+        The `text_filter` query parameter searches the title, query and
+        answer of the cards using the full text search index. A card
+        matches if it contains all of the words in the filter (each word
+        also matches as a prefix and is stemmed, ie. "questions" matches
+        "question"). With `order_by=2` the best matches are returned first.
+
+        The search index is kept up to date when cards are created,
+        imported, updated and deleted.
+        """
+        utils.login(self)
+
+        utils.add_card_set_1_to_database(self)
+
+        def get_titles(params):
+            params.update({'review_status': 1, 'cards_per_page': 0})
+            response = self.client.get(urls.reverse('notecards-api-cards'), params)
+            self.assertEqual(response.status_code, 200)
+
+            content = json.loads(response.content)
+            return sorted([card_obj['title'] for card_obj in content['cards']])
+
+        self.assertEqual(get_titles({'text_filter': "three"}), ["the title three"])
+        self.assertEqual(get_titles({'text_filter': "mathematical questions"}), [])
+        self.assertEqual(get_titles({'text_filter': "math questions"}), ["math five"])
+        self.assertEqual(get_titles({'text_filter': "answ fou"}), ["the title four"])
+        self.assertEqual(get_titles({'text_filter': "the \"answer\" OR*"}), [])
+        self.assertEqual(len(get_titles({'text_filter': "answer"})), 5)
+        self.assertEqual(len(get_titles({'text_filter': " - "})), 5)
+
+        # Updates and deletes are reflected in the search results
+        card = Card.objects.get(title="the title three")
+        card.answer = "xylophone"
+        card.save()
+        nc_utils.record_card_change(card)
+        self.assertEqual(get_titles({'text_filter': "xylophone"}), ["the title three"])
+        self.assertEqual(len(get_titles({'text_filter': "answer"})), 4)
+        self.assertEqual(get_titles({'text_filter': "answer three"}), [])
+
+        nc_utils.delete_card(card)
+        self.assertEqual(get_titles({'text_filter': "xylophone"}), [])
+
+        # The tables are not listed for every search
+        with CaptureQueriesContext(connection) as context:
+            get_titles({'text_filter': "answer"})
+
+        for query in context.captured_queries:
+            self.assertNotIn("sqlite_master", query['sql'])
+
+        # Ranked results
+        for text in ["pendulum", "pendulum pendulum pendulum"]:
+            utils.post_json(self, 'notecards-api-cards',
+                            {'title': text, 'query': text, 'answer': text})
+
+        params = {'text_filter': "pendulum", 'order_by': 2,
+                  'review_status': 1, 'cards_per_page': 0}
+        response = self.client.get(urls.reverse('notecards-api-cards'), params)
+        content = json.loads(response.content)
+
+        self.assertEqual([card_obj['title'] for card_obj in content['cards']],
+                         ["pendulum pendulum pendulum", "pendulum"])
+
+    def test_get_cards_with_tags_filter(self):
+        """
+        Method: GET
+        The `tags_filter` query parameter is a space separated list of tag
+        labels. Only the cards which have all of the tags are returned. By
+        default each label matches the tags which contain it (case
+        insensitive, `tags_match=2`). Exact matching (`tags_match=0`, which
+        uses the tag index and is also case insensitive since tag labels are
+        stored in lowercase) and case insensitive prefix matching
+        (`tags_match=1`) can be requested explicitly.
+        """
+        utils.login(self)
+
+        card_objects = utils.get_default_card_objects(4)
+        card_tags = [["math", "algebra"], ["math", "geometry"], ["mathematics"], ["Algebra"]]
+
+        for index, (card_obj, labels) in enumerate(zip(card_objects, card_tags)):
+            card_obj['title'] = "card {}".format(index)
+            card_obj['tags'] = [{'label': label} for label in labels]
+            utils.import_card(card_obj)
+
+        def get_titles(params):
+            params.update({'review_status': 1, 'cards_per_page': 0})
+            response = self.client.get(urls.reverse('notecards-api-cards'), params)
+            self.assertEqual(response.status_code, 200)
+
+            content = json.loads(response.content)
+            return sorted([card_obj['title'] for card_obj in content['cards']])
+
+        self.assertEqual(get_titles({'tags_filter': "gebra"}), ["card 0", "card 3"])
+        self.assertEqual(get_titles({'tags_filter': "math"}), ["card 0", "card 1", "card 2"])
+        self.assertEqual(get_titles({'tags_filter': "gebra math"}), ["card 0"])
+        self.assertEqual(get_titles({'tags_filter': ""}), ["card 0", "card 1", "card 2", "card 3"])
+
+        def get_exact_titles(params):
+            return get_titles(dict(params, tags_match=0))
+
+        self.assertEqual(get_exact_titles({'tags_filter': "math"}), ["card 0", "card 1"])
+        self.assertEqual(get_exact_titles({'tags_filter': "algebra math"}), ["card 0"])
+        self.assertEqual(get_exact_titles({'tags_filter': "math math"}), ["card 0", "card 1"])
+        self.assertEqual(get_exact_titles({'tags_filter': "Math"}), ["card 0", "card 1"])
+        self.assertEqual(get_exact_titles({'tags_filter': "ALGEBRA math"}), ["card 0"])
+        self.assertEqual(get_exact_titles({'tags_filter': "algebra"}), ["card 0", "card 3"])
+        self.assertEqual(get_exact_titles({'tags_filter': "math unknown"}), [])
+        self.assertEqual(get_exact_titles({'tags_filter': "algebra geometry"}), [])
+        self.assertEqual(get_exact_titles({'tags_filter': ""}), ["card 0", "card 1", "card 2", "card 3"])
+
+        self.assertEqual(get_titles({'tags_filter': "math", 'tags_match': 1}),
+                         ["card 0", "card 1", "card 2"])
+        self.assertEqual(get_titles({'tags_filter': "alg", 'tags_match': 1}), ["card 0", "card 3"])
+        self.assertEqual(get_titles({'tags_filter': "gebra", 'tags_match': 1}), [])
+
+    def test_get_cards_with_tags_filter_query_plan(self):
+        """
+        Method: GET
+        Exact tag matching resolves the labels to tag ids using the unique
+        (user, label) index and then filters the cards with a single grouped
+        subquery on the card/tag table. The number of joins does not grow
+        with the number of labels and the results do not need a distinct().
+        """
+        utils.login(self)
+
+        card_obj = utils.get_default_card_objects(1)[0]
+        card_obj['tags'] = [{'label': "one"}, {'label': "two"}, {'label': "three"}]
+        utils.import_card(card_obj)
+
+        user = utils.get_user()
+        tag_labels = ["one", "two", "three"]
+
+        with CaptureQueriesContext(connection) as context:
+            cards = nc_utils.get_filtered_cards({'tags_filter': " ".join(tag_labels), 'tags_match': 0}, user)
+            self.assertEqual(len(cards), 1)
+
+        self.assertEqual(len(context.captured_queries), 2)
+
+        card_sql = context.captured_queries[1]['sql'].upper()
+        self.assertNotIn("DISTINCT", card_sql)
+        self.assertNotIn("JOIN", card_sql)
+        self.assertIn("HAVING", card_sql)
+
+        tags = Tag.objects.filter(user=user, label__in=tag_labels).values_list('id', flat=True)
+
+        if connection.vendor == 'sqlite':
+            explain = "EXPLAIN QUERY PLAN "
+            detail_column = 3
+        elif connection.vendor == 'postgresql':
+            explain = "EXPLAIN "
+            detail_column = 0
+        else:
+            self.skipTest("No query plan checks for {}".format(connection.vendor))
+
+        def get_query_plan(queryset):
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(explain + sql, params)
+                return "\n".join([str(row[detail_column]) for row in cursor.fetchall()])
+
+        tags_plan = get_query_plan(tags)
+        cards_plan = get_query_plan(cards)
+
+        if connection.vendor == 'sqlite':
+            self.assertIn("notecards_tag_user_id_label", tags_plan)
+            self.assertIn("notecards_card_tags_tag_id", cards_plan)
+            self.assertNotIn("DISTINCT", cards_plan)
+        else:
+            self.assertNotIn("Unique", cards_plan)
+            self.assertRegex(cards_plan, "(Hash|Group)Aggregate")
+
+    def test_get_cards_query_plan_uses_card_indexes(self):
+        """
+        Method: GET
+        The card list queries for every `order_by`, `review_status` and
+        `active` combination are answered from one of the composite
+        (user, ...) card indexes. Unless the cards are restricted to the
+        ones which are due for review (in which case the due date range
+        is used), the index also provides the requested ordering so the
+        cards do not have to be sorted.
+        """
+        utils.login(self)
+
+        utils.add_card_set_1_to_database(self)
+        user = utils.get_user()
+
+        if connection.vendor == 'sqlite':
+            explain = "EXPLAIN QUERY PLAN "
+            detail_column = 3
+            sort_step = "USE TEMP B-TREE FOR ORDER BY"
+        elif connection.vendor == 'postgresql':
+            explain = "EXPLAIN "
+            detail_column = 0
+            sort_step = "Sort"
+        else:
+            self.skipTest("No query plan checks for {}".format(connection.vendor))
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # The test tables are too small for the planner to
+                # choose an index scan over a sequential scan
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+            for order_by, review_status, active in itertools.product([0, 1], [0, 1], [0, 1, 2]):
+                filter_params = {'order_by': order_by, 'review_status': review_status, 'active': active}
+                cards = nc_utils.get_filtered_cards(filter_params, user)
+
+                sql, params = cards.query.sql_with_params()
+                cursor.execute(explain + sql, params)
+                plan = "\n".join([str(row[detail_column]) for row in cursor.fetchall()])
+
+                self.assertRegex(plan, "card_user_(active_next|next|creation)_idx", msg=filter_params)
+
+                if review_status == 1 or order_by == 0:
+                    self.assertNotIn(sort_step, plan, msg=filter_params)
+
+    def test_get_cards_uses_the_card_list_cache(self):
+        """
+        Method: GET
+        Encoded card lists are cached per user, filter parameters and
+        format until the next change to one of the cards of the user
+        (including their tags, files and retrieval attempts). A cached
+        list is returned without loading any of the cards.
+        """
+        utils.login(self)
+
+        utils.add_card_set_1_to_database(self)
+        utils.add_card_set_1_to_database(self, utils.test_user2)
+
+        url = urls.reverse('notecards-api-cards')
+        params = {'review_status': 1, 'cards_per_page': 2, 'page': 1}
+
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(card_list_cache.stats.get_summary(), {'hits': 0, 'misses': 1})
+
+        with CaptureQueriesContext(connection) as context:
+            cached_response = self.client.get(url, params)
+
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+        self.assertEqual(card_list_cache.stats.get_summary(), {'hits': 1, 'misses': 1})
+
+        for query in context.captured_queries:
+            self.assertNotIn('"notecards_card"', query['sql'])
+
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Other formats and filters are cached separately
+        self.client.get(url, dict(params, format='links'))
+        self.client.get(url, dict(params, page=2))
+        self.assertEqual(card_list_cache.stats.get_summary(), {'hits': 2, 'misses': 3})
+
+        # Changes to the cards of other users do not invalidate the cache
+        user2_card = Card.objects.filter(user=utils.get_user(utils.test_user2)).first()
+        nc_utils.record_card_change(user2_card)
+
+        self.client.get(url, params)
+        self.assertEqual(card_list_cache.stats.get_summary(), {'hits': 3, 'misses': 3})
+
+        listed_uuid = json.loads(cached_response.content)['cards'][0]['uuid']
+        patch_url = urls.reverse('notecards-api-card', kwargs={'card_uuid': listed_uuid})
+        patch_json = json.dumps([{'op': 'replace', 'path': '/title', 'value': "new title"}])
+        response = self.client.patch(patch_url, patch_json, content_type='application/json-patch+json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, params)
+        self.assertEqual(card_list_cache.stats.get_summary(), {'hits': 3, 'misses': 4})
+        self.assertEqual(json.loads(response.content)['cards'][0]['title'], "new title")
+
+        # Lists cached with an older format are not used
+        with mock.patch.object(card_list_cache, 'CACHE_FORMAT_VERSION', card_list_cache.CACHE_FORMAT_VERSION + 1):
+            self.client.get(url, params)
+            self.assertEqual(card_list_cache.stats.get_summary(), {'hits': 3, 'misses': 5})
+
+    def test_get_cards_with_if_none_match(self):
+        """
+        Method: GET
+        Card list responses include an `ETag` header which is derived from
+        the listed cards and the page information. Sending the ETag back in
+        an `If-None-Match` header returns an empty 304 (Not Modified) response
+        if none of the cards on the page (and the total number of cards) have
+        changed. The 304 response is created without loading or serializing
+        the full cards.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        url = urls.reverse('notecards-api-cards')
+        params = {'review_status': 1, 'cards_per_page': 2, 'page': 1}
+
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        for query in context.captured_queries:
+            self.assertNotIn('"notecards_card"."answer"', query['sql'])
+
+        # Adding a card changes the total number of cards
+        utils.post_json(self, 'notecards-api-cards', {'title': "new card"})
+
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        listed_uuid = json.loads(response.content)['cards'][0]['uuid']
+        Card.objects.filter(uuid=listed_uuid).update(spacing_bin=9)
+        nc_utils.record_card_changes(utils.get_user().pk, [listed_uuid])
+
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # Cards which are not on the page do not change the ETag
+        other_cards = Card.objects.exclude(uuid__in=[card_obj['uuid'] for card_obj in json.loads(response.content)['cards']])
+        other_uuids = list(other_cards.values_list('uuid', flat=True))
+        other_cards.update(spacing_bin=10)
+        nc_utils.record_card_changes(utils.get_user().pk, other_uuids)
+
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        for params in [{'review_status': 1, 'cards_per_page': 2, 'cursor': ''},
+                       {'review_status': 1, 'text_filter': "answer", 'order_by': 2}]:
+            etag = self.client.get(url, params)['ETag']
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    @skipUnless(card_markdown.is_available(), "markdown-it-py is not installed")
+    def test_get_cards_etag_changes_when_the_query_snippets_are_rendered(self):
+        """
+        Method: GET
+        The card and card list ETags change when the query snippets of
+        the cards are rendered again (ie. by the render_query_snippets
+        command after the markdown renderer was updated).
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        list_url = urls.reverse('notecards-api-cards')
+        card_url = urls.reverse('notecards-api-card', kwargs={'card_uuid': card_objects[0]['uuid']})
+        params = {'review_status': 1, 'cards_per_page': 0, 'format': 'index'}
+
+        list_etag = self.client.get(list_url, params)['ETag']
+        card_etag = self.client.get(card_url)['ETag']
+
+        with mock.patch.object(card_markdown, 'RENDERER_VERSION', card_markdown.RENDERER_VERSION + 1):
+            nc_utils.render_query_snippets(Card.objects.all())
+
+            response = self.client.get(list_url, params, HTTP_IF_NONE_MATCH=list_etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], list_etag)
+
+            response = self.client.get(card_url, HTTP_IF_NONE_MATCH=card_etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], card_etag)
+
     def test_new_card_not_created_when_request_content_type_not_equal_to_json(self):
         """
         Method: POST
@@ -0,0 +1,143 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django import urls
+from django.test import tag
+
+from notecards.models import Card
+
+from . import utils
+
+import json
+
+
+@tag('card-api', 'integration')
+class ChangesApiTests(utils.CardApiTestCase):
+    """
+    ## /api/v1/changes/
+
+    ### GET
+
+    Returns the changes made to the cards of the user after the
+    change specified by the `since` query parameter (use 0 to get
+    all of the cards). Each change has a `sequence` number which
+    increases per user in the order the changes were committed (a
+    change is never committed after a change with a higher sequence
+    number) and contains either the current card object
+    (created or updated cards) or a tombstone (`deleted: true`) for
+    deleted cards. Only the most recent change of each card is kept.
+    The `next_since` value of the response is used as the `since`
+    value of the next request.
+
+    (see GET tests below for details)
+    """
+
+    def get_changes(self, params):
+        response = self.client.get(urls.reverse('notecards-api-changes'), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_must_be_logged_in_to_get_changes(self):
+        """
+        Method: GET
+        Anonymous users can not retrieve changes.
+        """
+        response = self.client.get(urls.reverse('notecards-api-changes'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_get_changes(self):
+        """
+        Method: GET
+        Created, updated and deleted cards are returned in the order the
+        changes were made. Cards which were changed more than once are only
+        returned once (with their current values). The optional `format`
+        query parameter specifies the card output format (ie. `archive`
+        for backups).
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        utils.add_card_set_1_to_database(self, utils.test_user2)
+
+        content = self.get_changes({'since': 0, 'format': 'archive'})
+        self.assertFalse(content['has_more'])
+        self.assertEqual([change['uuid'] for change in content['changes']],
+                         [card_obj['uuid'] for card_obj in card_objects])
+        utils.assertCardListsMatch(self, [change['card'] for change in content['changes']], card_objects)
+
+        since = content['next_since']
+        content = self.get_changes({'since': since})
+        self.assertEqual(content['changes'], [])
+        self.assertEqual(content['next_since'], since)
+
+        patch_json = json.dumps([{'op': 'replace', 'path': '/title', 'value': "patched title"}])
+        url = urls.reverse('notecards-api-card', kwargs={'card_uuid': card_objects[1]['uuid']})
+        self.client.patch(url, patch_json, content_type='application/json-patch+json')
+
+        url = urls.reverse('notecards-api-card', kwargs={'card_uuid': card_objects[3]['uuid']})
+        self.client.delete(url)
+
+        tags_url = urls.reverse('notecards-api-card-tags', kwargs={'card_uuid': card_objects[1]['uuid']})
+        self.client.post(tags_url, {'label': "new_tag"}, content_type='application/json')
+
+        content = self.get_changes({'since': since})
+        changes = content['changes']
+        self.assertEqual(len(changes), 2)
+
+        self.assertEqual(changes[0]['uuid'], card_objects[3]['uuid'])
+        self.assertTrue(changes[0]['deleted'])
+        self.assertFalse('card' in changes[0])
+
+        self.assertEqual(changes[1]['uuid'], card_objects[1]['uuid'])
+        self.assertFalse(changes[1]['deleted'])
+        self.assertEqual(changes[1]['card']['title'], "patched title")
+        self.assertEqual(changes[1]['card']['tags'][0]['label'], "new_tag")
+
+        self.assertTrue(changes[0]['sequence'] < changes[1]['sequence'])
+        self.assertTrue(since < changes[0]['sequence'])
+
+        # The sequence numbers of a user do not depend on the changes of other users
+        self.assertEqual(since, len(card_objects))
+
+        # Bulk updates are recorded as well
+        since = content['next_since']
+        response = utils.post_json(self, 'notecards-api-advance-review-date-tasks',
+                                   {'num_days': 1, 'filter': {'review_status': 1}})
+        self.assertEqual(response.status_code, 200)
+
+        content = self.get_changes({'since': since})
+        self.assertEqual(len(content['changes']), len(card_objects) - 1)
+
+    def test_get_changes_with_limit(self):
+        """
+        Method: GET
+        The `limit` query parameter (default 100, maximum 1000) sets the
+        maximum number of changes returned per request. `has_more` is true
+        if there are more changes and the `next` link contains the query
+        for the next batch of changes.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+
+        uuids = []
+        url = urls.reverse('notecards-api-changes')
+        params = {'since': 0, 'limit': 2}
+
+        while True:
+            response = self.client.get(url, params)
+            content = json.loads(response.content)
+            self.assertTrue(len(content['changes']) <= 2)
+
+            uuids.extend([change['uuid'] for change in content['changes']])
+            if not content['has_more']:
+                break
+
+            url = utils.get_rest_link(content['links'], 'next')
+            params = {}
+
+        self.assertEqual(uuids, [card_obj['uuid'] for card_obj in card_objects])
+
+        for params in [{'since': -1}, {'since': "abc"}, {'limit': 0}, {'limit': 1001}]:
+            response = self.client.get(urls.reverse('notecards-api-changes'), params)
+            self.assertEqual(response.status_code, 400)
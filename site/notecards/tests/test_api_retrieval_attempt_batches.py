@@ -0,0 +1,169 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django import urls
+from django.test import tag
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from notecards.models import Card, RetrievalAttempt
+
+from datetime import timedelta
+
+from . import utils
+
+import json
+
+
+@tag('card-api', 'integration')
+class RetrievalAttemptBatchesApiTests(utils.CardApiTestCase):
+    """
+    ## /api/v1/retrieval-attempt-batches/
+
+    ### POST
+
+    Submit the results of many card reviews (for example the results
+    of an offline review session) with a single request. A retrieval
+    attempt is created for each result and the spacing bins and next
+    retrieval dates of the cards are updated in one transaction.
+
+    (see POST tests below for details)
+    """
+
+    def test_anonymous_users_can_not_create_retrieval_attempt_batches(self):
+        """
+        Method: POST
+        Anonymous users do not have POST access to this resource.
+        """
+        utils.login(self)
+        card_objects = utils.add_card_set_1_to_database(self)
+        utils.logout(self)
+
+        num_retrieval_attempts = RetrievalAttempt.objects.count()
+        request_body = [{'uuid': card_objects[0]['uuid'], 'success': True}]
+
+        response = utils.post_json(self, 'notecards-api-retrieval-attempt-batches', request_body)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(RetrievalAttempt.objects.count(), num_retrieval_attempts)
+
+    def test_post_retrieval_attempt_batch(self):
+        """
+        Method: POST
+        The accepted content is of type `application/json` and should
+        contain an array of review results. The `retrieval_date` is
+        optional (it defaults to the current time) and the next retrieval
+        date of the card is scheduled relative to it. The results of each
+        card are applied in order of their retrieval dates. At most 1000
+        results can be sent at a time.
+
+        ``` javascript
+        [
+            {uuid: "...", success: true, retrieval_date: "2019-05-01T10:00:00Z"},
+            {uuid: "...", success: false}
+        ]
+        ```
+
+        A successfull post returns a 200 response code. The `results`
+        list contains a `status` for each of the review results: 201 for
+        created retrieval attempts (along with the `retrieval_attempt`
+        and the `spacing_bin`, `next_retrieval_date` and `active` values
+        of the card after that attempt), 404 for unknown cards and 400 for
+        invalid results (along with a `message`).
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        user = utils.get_user()
+        num_retrieval_attempts = RetrievalAttempt.objects.count()
+
+        # Json dates only have millisecond precision
+        first_date = timezone.now().replace(microsecond=0) - timedelta(days=2)
+        second_date = timezone.now().replace(microsecond=0) - timedelta(days=1)
+
+        request_body = [
+            {'uuid': card_objects[0]['uuid'], 'success': True, 'retrieval_date': second_date},
+            {'uuid': card_objects[0]['uuid'], 'success': False, 'retrieval_date': first_date},
+            {'uuid': card_objects[1]['uuid'], 'success': True},
+            {'uuid': "unknown_card_uuid_1234", 'success': True},
+            {'uuid': card_objects[2]['uuid']},
+            {'uuid': card_objects[2]['uuid'], 'success': True, 'retrieval_date': "yesterday"}
+        ]
+
+        with CaptureQueriesContext(connection) as context:
+            response = utils.post_json(self, 'notecards-api-retrieval-attempt-batches', request_body)
+
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content)
+        self.assertEqual(content['num_retrieval_attempts_created'], 3)
+        self.assertEqual([result['status'] for result in content['results']], [201, 201, 201, 404, 400, 400])
+
+        # The failed attempt (earlier date) is applied before the successful one
+        card = Card.from_uuid(card_objects[0]['uuid'], user)
+        self.assertEqual(card.spacing_bin, 2)
+        self.assertEqual(card.next_retrieval_date, second_date + timedelta(days=3))
+        retrieval_attempts = card.retrievalattempt_set.filter(retrieval_date__gte=first_date) \
+                                                      .order_by('retrieval_date')
+        self.assertEqual([(ra.retrieved, ra.spacing_bin) for ra in retrieval_attempts],
+                         [(False, card_objects[0]['spacing_bin']), (True, 1)])
+
+        # Each result contains the schedule after its own attempt
+        self.assertEqual(content['results'][1]['spacing_bin'], 1)
+        self.assertEqual(content['results'][1]['next_retrieval_date'],
+                         json.loads(json.dumps(first_date + timedelta(days=1), cls=DjangoJSONEncoder)))
+        self.assertEqual(content['results'][0]['spacing_bin'], 2)
+
+        card = Card.from_uuid(card_objects[1]['uuid'], user)
+        self.assertEqual(card.spacing_bin, card_objects[1]['spacing_bin'] + 1)
+        self.assertEqual(content['results'][2]['spacing_bin'], card.spacing_bin)
+        self.assertEqual(content['results'][2]['next_retrieval_date'],
+                         json.loads(json.dumps(card.next_retrieval_date, cls=DjangoJSONEncoder)))
+
+        self.assertEqual(RetrievalAttempt.objects.count(), num_retrieval_attempts + 3)
+
+        insert_queries = [q for q in context.captured_queries
+                          if q['sql'].startswith('INSERT INTO "notecards_retrievalattempt"')]
+        update_queries = [q for q in context.captured_queries
+                          if q['sql'].startswith('UPDATE "notecards_card"')]
+        self.assertEqual(len(insert_queries), 1)
+        self.assertEqual(len(update_queries), 1)
+
+    def test_post_retrieval_attempt_batch_moves_last_bin_cards_to_inactive(self):
+        """
+        Method: POST
+        Cards which are successfully retrieved from the last
+        spacing bin become inactive (the same as for single
+        retrieval attempts).
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        user = utils.get_user()
+
+        Card.objects.filter(uuid=card_objects[0]['uuid']).update(spacing_bin=7)
+
+        request_body = [{'uuid': card_objects[0]['uuid'], 'success': True}]
+        response = utils.post_json(self, 'notecards-api-retrieval-attempt-batches', request_body)
+        self.assertEqual(response.status_code, 200)
+
+        card = Card.from_uuid(card_objects[0]['uuid'], user)
+        self.assertFalse(card.active)
+        self.assertEqual(card.spacing_bin, 8)
+
+    def test_post_retrieval_attempt_batch_with_invalid_body(self):
+        """
+        Method: POST
+        A body which is not a json array returns a 400 response code
+        and no retrieval attempts are created.
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        num_retrieval_attempts = RetrievalAttempt.objects.count()
+
+        response = utils.post_json(self, 'notecards-api-retrieval-attempt-batches',
+                                   {'uuid': card_objects[0]['uuid'], 'success': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(RetrievalAttempt.objects.count(), num_retrieval_attempts)
@@ -0,0 +1,107 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django import urls
+from django.test import tag
+from django.utils import timezone
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from notecards.models import Card
+
+from datetime import timedelta
+
+from . import utils
+
+import json
+
+
+@tag('card-api', 'integration')
+class ReviewQueueApiTests(utils.CardApiTestCase):
+    """
+    ## /api/v1/review-queue/
+
+    ### GET
+
+    Returns the next active cards which are due for review (in the order
+    they should be reviewed) with everything that is needed to display
+    them. The results of the reviews can be submitted in one request
+    to `/api/v1/retrieval-attempt-batches/`.
+
+    (see GET tests below for details)
+    """
+
+    def test_must_be_logged_in_to_get_review_queue(self):
+        """
+        Method: GET
+        Anonymous users can not retrieve the review queue.
+        """
+        response = self.client.get(urls.reverse('notecards-api-review-queue'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_get_review_queue(self):
+        """
+        Method: GET
+        The optional `limit` query parameter is the maximum number of
+        cards to return (default 50, maximum 500). The cards are ordered
+        by their next retrieval date and only include cards which are
+        active and due today. Each card contains its full query and answer,
+        its tag labels and the urls of its file attachments. The
+        `total_num_due_cards` value is the number of cards which are due
+        (including the cards which were not returned).
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        utils.add_card_set_1_to_database(self, utils.test_user2)
+
+        card_obj = utils.get_default_card_objects(1)[0]
+        utils.attach_text_to_card_obj_as_file(card_obj, "file text", "file.txt")
+        card_obj['next_retrieval_date'] = '2018-01-01T00:00:00.000Z'
+        card_obj['tags'] = [{'label': "math"}]
+        card_obj = utils.import_card(card_obj)
+
+        user = utils.get_user()
+        Card.objects.filter(uuid=card_objects[4]['uuid'], user=user).update(active=False)
+        Card.objects.filter(uuid=card_objects[2]['uuid'], user=user) \
+                    .update(next_retrieval_date=timezone.now() + timedelta(days=3))
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(urls.reverse('notecards-api-review-queue'), {'limit': 3})
+
+        self.assertEqual(response.status_code, 200)
+
+        # The cards, their tags, their file attachments and the count
+        card_queries = [q for q in context.captured_queries if 'notecards_' in q['sql']]
+        self.assertEqual(len(card_queries), 4)
+
+        content = json.loads(response.content)
+        self.assertEqual([card['uuid'] for card in content['cards']],
+                         [card_obj.uuid, card_objects[0]['uuid'], card_objects[1]['uuid']])
+        self.assertEqual(content['num_cards'], 3)
+        self.assertEqual(content['total_num_due_cards'], 4)
+
+        card = content['cards'][0]
+        self.assertEqual(card['tags'], [{'label': "math"}])
+        self.assertEqual(len(card['files']), 1)
+        self.assertTrue('url' in card['files'][0])
+        self.assertFalse('retrieval_attempts' in card)
+
+        self.assertEqual(content['cards'][1]['answer'], card_objects[0]['answer'])
+
+        response = self.client.get(urls.reverse('notecards-api-review-queue'))
+        content = json.loads(response.content)
+        self.assertEqual(content['num_cards'], 4)
+        self.assertEqual(content['total_num_due_cards'], 4)
+
+    def test_get_review_queue_with_invalid_limit(self):
+        """
+        Method: GET
+        A `limit` which is not an integer between 1 and
+        500 returns a 400 response code.
+        """
+        utils.login(self)
+
+        for limit in ["x", 0, 501]:
+            response = self.client.get(urls.reverse('notecards-api-review-queue'), {'limit': limit})
+            self.assertEqual(response.status_code, 400)
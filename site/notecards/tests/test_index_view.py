@@ -0,0 +1,74 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django import urls
+from django.test import tag, override_settings
+
+from notecards import card_list_cache
+
+from . import utils
+
+import json
+
+
+@tag('views', 'integration')
+class IndexViewTests(utils.CardApiTestCase):
+    def get_embedded_card_list(self, response):
+        return json.loads(response.context['card_list_json'])
+
+    def test_index_embeds_the_first_card_list(self):
+        """
+        The index page of a logged in user contains the same card
+        list as the cards api returns for the filter of the page.
+        """
+        utils.login(self)
+        utils.add_card_set_1_to_database(self)
+        utils.add_card_set_1_to_database(self, utils.test_user2)
+
+        params = {'review_status': 1, 'order_by': 1, 'page': 2, 'cards_per_page': 2}
+        response = self.client.get(urls.reverse('notecards-index'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'id="card_list_data"')
+
+        card_list = self.get_embedded_card_list(response)
+        self.assertEqual(card_list['page_info']['current_page'], 2)
+        self.assertEqual(len(card_list['cards']), 2)
+
+        # The page view filled the cache of the api request
+        card_list_cache.stats.reset()
+
+        response = self.client.get(urls.reverse('notecards-api-cards'), dict(params, format='index'))
+        self.assertEqual(json.loads(response.content), card_list)
+        self.assertEqual(card_list_cache.stats.get_summary(), {'hits': 1, 'misses': 0})
+
+    def test_embedded_card_list_is_escaped(self):
+        """
+        The embedded card list can not close its script element.
+        """
+        utils.login(self)
+
+        card_obj = utils.get_default_card_objects(1)[0]
+        card_obj['query'] = "</script><script>alert(1)</script>"
+        utils.import_card(card_obj)
+
+        response = self.client.get(urls.reverse('notecards-index'))
+        self.assertNotContains(response, "</script><script>alert(1)")
+
+        card_list = self.get_embedded_card_list(response)
+        self.assertEqual(card_list['cards'][0]['query'], card_obj['query'])
+
+    def test_card_list_is_not_embedded(self):
+        """
+        The card list is not embedded for anonymous users
+        or if NOTECARDS_EMBED_INDEX_CARD_LIST is disabled.
+        """
+        utils.add_card_set_1_to_database(self)
+
+        response = self.client.get(urls.reverse('notecards-index'))
+        self.assertNotContains(response, 'id="card_list_data"')
+
+        utils.login(self)
+
+        with override_settings(NOTECARDS_EMBED_INDEX_CARD_LIST=False):
+            response = self.client.get(urls.reverse('notecards-index'))
+            self.assertNotContains(response, 'id="card_list_data"')
@@ -0,0 +1,59 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from unittest import mock, skipUnless
+
+from django.test import tag
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from notecards.models import Card
+from notecards import card_list_cache, card_markdown
+
+from . import utils
+
+import io
+
+
+@tag('commands', 'integration')
+@skipUnless(card_markdown.is_available(), "markdown-it-py is not installed")
+class RenderQuerySnippetsCommandTests(utils.CardApiTestCase):
+    def run_command(self, *args, **kwargs):
+        stdout = io.StringIO()
+        call_command('render_query_snippets', *args, stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def test_render_query_snippets(self):
+        """
+        The render_query_snippets command renders the snippets of the
+        cards which were not rendered (ie. imported before markdown-it-py
+        was installed) or rendered with an older renderer version. The
+        updated cards are recorded as card changes.
+        """
+        utils.add_card_set_1_to_database(self)
+        utils.add_card_set_1_to_database(self, utils.test_user2)
+
+        user = utils.get_user()
+        rendered_snippets = dict(Card.objects.values_list('id', 'query_html'))
+
+        output = self.run_command()
+        self.assertIn("10 cards checked, 0 snippets rendered", output)
+
+        Card.objects.update(query_html="", query_html_sha_512="")
+        deck_version = card_list_cache.get_deck_version(user)
+
+        output = self.run_command(utils.test_user1['username'])
+        self.assertIn("5 cards checked, 5 snippets rendered", output)
+        self.assertTrue(card_list_cache.get_deck_version(user) > deck_version)
+
+        for card in Card.objects.filter(user=user):
+            self.assertEqual(card.query_html, rendered_snippets[card.id])
+
+        self.assertFalse(Card.objects.filter(user=utils.get_user(utils.test_user2)).exclude(query_html="").exists())
+
+        with mock.patch.object(card_markdown, 'RENDERER_VERSION', card_markdown.RENDERER_VERSION + 1):
+            output = self.run_command()
+            self.assertIn("10 cards checked, 10 snippets rendered", output)
+
+        with self.assertRaises(CommandError):
+            self.run_command("unknown_user")
@@ -0,0 +1,164 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django import urls
+from django.test import tag
+from django.utils import dateparse, timezone
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from notecards.models import Card, RetrievalAttempt, SchedulerSetting
+from notecards import scheduler
+
+from datetime import timedelta
+
+from . import utils
+
+import io
+import json
+import unittest
+
+
+@tag('commands', 'integration')
+class SetCardSchedulerCommandTests(utils.CardApiTestCase):
+    def run_command(self, *args, **kwargs):
+        stdout = io.StringIO()
+        call_command('set_card_scheduler', *args, stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def get_card(self, uuid):
+        return Card.objects.get(user=utils.get_user(), uuid=uuid)
+
+    def test_set_card_scheduler(self):
+        """
+        The set_card_scheduler command stores the scheduler of the user
+        and reschedules the cards which have a retrieval history by
+        replaying their retrieval attempts with the new scheduler (if
+        the scheduler replays the retrieval history).
+        """
+        card_objects = utils.add_card_set_1_to_database(self)
+        utils.add_card_set_1_to_database(self, utils.test_user2)
+
+        # Three successful retrievals
+        card_obj = card_objects[3]
+        last_retrieval_date = dateparse.parse_datetime(card_obj['retrieval_attempts'][-1]['retrieval_date'])
+
+        output = self.run_command(utils.test_user1['username'], "sm2")
+        self.assertIn("1 cards rescheduled", output)
+
+        card = self.get_card(card_obj['uuid'])
+        self.assertEqual(card.spacing_bin, 4)
+        self.assertEqual(card.next_retrieval_date, last_retrieval_date + timedelta(days=6 * 2.5))
+        self.assertTrue(card.active)
+
+        setting = SchedulerSetting.objects.get(user=utils.get_user())
+        self.assertEqual(setting.name, "sm2")
+
+        output = self.run_command(utils.test_user1['username'], "exponential",
+                                  parameters=json.dumps({'base_days': 2, 'growth': 2.0}))
+        self.assertIn("1 cards rescheduled", output)
+
+        card = self.get_card(card_obj['uuid'])
+        self.assertEqual(card.next_retrieval_date, last_retrieval_date + timedelta(days=2 * 2.0 ** 2))
+
+        # The fixed bin scheduler uses the spacing bins of the
+        # cards so the cards are not rescheduled
+        output = self.run_command(utils.test_user1['username'], "fixed_bins")
+        self.assertIn("0 cards rescheduled", output)
+
+        card = self.get_card(card_obj['uuid'])
+        self.assertEqual(card.spacing_bin, 4)
+        self.assertEqual(card.next_retrieval_date, last_retrieval_date + timedelta(days=2 * 2.0 ** 2))
+        self.assertEqual(SchedulerSetting.objects.get(user=utils.get_user()).name, "fixed_bins")
+
+        # The cards without retrieval attempts and the cards
+        # of the other users are not changed
+        for other_card_obj in card_objects[:3] + card_objects[4:]:
+            card = self.get_card(other_card_obj['uuid'])
+            self.assertEqual(card.next_retrieval_date,
+                             dateparse.parse_datetime(other_card_obj['next_retrieval_date']))
+
+        user2_card = Card.objects.get(user=utils.get_user(utils.test_user2), uuid=card_obj['uuid'])
+        self.assertEqual(user2_card.next_retrieval_date,
+                         dateparse.parse_datetime(card_obj['next_retrieval_date']))
+
+    def test_reviews_use_the_scheduler_of_the_user(self):
+        """
+        Retrieval attempts created after the scheduler has been
+        changed are scheduled with the new scheduler (the same as
+        rescheduling the card with the new retrieval history).
+        """
+        utils.login(self)
+
+        card_objects = utils.add_card_set_1_to_database(self)
+        card_obj = card_objects[3]
+
+        self.run_command(utils.test_user1['username'], "sm2")
+
+        url = urls.reverse('notecards-api-card-retrieval-attempts', kwargs={'card_uuid': card_obj['uuid']})
+        response = self.client.post(url, {'success': True}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        card = self.get_card(card_obj['uuid'])
+        retrieval_date = RetrievalAttempt.objects.filter(card=card).latest('retrieval_date').retrieval_date
+        self.assertEqual(card.spacing_bin, 5)
+        self.assertEqual(card.next_retrieval_date, retrieval_date + timedelta(days=6 * 2.5 * 2.5))
+
+        next_retrieval_date = card.next_retrieval_date
+        scheduler.reschedule_cards(scheduler.SM2Scheduler(), Card.objects.filter(pk=card.pk))
+
+        card = self.get_card(card_obj['uuid'])
+        self.assertEqual(card.spacing_bin, 5)
+        self.assertEqual(card.next_retrieval_date, next_retrieval_date)
+
+    @unittest.skipIf(scheduler.numpy is None, "numpy is not installed")
+    def test_vectorized_rescheduling_matches(self):
+        """
+        Rescheduling with numpy gives the same results as
+        replaying the retrieval histories one card at a time.
+        """
+        user = utils.get_user()
+        now = timezone.now()
+
+        for index in range(20):
+            card_obj = utils.get_default_card_objects(1)[0]
+            card_obj['retrieval_attempts'] = [
+                {'retrieval_date': now - timedelta(days=100 - attempt),
+                 'retrieved': ((index + attempt) % 4) != 0,
+                 'spacing_bin': 1}
+                for attempt in range(index % 9)
+            ]
+            utils.import_card(card_obj)
+
+        cards = Card.objects.filter(user=user)
+
+        for name in scheduler.SCHEDULERS:
+            card_scheduler = scheduler.create_scheduler(name)
+
+            scheduler.reschedule_cards(card_scheduler, cards, vectorized=False)
+            expected_values = list(cards.order_by('id').values_list('spacing_bin', 'next_retrieval_date', 'active'))
+
+            Card.objects.filter(user=user).update(spacing_bin=1, active=True)
+
+            scheduler.reschedule_cards(card_scheduler, cards, chunk_size=7, vectorized=True)
+            values = list(cards.order_by('id').values_list('spacing_bin', 'next_retrieval_date', 'active'))
+
+            self.assertEqual(values, expected_values)
+
+    def test_set_card_scheduler_with_invalid_arguments(self):
+        """
+        Unknown users and invalid scheduler parameters
+        raise a CommandError and nothing is changed.
+        """
+        utils.add_card_set_1_to_database(self)
+
+        with self.assertRaises(CommandError):
+            self.run_command("unknown_user", "sm2")
+
+        with self.assertRaises(CommandError):
+            self.run_command(utils.test_user1['username'], "sm2", parameters=json.dumps({'unknown': 1}))
+
+        with self.assertRaises(CommandError):
+            self.run_command(utils.test_user1['username'], "sm2", parameters="[1]")
+
+        self.assertEqual(SchedulerSetting.objects.count(), 0)
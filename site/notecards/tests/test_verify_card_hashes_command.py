@@ -0,0 +1,70 @@
+# Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
+# Licensed under the terms of the MIT license.
+
+from django.test import tag
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from notecards.models import Card
+from notecards import utils as nc_utils
+from notecards import card_list_cache
+
+from . import utils
+
+import io
+
+
+@tag('commands', 'integration')
+class VerifyCardHashesCommandTests(utils.CardApiTestCase):
+    def run_command(self, *args, **kwargs):
+        stdout = io.StringIO()
+        call_command('verify_card_hashes', *args, stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def test_verify_and_rebuild_card_hashes(self):
+        """
+        The verify_card_hashes command reports the cards whose stored
+        hashes do not match their contents and file attachments. With
+        --rebuild the incorrect hashes are updated and the updated cards
+        are recorded as card changes.
+        """
+        card_objects = utils.add_card_set_1_to_database(self)
+        utils.add_card_set_1_to_database(self, utils.test_user2)
+
+        card_obj = utils.get_default_card_objects(1)[0]
+        utils.attach_text_to_card_obj_as_file(card_obj, "file one", "one.txt")
+        utils.attach_text_to_card_obj_as_file(card_obj, "file two", "two.txt")
+        card = utils.import_card(card_obj)
+
+        output = self.run_command()
+        self.assertIn("11 cards checked, 0 incorrect hashes", output)
+
+        # Simulate cards whose contents changed without updating the hashes
+        user = utils.get_user()
+        Card.objects.filter(user=user, uuid=card_objects[0]['uuid']).update(title="changed")
+        Card.objects.filter(pk=card.pk).update(sha_512="", files_sha_512="")
+
+        output = self.run_command(utils.test_user2['username'])
+        self.assertIn("5 cards checked, 0 incorrect hashes", output)
+
+        output = self.run_command(utils.test_user1['username'])
+        self.assertIn("6 cards checked, 2 incorrect hashes", output)
+        self.assertIn(card_objects[0]['uuid'], output)
+        self.assertIn(card.uuid, output)
+
+        deck_version = card_list_cache.get_deck_version(user)
+        user2_deck_version = card_list_cache.get_deck_version(utils.get_user(utils.test_user2))
+
+        output = self.run_command(utils.test_user1['username'], rebuild=True)
+        self.assertIn("6 cards checked, 2 hashes rebuilt", output)
+        self.assertEqual(card_list_cache.get_deck_version(user), deck_version + 2)
+        self.assertEqual(card_list_cache.get_deck_version(utils.get_user(utils.test_user2)), user2_deck_version)
+
+        for card in Card.objects.all():
+            self.assertEqual(card.sha_512, nc_utils.compute_card_sha_512(card))
+
+        output = self.run_command()
+        self.assertIn("11 cards checked, 0 incorrect hashes", output)
+
+        with self.assertRaises(CommandError):
+            self.run_command("unknown_user")
@@ -3,10 +3,11 @@
 
 from notecards.models import Card, FileAttachment, Tag
 from notecards import utils as nc_utils
+from notecards import card_list_cache
 
 from django import urls
 from django.utils import timezone, dateparse
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
 
@@ -160,6 +161,13 @@ def remove_filesystem_files():
         file_attachment.file.delete(save=False)
 
 
+def clear_card_list_cache():
+    # The database is rolled back after each test so the
+    # ids (and the deck versions) are reused by the next test
+    card_list_cache.get_cache().clear()
+    card_list_cache.stats.reset()
+
+
 def remove_cards_from_database():
     remove_filesystem_files()
 
@@ -331,6 +339,10 @@ def get_rest_link(links, rel):
     return url
 
 
+# The task workers are started by the first request (see apps.py) and
+# would run the queued tasks of the tests in the background. The tests
+# which exercise the workers enable them with override_settings.
+@override_settings(NOTECARDS_TASK_WORKERS=0)
 class CardApiTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -344,9 +356,11 @@ class CardApiTestCase(TestCase):
 
     def tearDown(self):
         remove_filesystem_files()
+        clear_card_list_cache()
         super().tearDown()
 
 
+@override_settings(NOTECARDS_TASK_WORKERS=0)
 class CardApiTransactionTestCase(TransactionTestCase):
     def setUp(self):
         User.objects.create_user(test_user1['username'],
@@ -361,5 +375,6 @@ class CardApiTransactionTestCase(TransactionTestCase):
 
     def tearDown(self):
         remove_filesystem_files()
+        clear_card_list_cache()
         super().tearDown()
 
@@ -7,24 +7,91 @@ import subprocess
 from datetime import datetime, timedelta, time
 
 from django.conf import settings
-from django.utils import timezone
-from django.http import Http404, JsonResponse
-from django.db import IntegrityError
+from django.utils import timezone, dateparse
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseNotModified
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Count, QuerySet, prefetch_related_objects
+from django.db.models.functions import Substr
 from django.core.paginator import Paginator, Page
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.files import File
-from django.utils.http import urlencode
+from django.core.exceptions import ValidationError
+from django.utils.http import urlencode, parse_etags, quote_etag
+from django.utils.cache import patch_cache_control
 
-from .models import Card, FileAttachment, Tag, RetrievalAttempt
+from .models import Card, FileAttachment, Tag, RetrievalAttempt, CardChange, CardChangeSequence, SchedulerSetting
+from .card_archive_decoding import decode_card_archive_member, get_bytes_sha_512
+from . import search
+from . import content_hash
+from . import card_markdown
+from . import scheduler
+
+from concurrent.futures import ProcessPoolExecutor
 
 import io
+import collections
+import collections.abc
+import functools
+import operator
+import multiprocessing
 import pathlib
 import json
 import copy
 import base64
 import hashlib
 import tarfile
-import tempfile
+import secrets
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Number of cards loaded from the database at a time
+# when iterating over all of the cards of a user.
+CARD_CHUNK_SIZE = 500
+
+# Number of cards inserted at a time when importing a card archive
+ARCHIVE_IMPORT_BATCH_SIZE = 200
+
+# Maximum number of cards accepted by a single card batch request
+MAX_CARD_BATCH_SIZE = 1000
+
+# Default and maximum number of cards returned by the review queue
+DEFAULT_REVIEW_QUEUE_LIMIT = 50
+MAX_REVIEW_QUEUE_LIMIT = 500
+
+# Maximum number of review results accepted by a
+# single retrieval attempt batch request
+MAX_RETRIEVAL_ATTEMPT_BATCH_SIZE = 1000
+
+# Maximum number of decoded archive members waiting to be
+# imported for each worker process during parallel imports
+ARCHIVE_IMPORT_QUEUE_SIZE_PER_WORKER = 4
+
+
+# Only used for its default() method (which formats the
+# datetimes, dates, decimals and uuids) when encoding with orjson
+json_encoder = DjangoJSONEncoder()
+
+
+def encode_json(data):
+    """
+    Returns data encoded as utf-8 json. Uses orjson if it is installed.
+    The datetimes are formatted by DjangoJSONEncoder either way so the
+    values are the same as the ones encoded by JsonResponse (non-string
+    dictionary keys are converted to strings by both encoders).
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=json_encoder.default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+    return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def create_json_response(data, status=200):
+    return HttpResponse(encode_json(data), status=status, content_type='application/json')
 
 
 def create_400_json_response(message="Bad request"):
@@ -54,11 +121,22 @@ def create_409_json_response(message="Conflict"):
     return response
 
 
+def create_412_json_response(message="Precondition failed. The resource has been modified."):
+    response = JsonResponse({'message': message}, status=412)
+    return response
+
+
 def create_415_json_response(message="Content type not supported"):
     response = JsonResponse({'message': message}, status=415)
     return response
 
 
+def create_304_response(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
 def get_utc_datetime_for_local_midnight():
     # Get date time for today (local) at 12 in the morning (no timezone info)
     dt = datetime.combine(timezone.localdate(), time())
@@ -74,10 +152,24 @@ def get_utc_datetime_for_local_midnight():
     return dt_utc
 
 
+def get_due_cards(user):
+    """
+    Returns the active cards of the user which are due for review
+    today in the order they should be reviewed (uses the user, active,
+    next_retrieval_date index).
+    """
+    dt = get_utc_datetime_for_local_midnight()
+
+    return Card.objects.filter(user=user, active=True, next_retrieval_date__lte=dt) \
+                       .order_by('next_retrieval_date', 'id')
+
+
 def parse_card_filter(filter_dict):
     filter_params = {
         'tags_filter':    str(filter_dict.get('tags_filter', "")),
+        'tags_match':     int(filter_dict.get('tags_match', 2)),
         'title_filter':   str(filter_dict.get('title_filter', "")),
+        'text_filter':    str(filter_dict.get('text_filter', "")),
         'active':         int(filter_dict.get('active', 2)),
         'order_by':       int(filter_dict.get('order_by', 0)),
         'review_status':  int(filter_dict.get('review_status', 1)),
@@ -85,12 +177,23 @@ def parse_card_filter(filter_dict):
         'cards_per_page': int(filter_dict.get('cards_per_page', 0)),
     }
 
+    # Cursor based pagination is opt-in so the cursor related
+    # parameters are only added when a cursor was supplied.
+    if 'cursor' in filter_dict:
+        filter_params['cursor'] = str(filter_dict.get('cursor', ""))
+        filter_params['include_total'] = int(filter_dict.get('include_total', 0))
+
     return filter_params
 
 
 def get_card_query_from_filter_params(filter_params, **kwargs):
     fp_copy = copy.deepcopy(filter_params)
     fp_copy.update(kwargs)
+
+    # Only added to the links if the cards are searched
+    if fp_copy.get('text_filter') == "":
+        del fp_copy['text_filter']
+
     query = urlencode(fp_copy)
 
     if len(query) > 0:
@@ -99,21 +202,168 @@ def get_card_query_from_filter_params(filter_params, **kwargs):
     return query
 
 
-def get_filtered_cards(filter_params, user):
+class CursorPage(collections.abc.Sequence):
+    """
+    A page of cards retrieved using keyset pagination. Unlike
+    a Paginator Page, the total number of cards is only known
+    if it was explicitly requested (otherwise it is None).
+    """
+
+    def __init__(self, object_list, next_cursor=None, total_count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.total_count = total_count
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def get_cursor_order_field(order_by):
+    if order_by == 0:
+        return 'next_retrieval_date'
+    elif order_by == 1:
+        return 'creation_date'
+
+    return None
+
+
+def encode_card_cursor(card, order_by):
+    value = None
+    field = get_cursor_order_field(order_by)
+
+    if field:
+        value = getattr(card, field).isoformat()
+
+    data = json.dumps([order_by, value, card.pk]).encode('utf-8')
+    cursor = base64.urlsafe_b64encode(data).decode('utf-8')
+    return cursor.rstrip('=')
+
+
+def decode_card_cursor(cursor, order_by):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_order_by, value, card_id = json.loads(data.decode('utf-8'))
+
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+    if (cursor_order_by != order_by) or (not isinstance(card_id, int)):
+        raise ValueError("Invalid cursor")
+
+    if get_cursor_order_field(order_by):
+        value = dateparse.parse_datetime(str(value))
+
+        if value is None:
+            raise ValueError("Invalid cursor")
+
+    return (value, card_id)
+
+
+def get_cursor_page(cards, filter_params, output_format=None):
+    order_by = filter_params.get('order_by', -1)
+    field = get_cursor_order_field(order_by)
+
+    # Ranked text search results (order_by=2) have no stable key
+    if field is None:
+        raise ValueError("A cursor can not be used with order_by={}".format(order_by))
+
+    total_count = None
+    if filter_params.get('include_total', 0):
+        total_count = cards.count()
+
+    # The id is used as a tie breaker so that cards with
+    # the same date have a stable position between pages.
+    cards = cards.order_by(field, 'id')
+
+    if filter_params['cursor'] != "":
+        value, card_id = decode_card_cursor(filter_params['cursor'], order_by)
+
+        cards = cards.filter(Q(**{field + '__gt': value}) |
+                             Q(**{field: value, 'id__gt': card_id}))
+
+    # The ETags of cursor pages are computed from the loaded cards
+    cards = project_card_columns(cards, output_format, CARD_ETAG_FIELDS)
+
+    num_cards_per_page = filter_params.get('cards_per_page', 0)
+    if num_cards_per_page < 1:
+        return CursorPage(list(cards), None, total_count)
+
+    # Fetch one extra card to find out if there is a next page
+    object_list = list(cards[:num_cards_per_page + 1])
+    next_cursor = None
+
+    if len(object_list) > num_cards_per_page:
+        object_list = object_list[:num_cards_per_page]
+        next_cursor = encode_card_cursor(object_list[-1], order_by)
+
+    return CursorPage(object_list, next_cursor, total_count)
+
+
+def filter_cards_by_tag_labels(cards, tag_labels, user):
+    """
+    Returns the cards which have all of the tags in tag_labels (exact
+    matches, the labels are lowercased like the stored tag labels, see
+    create_tag_from_object). The labels are resolved to tag ids with a single query
+    and the cards are then filtered with a grouped subquery on the
+    card/tag table so no joins or distinct() are needed.
+    """
+    tag_labels = set([label.lower() for label in tag_labels])
+    if len(tag_labels) == 0:
+        return cards
+
+    tag_ids = list(Tag.objects.filter(user=user, label__in=tag_labels).values_list('id', flat=True))
+    if len(tag_ids) != len(tag_labels):
+        return cards.none()
+
+    card_ids = Card.tags.through.objects.filter(tag_id__in=tag_ids) \
+                                        .values('card_id') \
+                                        .annotate(num_tags=Count('tag_id')) \
+                                        .filter(num_tags=len(tag_ids)) \
+                                        .values('card_id')
+
+    return cards.filter(id__in=card_ids)
+
+
+def get_filtered_cards(filter_params, user, output_format=None):
+    """
+    Returns the cards of the user which match the filter parameters
+    (a queryset, Page or CursorPage). If output_format is not None only
+    the columns needed to create the card objects of that format are
+    loaded (see project_card_columns).
+    """
     cards = Card.objects.filter(user=user)
 
     if 'tags_filter' in filter_params:
         tag_labels = filter_params['tags_filter'].split()
-        for tag_label in tag_labels:
-            cards = cards.filter(tags__label__icontains=tag_label)
+        tags_match = filter_params.get('tags_match', 2)
+
+        if tags_match == 0:
+            cards = filter_cards_by_tag_labels(cards, tag_labels, user)
+
+        elif len(tag_labels) > 0:
+            for tag_label in tag_labels:
+                if tags_match == 1:
+                    cards = cards.filter(tags__label__istartswith=tag_label)
+                else:
+                    cards = cards.filter(tags__label__icontains=tag_label)
 
-        cards = cards.distinct()
+            cards = cards.distinct()
 
     if 'title_filter' in filter_params:
         title_keywords = filter_params['title_filter'].split()
         for title_keyword in title_keywords:
             cards = cards.filter(title__icontains=title_keyword)
 
+    if filter_params.get('text_filter', "") != "":
+        ranked = (filter_params.get('order_by', 0) == 2)
+        cards = search.filter_cards_by_text(cards, filter_params['text_filter'], ranked)
+
     if 'review_status' in filter_params:
         if filter_params['review_status'] == 0:
             dt = get_utc_datetime_for_local_midnight()
@@ -124,6 +374,10 @@ def get_filtered_cards(filter_params, user):
             cards = cards.order_by('next_retrieval_date')
         elif filter_params['order_by'] == 1:
             cards = cards.order_by('creation_date')
+        elif filter_params['order_by'] == 2:
+            # Best text_filter matches first
+            if filter_params.get('text_filter', "") != "":
+                cards = cards.order_by('search_rank', 'id')
 
     if 'active' in filter_params:
         if filter_params['active'] == 0:
@@ -131,21 +385,99 @@ def get_filtered_cards(filter_params, user):
         elif filter_params['active'] == 1:
             cards = cards.filter(active__exact=True)
 
-    if 'page' in filter_params and 'cards_per_page' in filter_params:
-        num_cards_per_page = filter_params['cards_per_page']
-        if (num_cards_per_page < 1):
-            num_cards_per_page = max(len(cards), 1)
+    if 'cursor' in filter_params:
+        return get_cursor_page(cards, filter_params, output_format)
+
+    # A cards_per_page value less than one means all of the cards
+    # are requested. In that case the queryset is returned as is
+    # so the caller can decide how to iterate over it instead of
+    # loading every card just to determine the page size.
+    if ('page' in filter_params) and (filter_params.get('cards_per_page', 0) > 0):
+        paginator = Paginator(cards, filter_params['cards_per_page'])
+        page = paginator.get_page(filter_params['page'])
+
+        # Projected after the cards have been counted (the text
+        # annotations would make the count query read every card)
+        page.object_list = project_card_columns(page.object_list, output_format)
+        return page
+
+    return project_card_columns(cards, output_format)
+
+
+def project_card_columns(cards, output_format=None, required_fields=[]):
+    """
+    Returns the cards (a queryset) with only the columns needed to
+    create the card objects of the output format (along with the
+    required_fields) loaded from the database. Truncated text fields
+    are replaced by an annotation containing just enough of the start
+    of the text to truncate it. The cards are returned as is if
+    output_format is None.
+    """
+    if output_format is None:
+        return cards
+
+    options = get_card_serializer(output_format).options
+    fields = ['id', 'uuid'] + list(required_fields)
+    annotations = {}
+
+    for name in ['title', 'creation_date', 'last_modified_date',
+                 'next_retrieval_date', 'spacing_bin', 'active']:
+        if options['include_' + name]:
+            fields.append(name)
+
+    if options['include_hash']:
+        fields.append('sha_512')
 
-        paginator = Paginator(cards, num_cards_per_page)
-        cards = paginator.get_page(filter_params['page'])
+    if options['include_query_html']:
+        fields.append('query_html')
 
-    return cards
+    for name in ['query', 'answer']:
+        max_length = options['max_' + name + '_length']
 
+        if not options['include_' + name]:
+            continue
 
-def create_card_object(card, output_format="", output_format_overrides={}):
+        if max_length >= 0:
+            # One extra character to tell if the text has to be truncated
+            annotations[name + TEXT_PREFIX_SUFFIX] = Substr(name, 1, max_length + 1)
+        else:
+            fields.append(name)
+
+    return cards.only(*fields).annotate(**annotations)
+
+
+def iterate_card_chunks(cards, chunk_size=CARD_CHUNK_SIZE):
+    """
+    Yields the cards in lists of at most chunk_size cards. Querysets
+    are streamed from the database using iterator() so only a single
+    chunk of cards is held in memory at any given time.
+    """
+    if isinstance(cards, QuerySet):
+        cards = cards.iterator(chunk_size=chunk_size)
+
+    chunk = []
+    for card in cards:
+        chunk.append(card)
+
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+# Length of the queries of the index format. The rendered query
+# snippet stored with each card (see update_card_query_html) is the
+# html of the query truncated to this length.
+QUERY_SNIPPET_LENGTH = 160
+
+
+def get_card_output_options(output_format="", output_format_overrides={}):
     options = {
         'include_title':       True,
         'include_query':       True,
+        'include_query_html':  False,
         'include_answer':      True,
         'max_query_length':    -1, # Anything other than >= 0 will return full query
         'max_answer_length':   -1, # Anything other than >= 0 will return full answer
@@ -166,7 +498,8 @@ def create_card_object(card, output_format="", output_format_overrides={}):
 
     if output_format == "index":
         options.update({
-            'max_query_length': 160,
+            'max_query_length': QUERY_SNIPPET_LENGTH,
+            'include_query_html': True,
             'include_answer': False,
             'include_retrieval_attempts': False,
             'include_file_attachments':  True,
@@ -181,6 +514,15 @@ def create_card_object(card, output_format="", output_format_overrides={}):
             'file_attachment_output_format': "archive",
             'retrieval_attempt_output_format': "archive"
         })
+    elif output_format == "review":
+        # Everything needed to review the card
+        # (the file attachments are loaded by url)
+        options.update({
+            'include_retrieval_attempts': False,
+            'include_hash': False,
+            'tag_output_format': "archive",
+            'file_attachment_output_format': "index"
+        })
     elif output_format == "links":
         options.update({
             'include_title':       False,
@@ -199,122 +541,295 @@ def create_card_object(card, output_format="", output_format_overrides={}):
         })
 
     options.update(output_format_overrides)
+    return options
 
-    card_obj = {'version': 1}
-    card_obj['uuid'] = card.uuid
 
-    if options['include_title']:
-        card_obj['title'] = card.title
+# Suffix of the annotations which contain the start of
+# a truncated text field (see project_card_columns)
+TEXT_PREFIX_SUFFIX = '_prefix'
 
-    if options['include_query']:
-        if options['max_query_length'] >= 0:
-            if len(card.query) > options['max_query_length']:
-                card_obj['query'] = card.query[:options['max_query_length'] - 3] + "..."
-            else:
-                card_obj['query'] = card.query[:options['max_query_length']]
+# Links of the card objects as (rel, href prefix, href suffix)
+# tuples. The href of each link is prefix + card uuid + suffix.
+CARD_LINK_TEMPLATES = [
+    ('self', '/cards/api/v1/cards/', ''),
+    ('edit-page', '/cards/edit/', ''),
+    ('review-page', '/cards/review/', ''),
+    ('tags', '/cards/api/v1/cards/', '/tags'),
+    ('files', '/cards/api/v1/cards/', '/files'),
+    ('retrieval-attempts', '/cards/api/v1/cards/', '/retrieval-attempts')
+]
 
-        else:
-            card_obj['query'] = card.query
 
-    if options['include_answer']:
-        if options['max_answer_length'] >= 0:
-            if len(card.answer) > options['max_answer_length']:
-                card_obj['answer'] = card.answer[:options['max_answer_length'] - 3] + "..."
-            else:
-                card_obj['answer'] = card.answer[:options['max_answer_length']]
+def create_card_links(card):
+    uuid = str(card.uuid)
+    return [{'rel': rel, 'href': prefix + uuid + suffix} for rel, prefix, suffix in CARD_LINK_TEMPLATES]
 
-        else:
-            card_obj['answer'] = card.answer
 
-    if options['include_creation_date']:
-        card_obj['creation_date'] = card.creation_date
+def truncate_text(text, max_length):
+    if len(text) > max_length:
+        return text[:max_length - 3] + "..."
+
+    return text
 
-    if options['include_last_modified_date']:
-        card_obj['last_modified_date'] = card.last_modified_date
 
-    if options['include_next_retrieval_date']:
-        card_obj['next_retrieval_date'] = card.next_retrieval_date
+def create_text_getter(name, max_length):
+    # Anything other than max_length >= 0 returns the full text
+    if max_length < 0:
+        return operator.attrgetter(name)
+
+    prefix_name = name + TEXT_PREFIX_SUFFIX
+
+    def get_text(card):
+        # Cards loaded with project_card_columns only
+        # contain the start of the text (as an annotation)
+        text = getattr(card, prefix_name, None)
+        if text is None:
+            text = getattr(card, name)
+
+        return truncate_text(text, max_length)
+
+    return get_text
+
+
+def compile_card_fields(options):
+    """
+    Returns the field plan of the card objects created with the output
+    options: a list of (key, function) pairs in the order of the keys
+    of the card objects where function returns the value of the key
+    for a card.
+    """
+    fields = [('uuid', operator.attrgetter('uuid'))]
+
+    if options['include_title']:
+        fields.append(('title', operator.attrgetter('title')))
+
+    if options['include_query']:
+        fields.append(('query', create_text_getter('query', options['max_query_length'])))
+
+    if options['include_query_html']:
+        # None if the snippet has not been rendered
+        fields.append(('query_html', lambda card: card.query_html or None))
+
+    if options['include_answer']:
+        fields.append(('answer', create_text_getter('answer', options['max_answer_length'])))
+
+    for name in ['creation_date', 'last_modified_date', 'next_retrieval_date']:
+        if options['include_' + name]:
+            fields.append((name, operator.attrgetter(name)))
 
     if options['include_retrieval_attempts']:
-        ra_list = create_card_retrieval_attempt_list(card, options['retrieval_attempt_output_format'])
-        card_obj.update(ra_list)
+        ra_output_format = options['retrieval_attempt_output_format']
+        fields.append(('retrieval_attempts',
+                       lambda card: create_card_retrieval_attempt_list(card, ra_output_format)['retrieval_attempts']))
 
     if options['include_spacing_bin']:
-        card_obj['spacing_bin'] = card.spacing_bin
+        fields.append(('spacing_bin', operator.attrgetter('spacing_bin')))
 
     if options['include_active']:
-        card_obj['active'] = card.active
+        fields.append(('active', operator.attrgetter('active')))
 
     if options['include_hash']:
-        card_obj['sha_512'] = card.sha_512
+        fields.append(('sha_512', operator.attrgetter('sha_512')))
 
     if options['include_tags']:
-        tag_list = create_card_tag_list(card, options['tag_output_format'])
-        card_obj.update(tag_list)
+        tag_output_format = options['tag_output_format']
+        fields.append(('tags', lambda card: create_card_tag_list(card, tag_output_format)['tags']))
 
     if options['include_file_attachments']:
-        file_attachment_list = create_card_file_attachment_list(card, options['file_attachment_output_format'])
-        card_obj.update(file_attachment_list)
+        fa_output_format = options['file_attachment_output_format']
+        fields.append(('files', lambda card: create_card_file_attachment_list(card, fa_output_format)['files']))
 
     if options['include_links']:
-        card_obj['links'] = [
-            { 'rel': 'self', 'href': '/cards/api/v1/cards/' + str(card.uuid)},
-            { 'rel': 'edit-page', 'href': '/cards/edit/' + str(card.uuid)},
-            { 'rel': 'review-page', 'href': '/cards/review/' + str(card.uuid)},
-            { 'rel': 'tags', 'href': '/cards/api/v1/cards/' + str(card.uuid) + '/tags'},
-            { 'rel': 'files', 'href': '/cards/api/v1/cards/' + str(card.uuid) + '/files'},
-            { 'rel': 'retrieval-attempts', 'href': '/cards/api/v1/cards/' + str(card.uuid) + '/retrieval-attempts'}
-        ]
+        fields.append(('links', create_card_links))
 
-    return card_obj
+    return fields
 
 
-def create_card_from_object(card_obj):
-    card = Card()
+class CardSerializer:
+    """
+    Creates the card objects of one output format. The output options
+    are only resolved once (into the field plan) instead of for every
+    card. Use get_card_serializer to get the shared instance of a format.
+    """
+    def __init__(self, output_format="", output_format_overrides={}):
+        self.options = get_card_output_options(output_format, output_format_overrides)
+        self.fields = compile_card_fields(self.options)
+
+    def create_card_object(self, card):
+        card_obj = {'version': 1}
+
+        for key, get_value in self.fields:
+            card_obj[key] = get_value(card)
 
-    if 'uuid' in card_obj:
-        card.uuid = card_obj['uuid']
+        return card_obj
 
-    if 'title' in card_obj:
-        card.title = card_obj['title']
 
-    if 'query' in card_obj:
-        card.query = card_obj['query']
+@functools.lru_cache(maxsize=64)
+def get_cached_card_serializer(output_format, output_format_overrides):
+    return CardSerializer(output_format, dict(output_format_overrides))
+
+
+def get_card_serializer(output_format="", output_format_overrides={}):
+    return get_cached_card_serializer(output_format, tuple(sorted(output_format_overrides.items())))
+
+
+def create_card_object(card, output_format="", output_format_overrides={}):
+    return get_card_serializer(output_format, output_format_overrides).create_card_object(card)
+
 
-    if 'answer' in card_obj:
-        card.answer = card_obj['answer']
+def update_card_query_html(card):
+    """
+    Renders the query snippet of the card after its query has been
+    changed. The snippet is only rendered again if the truncated query
+    (or the renderer version) changed since it was last rendered. If
+    the markdown renderer is not installed the snippet is left empty.
+    """
+    text = truncate_text(card.query, QUERY_SNIPPET_LENGTH)
+    text_sha_512 = content_hash.get_sha_512(str(card_markdown.RENDERER_VERSION), text)
 
-    if 'creation_date' in card_obj:
-        card.creation_date = card_obj['creation_date']
+    if text_sha_512 == card.query_html_sha_512:
+        return
 
-    if 'last_modified_date' in card_obj:
-        card.last_modified_date = card_obj['last_modified_date']
+    query_html = card_markdown.render(text)
+
+    if query_html is None:
+        card.query_html = ""
+        card.query_html_sha_512 = ""
     else:
+        card.query_html = query_html
+        card.query_html_sha_512 = text_sha_512
+
+
+def render_query_snippets(cards, chunk_size=CARD_CHUNK_SIZE):
+    """
+    Renders the query snippets of the cards which are out of date (ie.
+    rendered with an older renderer version or not rendered at all
+    because the markdown renderer was not installed). The cards are
+    processed in chunks of chunk_size with one bulk update per chunk
+    and the updated cards are recorded as card changes so the cached
+    card lists of their users are not used anymore.
+
+    Returns a tuple containing the number of cards which were
+    checked and a list with the uuids of the updated cards.
+    """
+    num_cards_checked = 0
+    updated_uuids = []
+    last_card_id = 0
+
+    while True:
+        chunk = list(cards.filter(id__gt=last_card_id)
+                          .order_by('id')
+                          .only('id', 'uuid', 'user_id', 'query', 'query_html', 'query_html_sha_512')[:chunk_size])
+        if len(chunk) == 0:
+            break
+
+        last_card_id = chunk[-1].id
+
+        cards_to_update = []
+        for card in chunk:
+            stored_values = (card.query_html, card.query_html_sha_512)
+            update_card_query_html(card)
+
+            if stored_values != (card.query_html, card.query_html_sha_512):
+                cards_to_update.append(card)
+
+        if len(cards_to_update) > 0:
+            uuids_by_user = collections.defaultdict(list)
+            for card in cards_to_update:
+                uuids_by_user[card.user_id].append(card.uuid)
+
+            with transaction.atomic():
+                Card.objects.bulk_update(cards_to_update, ['query_html', 'query_html_sha_512'])
+
+                for user_id, uuids in uuids_by_user.items():
+                    record_card_changes(user_id, uuids)
+
+            updated_uuids.extend([card.uuid for card in cards_to_update])
+
+        num_cards_checked += len(chunk)
+
+    return (num_cards_checked, updated_uuids)
+
+
+def set_field_values(obj, values, field_names):
+    """
+    Sets the fields of the model instance to the values (a dict) of the
+    field names which are in values. The values are converted with the
+    model fields so invalid values (ie. dates which can not be parsed)
+    raise a ValidationError here instead of when the object is saved.
+    """
+    for name in field_names:
+        if name in values:
+            setattr(obj, name, obj._meta.get_field(name).to_python(values[name]))
+
+
+def get_object_list(obj, name):
+    """
+    Returns the list of objects obj[name] (an empty list if obj does
+    not contain name). Raises a ValidationError if the value is not
+    a list or if one of its items is not an object.
+    """
+    values = obj.get(name, [])
+
+    if not isinstance(values, list) or not all(isinstance(value, dict) for value in values):
+        raise ValidationError("'{}' must be a list of objects".format(name))
+
+    return values
+
+
+def validate_card_object_lists(card_obj):
+    """
+    Raises a ValidationError if the tags, files or retrieval attempts
+    of card_obj are not lists of objects.
+    """
+    for name in ['tags', 'files', 'retrieval_attempts']:
+        get_object_list(card_obj, name)
+
+
+def create_card_from_object(card_obj):
+    """
+    Raises a ValidationError if one of the values of card_obj is invalid
+    (including values which the database would reject, ie. null values).
+    """
+    card = Card()
+
+    set_field_values(card, card_obj, ['uuid', 'title', 'query', 'answer', 'creation_date',
+                                      'last_modified_date', 'next_retrieval_date',
+                                      'spacing_bin', 'active'])
+
+    if 'last_modified_date' not in card_obj:
         card.last_modified_date = timezone.now()
 
-    if 'next_retrieval_date' in card_obj:
-        card.next_retrieval_date = card_obj['next_retrieval_date']
-    else:
+    if 'next_retrieval_date' not in card_obj:
         card.next_retrieval_date = timezone.now() + timedelta(days=1)
 
-    if 'spacing_bin' in card_obj:
-        card.spacing_bin = card_obj['spacing_bin']
-
-    if 'active' in card_obj:
-        card.active = card_obj['active']
+    # The text fields may be empty although they are not blank=True.
+    # The user and the hashes are set by the caller.
+    exclude = ['user', 'sha_512', 'text_sha_512', 'files_sha_512', 'query_html', 'query_html_sha_512']
+    exclude.extend([name for name in ['title', 'query', 'answer'] if getattr(card, name) == ""])
+    card.clean_fields(exclude=exclude)
 
     return card
 
 
+def get_validation_error_message(err):
+    return 'Invalid card. ' + ' '.join(err.messages)
+
+
 def import_card(card_obj, user):
     result = (400, 'Could not import card')
 
     try:
+        validate_card_object_lists(card_obj)
         card = create_card_from_object(card_obj)
-        card.sha_512 = compute_card_sha_512(card)
+        content_hash.update_card_hashes(card, [])
+        update_card_query_html(card)
         card.user = user
         card.save()
 
+    except ValidationError as err:
+        result = (400, get_validation_error_message(err))
+
     except IntegrityError as err:
         error_string = str(err).lower()
 
@@ -329,7 +844,8 @@ def import_card(card_obj, user):
 
             if (('files' in card_obj) and (len(card_obj['files']) > 0)):
                 if import_file_attachments_from_list(card, card_obj['files']):
-                    card.sha_512 = compute_card_sha_512(card)
+                    # The file hashes were added to the card hash as
+                    # the file attachments were imported
                     card.save()
 
                 else:
@@ -347,22 +863,132 @@ def import_card(card_obj, user):
 
             delete_card(card)
 
+        except ValidationError as err:
+            delete_card(card)
+            result = (400, get_validation_error_message(err))
+
         else:
+            record_card_change(card)
             result = (201, card)
 
     return result
 
 
+def prefetch_card_relations(cards, options):
+    lookups = []
+
+    if options['include_tags']:
+        lookups.append('tags')
+
+    if options['include_file_attachments']:
+        lookups.append('fileattachment_set')
+
+    if options['include_retrieval_attempts']:
+        lookups.append('retrievalattempt_set')
+
+    if len(lookups) > 0:
+        prefetch_related_objects(cards, *lookups)
+
+
+# The ETags are derived from the stored card values that the card
+# objects are created from (including the content hash) so they can
+# be checked without serializing the cards. The output format is part
+# of the request url so it does not have to be part of the ETags.
+# The query_html_sha_512 field identifies the rendered query snippet
+# (which is not part of sha_512) without loading the snippet
+CARD_ETAG_FIELDS = ['id', 'uuid', 'sha_512', 'query_html_sha_512', 'creation_date',
+                    'last_modified_date', 'next_retrieval_date', 'spacing_bin', 'active']
+
+
+def create_etag(*values):
+    data = json.dumps(values, cls=DjangoJSONEncoder).encode('utf-8')
+    return quote_etag(hashlib.sha256(data).hexdigest())
+
+
+def get_card_etag(card):
+    card_values = [getattr(card, field) for field in CARD_ETAG_FIELDS]
+    tag_ids = sorted(card.tags.values_list('id', flat=True))
+
+    return create_etag(card_values, tag_ids)
+
+
+def get_card_list_etag(cards):
+    """
+    Returns the ETag of the card list created from cards (a queryset,
+    Page or CursorPage). Only the values used to compute the ETag are
+    retrieved from the database (along with the card/tag pairs) so the
+    full cards do not have to be loaded.
+    """
+    object_list = cards.object_list if isinstance(cards, (Page, CursorPage)) else cards
+
+    if isinstance(object_list, QuerySet):
+        card_values = [list(values) for values in object_list.values_list(*CARD_ETAG_FIELDS)]
+    else:
+        card_values = [[getattr(card, field) for field in CARD_ETAG_FIELDS] for card in object_list]
+
+    card_ids = [values[0] for values in card_values]
+    card_tags = Card.tags.through.objects.filter(card_id__in=card_ids) \
+                                         .order_by('card_id', 'tag_id') \
+                                         .values_list('card_id', 'tag_id')
+
+    page_values = None
+    if isinstance(cards, Page):
+        page_values = [cards.number, cards.paginator.count]
+    elif isinstance(cards, CursorPage):
+        page_values = [cards.next_cursor, cards.total_count]
+
+    return create_etag(page_values, card_values, list(card_tags))
+
+
+def etag_matches(etag, header_value):
+    etags = parse_etags(header_value)
+    return ('*' in etags) or (etag in etags)
+
+
+def is_not_modified(request, etag):
+    """
+    Returns True if the If-None-Match header of the request
+    matches etag (ie. the client already has the resource).
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    return (if_none_match is not None) and etag_matches(etag, if_none_match)
+
+
+def is_precondition_failed(request, etag):
+    """
+    Returns True if the request has an If-Match header which
+    does not match etag (ie. the resource has been modified).
+    """
+    if_match = request.META.get('HTTP_IF_MATCH')
+    return (if_match is not None) and not etag_matches(etag, if_match)
+
+
+def set_etag(response, etag):
+    response['ETag'] = etag
+
+    # The responses depend on the logged in user and must always
+    # be revalidated (which is cheap when the ETag still matches).
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 def create_card_list(cards,
                      card_output_format="",
                      card_output_format_overrides={},
                      filter_params={}):
 
-    card_list = {'version': 1, 'cards': []}
+    serializer = get_card_serializer(card_output_format, card_output_format_overrides)
 
-    for card in cards:
-        card_obj = create_card_object(card, card_output_format, card_output_format_overrides)
-        card_list['cards'].append(card_obj)
+    # Evaluate the cards once and load the related objects for
+    # the whole list up front so that serializing each card does
+    # not issue its own tag, file and retrieval attempt queries.
+    card_instances = list(cards)
+    prefetch_card_relations(card_instances, serializer.options)
+
+    card_list = {
+        'version': 1,
+        'cards': [serializer.create_card_object(card) for card in card_instances]
+    }
 
     page_info = {'links': [
         {'rel': 'next', 'href': None},
@@ -405,6 +1031,26 @@ def create_card_list(cards,
             href = '/cards/' + query
             page_info['links'][2] = {'rel': 'next-index-page', 'href': href}
 
+    elif isinstance(cards, CursorPage):
+        page_info.update({
+            'num_cards':       len(cards),
+            'has_previous':    False,
+            'has_next':        cards.has_next()
+        })
+
+        if cards.total_count is not None:
+            page_info['total_num_cards'] = cards.total_count
+
+        if page_info['has_next']:
+            page_info['next_cursor'] = cards.next_cursor
+
+            query = get_card_query_from_filter_params(filter_params, cursor=cards.next_cursor)
+            href = '/cards/api/v1/cards/' + query
+            page_info['links'][0] = {'rel': 'next', 'href': href}
+
+            href = '/cards/' + query
+            page_info['links'][2] = {'rel': 'next-index-page', 'href': href}
+
     else:
         page_info.update({
             'num_cards':       len(cards),
@@ -421,62 +1067,445 @@ def create_card_list(cards,
     return card_list
 
 
-def create_card_archive(cards):
-    tmp_file = tempfile.NamedTemporaryFile(suffix=".notecards")
-    tf = tarfile.open(fileobj=tmp_file, mode='w:gz')
+class CardArchiveMemberReader:
+    """
+    File like object which produces the json data of a single card
+    archive member on demand. The base64 encoded data of the file
+    attachments is read from disk in chunks while the member is being
+    written so the attachments are never held in memory all at once.
+    """
 
-    for card in cards:
-        card_obj = create_card_object(card, 'archive')
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        while (size < 0) or (len(self.buffer) < size):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+
+            self.buffer.extend(chunk)
+
+        if size < 0:
+            size = len(self.buffer)
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class ArchiveOutputBuffer:
+    """
+    Write only file like object used as the target of a streaming
+    tarfile. The data written so far can be removed with pop() and
+    sent to the client before the next archive member is written.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
 
-        data = json.dumps(card_obj, cls=DjangoJSONEncoder)
-        data = data.encode('utf-8')
-        byte_stream = io.BytesIO(data)
 
-        tarinfo = tarfile.TarInfo(name=card_obj['uuid'])
-        tarinfo.size = len(data)
+def get_base64_encoded_size(num_bytes):
+    return 4 * ((num_bytes + 2) // 3)
 
-        tf.addfile(tarinfo=tarinfo, fileobj=byte_stream)
+
+def generate_base64_file_chunks(file_path):
+    with open(file_path, "rb") as f:
+        while True:
+            # Must be a multiple of 3 so that the encoded
+            # chunks can be concatenated without padding
+            data = f.read(3 * 65536)
+            if not data:
+                break
+
+            yield base64.b64encode(data)
+
+
+def create_card_archive_member(card, placeholder):
+    card_obj = create_card_object(card, 'archive', {'include_file_attachments': False})
+
+    # The file data is written directly from disk when the member is
+    # read so a placeholder is stored in the json data in its place.
+    card_obj['files'] = []
+    file_paths = []
+
+    for file_attachment in card.fileattachment_set.all():
+        fa_obj = create_file_attachment_obj(file_attachment, 'archive', {'include_data': False})
+        fa_obj['data'] = placeholder
+
+        card_obj['files'].append(fa_obj)
+        file_paths.append(settings.MEDIA_ROOT + "/" + str(file_attachment.file))
+
+    data = json.dumps(card_obj, cls=DjangoJSONEncoder)
+    json_parts = [part.encode('utf-8') for part in data.split(placeholder)]
+
+    size = sum([len(part) for part in json_parts])
+    for file_path in file_paths:
+        size += get_base64_encoded_size(pathlib.Path(file_path).stat().st_size)
+
+    def generate_chunks():
+        for index, part in enumerate(json_parts):
+            yield part
+
+            if index < len(file_paths):
+                yield from generate_base64_file_chunks(file_paths[index])
+
+    tarinfo = tarfile.TarInfo(name=card_obj['uuid'])
+    tarinfo.size = size
+
+    return (tarinfo, CardArchiveMemberReader(generate_chunks()))
+
+
+def generate_card_archive(cards):
+    """
+    Generator which yields the gzipped tar data for a card archive as
+    each card is serialized. This allows the archive to be streamed to
+    the client without first writing the whole archive to a temporary
+    file. At most one card (and its file attachments) is held in
+    memory at any given time.
+    """
+    output_buffer = ArchiveOutputBuffer()
+    tf = tarfile.open(fileobj=output_buffer, mode='w|gz')
+
+    # Random placeholder so it can not collide with any card content
+    placeholder = secrets.token_hex(16)
+    options = get_card_output_options('archive')
+
+    for card_chunk in iterate_card_chunks(cards):
+        prefetch_card_relations(card_chunk, options)
+
+        for card in card_chunk:
+            tarinfo, fileobj = create_card_archive_member(card, placeholder)
+            tf.addfile(tarinfo=tarinfo, fileobj=fileobj)
+
+            data = output_buffer.pop()
+            if len(data) > 0:
+                yield data
 
     tf.close()
+    yield output_buffer.pop()
+
 
-    # Return the temporary file which contains the gzipped
-    # tar data. The caller is responsible for closing the
-    # file. Note, the file will be automatically deleted
-    # when the file is closed.
-    tmp_file.seek(0)
-    return tmp_file
+def import_cards(card_objects, user):
+    """
+    Bulk version of import_card. The cards, retrieval attempts, file
+    attachments, tags and card tag associations for all of the card
+    objects are inserted with one bulk insert per table. Existing
+    uuids and tags are resolved with a single query each.
 
+    Returns a list containing a (status, card or message) tuple for
+    each card object (in the same order as card_objects). The caller
+    is responsible for running this inside of a transaction.
+    """
+    results = [None] * len(card_objects)
 
-def import_card_archive(archive_file, user):
-    num_cards_imported = 0
+    uuids = [str(card_obj['uuid']) for card_obj in card_objects
+             if isinstance(card_obj, dict) and 'uuid' in card_obj]
+    existing_uuids = set(Card.objects.filter(user=user, uuid__in=uuids)
+                                     .values_list('uuid', flat=True))
 
+    new_cards = []
+
+    for index, card_obj in enumerate(card_objects):
+        if not isinstance(card_obj, dict):
+            results[index] = (400, 'Invalid card format. Card must be an object')
+            continue
+
+        try:
+            validate_card_object_lists(card_obj)
+            card = create_card_from_object(card_obj)
+            retrieval_attempts = [create_retrieval_attempt_from_object(card, ra_obj)
+                                  for ra_obj in card_obj.get('retrieval_attempts', [])]
+
+        except ValidationError as err:
+            results[index] = (400, get_validation_error_message(err))
+            continue
+
+        card.user = user
+
+        if card.uuid in existing_uuids:
+            results[index] = (409, 'Card with uuid already exists.')
+            continue
+
+        file_attachments = create_file_attachments_from_list(card, card_obj.get('files', []))
+        if file_attachments is None:
+            results[index] = (400, 'One or more file attachments could not be imported.')
+            continue
+
+        file_hashes = [file_attachment.sha_512 for file_attachment in file_attachments]
+        content_hash.update_card_hashes(card, file_hashes)
+        update_card_query_html(card)
+
+        # Also catches duplicate uuids within card_objects
+        existing_uuids.add(card.uuid)
+        new_cards.append((index, card, card_obj, retrieval_attempts, file_attachments))
+
+    if len(new_cards) == 0:
+        return results
+
+    try:
+        insert_new_cards(new_cards, results, user)
+
+    except:
+        # The file data has already been written to storage
+        for _, _, _, _, file_attachments in new_cards:
+            for file_attachment in file_attachments:
+                file_attachment.file.delete(save=False)
+
+        raise
+
+    return results
+
+
+def insert_new_cards(new_cards, results, user):
+    Card.objects.bulk_create([card for _, card, _, _, _ in new_cards])
+    record_card_changes(user.pk, [card.uuid for _, card, _, _, _ in new_cards])
+
+    # Not all of the database backends (ie. sqlite) set the
+    # primary keys of the objects created with bulk_create.
+    card_ids = dict(Card.objects.filter(user=user, uuid__in=[card.uuid for _, card, _, _, _ in new_cards])
+                                .values_list('uuid', 'id'))
+
+    all_retrieval_attempts = []
+    all_file_attachments = []
+    card_tag_labels = []
+
+    for index, card, card_obj, retrieval_attempts, file_attachments in new_cards:
+        card.pk = card_ids[card.uuid]
+
+        for retrieval_attempt in retrieval_attempts:
+            # Reassign now that the card has a primary key
+            retrieval_attempt.card = card
+            all_retrieval_attempts.append(retrieval_attempt)
+
+        for file_attachment in file_attachments:
+            # Reassign now that the card has a primary key
+            file_attachment.card = card
+            all_file_attachments.append(file_attachment)
+
+        labels = set()
+        for tag_obj in card_obj.get('tags', []):
+            tag = create_tag_from_object(tag_obj)
+
+            if tag:
+                labels.add(tag.label)
+
+        card_tag_labels.append((card, labels))
+        results[index] = (201, card)
+
+    RetrievalAttempt.objects.bulk_create(all_retrieval_attempts)
+    FileAttachment.objects.bulk_create(all_file_attachments)
+
+    all_labels = set()
+    for _, labels in card_tag_labels:
+        all_labels.update(labels)
+
+    tags = get_or_create_tags(all_labels, user)
+
+    CardTag = Card.tags.through
+    card_tags = []
+
+    for card, labels in card_tag_labels:
+        for label in sorted(labels):
+            card_tags.append(CardTag(card_id=card.pk, tag_id=tags[label].pk))
+
+    CardTag.objects.bulk_create(card_tags)
+
+
+def import_card_batch(card_objects, user, atomic=False):
+    """
+    Imports the card objects with import_cards in a single transaction
+    and returns the (status, card or message) result of each card.
+
+    By default the cards which could be imported are committed even if
+    some of the other cards could not be imported. If atomic is True
+    and any of the cards can not be imported then none of the cards
+    are imported and the status of the other cards is set to 424.
+    """
+    with transaction.atomic():
+        results = import_cards(card_objects, user)
+
+        if atomic and any([result[0] != 201 for result in results]):
+            card_ids = [result[1].pk for result in results if result[0] == 201]
+            file_attachments = FileAttachment.objects.filter(card_id__in=card_ids).only('file')
+
+            # Rolling back the transaction does not remove
+            # the files which were written to storage
+            for file_attachment in file_attachments:
+                file_attachment.file.delete(save=False)
+
+            transaction.set_rollback(True)
+
+            message = 'Card not imported. Another card in the batch could not be imported.'
+            results = [(424, message) if result[0] == 201 else result for result in results]
+
+    return results
+
+
+def import_card_archive(archive_file, user,
+                        batch_size=ARCHIVE_IMPORT_BATCH_SIZE,
+                        single_transaction=True,
+                        progress_callback=None,
+                        num_workers=None):
+    """
+    Imports all of the cards in a card archive using import_cards
+    on batches of batch_size cards. Returns a summary of the import
+    which lists the cards which could not be imported.
+
+    The archive members (json parsing, base64 decoding and hashing of
+    the file attachments) are decoded by num_workers processes while
+    the cards are written to the database by the calling thread. If
+    num_workers is None the NOTECARDS_ARCHIVE_IMPORT_WORKERS setting
+    is used and a value less than one decodes the members serially.
+
+    By default the whole import is done in a single transaction. When
+    single_transaction is False each batch is committed separately so
+    that the progress of the import is visible to other connections.
+    The optional progress_callback is called with the current summary
+    after each batch.
+    """
+    if num_workers is None:
+        num_workers = getattr(settings, 'NOTECARDS_ARCHIVE_IMPORT_WORKERS', 0)
+
+    summary = {
+        'num_cards_processed':  0,
+        'num_cards_imported':   0,
+        'num_cards_conflicted': 0,
+        'errors': []
+    }
+
+    def import_batch(names, card_objects):
+        with transaction.atomic():
+            results = import_cards(card_objects, user)
+
+        if single_transaction:
+            card_ids = [result[1].pk for result in results if result[0] == 201]
+            file_attachments = FileAttachment.objects.filter(card_id__in=card_ids).only('file')
+            saved_files.extend([file_attachment.file for file_attachment in file_attachments])
+
+        for name, result in zip(names, results):
+            summary['num_cards_processed'] += 1
+
+            if result[0] == 201:
+                summary['num_cards_imported'] += 1
+
+            else:
+                if result[0] == 409:
+                    summary['num_cards_conflicted'] += 1
+
+                summary['errors'].append({'uuid': name, 'status': result[0], 'message': result[1]})
+
+        if progress_callback:
+            progress_callback(summary)
+
+    def read_members(tf):
+        for tarinfo in tf:
+            if tarinfo.isfile():
+                yield (tarinfo.name, tf.extractfile(tarinfo).read())
+
+    def decode_members(tf):
+        if num_workers < 1:
+            for name, data in read_members(tf):
+                yield (name, decode_card_archive_member(data))
+
+            return
+
+        # The members are decoded by the worker processes but are
+        # yielded in archive order. The number of members waiting
+        # to be imported is bounded to limit the memory usage.
+        mp_context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context) as executor:
+            pending = collections.deque()
+
+            for name, data in read_members(tf):
+                pending.append((name, executor.submit(decode_card_archive_member, data)))
+
+                if len(pending) >= num_workers * ARCHIVE_IMPORT_QUEUE_SIZE_PER_WORKER:
+                    name, future = pending.popleft()
+                    yield (name, future.result())
+
+            while len(pending) > 0:
+                name, future = pending.popleft()
+                yield (name, future.result())
+
+    def import_members(tf):
+        names = []
+        card_objects = []
+
+        for name, card_obj in decode_members(tf):
+            names.append(name)
+            card_objects.append(card_obj)
+
+            if len(card_objects) >= batch_size:
+                import_batch(names, card_objects)
+                names = []
+                card_objects = []
+
+        if len(card_objects) > 0:
+            import_batch(names, card_objects)
+
+    saved_files = []
     tf = tarfile.open(fileobj=archive_file, mode='r:gz')
-    for tarinfo in tf:
-        buffered_reader = tf.extractfile(tarinfo)
-        card_obj = json.load(buffered_reader)
 
-        result = import_card(card_obj, user)
+    if single_transaction:
+        try:
+            with transaction.atomic():
+                import_members(tf)
+
+        except:
+            # The database changes were rolled back but the
+            # files which were written to disk need removing.
+            for saved_file in saved_files:
+                saved_file.delete(save=False)
+
+            raise
+
+    else:
+        import_members(tf)
 
-        if result[0] == 201:
-            num_cards_imported += 1
+    return summary
 
-    return num_cards_imported
+
+def create_card_archive_import_task_obj(task):
+    task_url = '/cards/api/v1/card-archive-import-tasks/' + str(task.pk) + '/'
+
+    obj = {
+        'id': task.pk,
+        'status': task.status,
+        'num_cards_processed': task.num_cards_processed,
+        'num_cards_imported': task.num_cards_imported,
+        'num_cards_conflicted': task.num_cards_conflicted,
+        'errors': json.loads(task.errors),
+        'message': task.message,
+        'creation_date': task.creation_date,
+        'start_date': task.start_date,
+        'completion_date': task.completion_date,
+        'links': [ { 'rel': 'self', 'href': task_url } ]
+    }
+
+    return obj
 
 
 def compute_card_sha_512(card):
-    sha_512 = hashlib.sha512()
+    file_hashes = content_hash.get_card_file_hashes(card)
+    return compute_card_sha_512_from_file_hashes(card, file_hashes)
 
-    sha_512.update(card.title.encode())
-    sha_512.update(card.query.encode())
-    sha_512.update(card.answer.encode())
 
-    file_attachments = FileAttachment.objects.filter(card=card)
-    for file_attachment in file_attachments:
-        sha_512.update(file_attachment.sha_512.encode())
+def compute_card_sha_512_from_file_hashes(card, file_hashes):
+    text_sha_512 = content_hash.get_text_sha_512(card.title, card.query, card.answer)
+    files_sha_512 = content_hash.get_files_sha_512(file_hashes)
 
-    digest = sha_512.digest()
-    b64_digest = base64.b64encode(digest)
-    return b64_digest.decode()
+    return content_hash.combine_card_sha_512(text_sha_512, files_sha_512)
 
 
 def delete_card(card):
@@ -484,9 +1513,84 @@ def delete_card(card):
     for file_attachment in file_attachments:
         file_attachment.file.delete(save=False)
 
+    record_card_change(card, deleted=True)
     card.delete()
 
 
+def record_card_changes(user_id, card_uuids, deleted=False):
+    """
+    Records a change to each of the cards in card_uuids. The previous
+    change of each card is replaced so there is at most one change
+    (the most recent one) per card. The changes are numbered with the
+    next sequence numbers of the user. The sequence row of the user
+    stays locked until the surrounding transaction commits so other
+    changes of the user wait for it (see CardChangeSequence).
+    """
+    card_uuids = list(dict.fromkeys(card_uuids))
+
+    if len(card_uuids) == 0:
+        return
+
+    with transaction.atomic():
+        change_sequence, _ = CardChangeSequence.objects.select_for_update().get_or_create(user_id=user_id)
+
+        for index in range(0, len(card_uuids), CARD_CHUNK_SIZE):
+            uuid_chunk = card_uuids[index:index + CARD_CHUNK_SIZE]
+            first_sequence = change_sequence.last_sequence + 1
+
+            CardChange.objects.filter(user_id=user_id, card_uuid__in=uuid_chunk).delete()
+            CardChange.objects.bulk_create([CardChange(user_id=user_id, card_uuid=uuid,
+                                                       sequence=first_sequence + offset, deleted=deleted)
+                                            for offset, uuid in enumerate(uuid_chunk)])
+
+            change_sequence.last_sequence += len(uuid_chunk)
+
+        change_sequence.save(update_fields=['last_sequence'])
+
+
+def record_card_change(card, deleted=False):
+    record_card_changes(card.user_id, [card.uuid], deleted)
+
+
+def get_card_changes(user, since, limit, output_format=""):
+    """
+    Returns a list with at most limit changes to the cards of the user
+    (ordered by change sequence number) which were made after the change
+    with the sequence number since. Changed cards include the current
+    card object and deleted cards are returned as tombstones. Also returns
+    True if there are more changes after the last change in the list.
+    """
+    card_changes = list(CardChange.objects.filter(user=user, sequence__gt=since).order_by('sequence')[:limit + 1])
+
+    has_more = len(card_changes) > limit
+    card_changes = card_changes[:limit]
+
+    changed_uuids = [card_change.card_uuid for card_change in card_changes if not card_change.deleted]
+    cards = {}
+
+    serializer = get_card_serializer(output_format)
+    for index in range(0, len(changed_uuids), CARD_CHUNK_SIZE):
+        card_chunk = list(Card.objects.filter(user=user, uuid__in=changed_uuids[index:index + CARD_CHUNK_SIZE]))
+        prefetch_card_relations(card_chunk, serializer.options)
+        cards.update({card.uuid: card for card in card_chunk})
+
+    changes = []
+    for card_change in card_changes:
+        change_obj = {
+            'sequence': card_change.sequence,
+            'uuid': card_change.card_uuid,
+            'change_date': card_change.change_date,
+            'deleted': card_change.deleted or (card_change.card_uuid not in cards)
+        }
+
+        if not change_obj['deleted']:
+            change_obj['card'] = serializer.create_card_object(cards[card_change.card_uuid])
+
+        changes.append(change_obj)
+
+    return (changes, has_more)
+
+
 def is_image_media_type(media_type):
     return ((media_type == "image/png") or
             (media_type == "image/jpeg") or
@@ -502,15 +1606,6 @@ def sanitize_image(image_path):
                      str(image_path)]);
 
 
-def get_bytes_sha_512(data):
-    sha_512 = hashlib.sha512()
-    sha_512.update(data)
-
-    digest = sha_512.digest()
-    b64_digest = base64.b64encode(digest)
-    return b64_digest.decode()
-
-
 def get_file_sha_512(file_path):
     sha_512 = hashlib.sha512()
 
@@ -527,7 +1622,7 @@ def get_file_sha_512(file_path):
     return b64_digest.decode()
 
 
-def create_file_attachment_obj(file_attachment, output_format=""):
+def create_file_attachment_obj(file_attachment, output_format="", output_format_overrides={}, card=None):
     options = {
         'include_url':   True,
         'include_data':  False,
@@ -553,6 +1648,8 @@ def create_file_attachment_obj(file_attachment, output_format=""):
             'include_links': False
         })
 
+    options.update(output_format_overrides)
+
     file_attachment_obj = {
         'name': pathlib.Path(file_attachment.file.name).name,
         'media_type': file_attachment.media_type
@@ -578,9 +1675,10 @@ def create_file_attachment_obj(file_attachment, output_format=""):
         file_attachment_obj['sha_512'] = file_attachment.sha_512
 
     if options['include_links']:
+        card_href = '/cards/api/v1/cards/' + str((card or file_attachment.card).uuid)
         file_attachment_obj['links'] = [
-            { 'rel': 'self', 'href': '/cards/api/v1/cards/' + str(file_attachment.card.uuid) + '/files/' + str(file_attachment.pk)},
-            { 'rel': 'card', 'href': '/cards/api/v1/cards/' + str(file_attachment.card.uuid)}
+            { 'rel': 'self', 'href': card_href + '/files/' + str(file_attachment.pk)},
+            { 'rel': 'card', 'href': card_href}
         ]
 
     return file_attachment_obj
@@ -588,18 +1686,25 @@ def create_file_attachment_obj(file_attachment, output_format=""):
 
 def create_file_attachment_from_object(card, fa_obj):
     file_attachment = None
+    file_bytes = None
+
+    if isinstance(fa_obj.get('decoded_data'), bytes):
+        # Already decoded by decode_card_archive_member
+        file_bytes = fa_obj['decoded_data']
+        sha_512 = fa_obj['decoded_sha_512']
+
+    elif ('data' in fa_obj) and (len(fa_obj['data']) > 0):
+        file_bytes = base64.b64decode(fa_obj['data'])
+        sha_512 = get_bytes_sha_512(file_bytes)
 
     if (('name' in fa_obj) and
-        ('data' in fa_obj) and
         ('media_type' in fa_obj) and
-        (len(fa_obj['data']) > 0)):
+        file_bytes):
 
         file_attachment = FileAttachment()
         file_attachment.card = card
         file_attachment.media_type = fa_obj['media_type']
-
-        file_bytes = base64.b64decode(fa_obj['data'])
-        file_attachment.sha_512 = get_bytes_sha_512(file_bytes)
+        file_attachment.sha_512 = sha_512
 
         f = File(io.BytesIO(file_bytes))
         file_attachment.file.save(fa_obj['name'], f, save=False)
@@ -611,15 +1716,39 @@ def create_card_file_attachment_list(card=None, output_format=""):
     file_attachment_list = {'files': []}
 
     if card:
-        file_attachments = FileAttachment.objects.filter(card=card)
-
-        for file_attachment in file_attachments:
-            file_attachment_obj = create_file_attachment_obj(file_attachment, output_format)
+        # Uses the prefetched file attachments if they are available
+        for file_attachment in card.fileattachment_set.all():
+            file_attachment_obj = create_file_attachment_obj(file_attachment, output_format, card=card)
             file_attachment_list['files'].append(file_attachment_obj)
 
     return file_attachment_list
 
 
+def create_file_attachments_from_list(card, fa_list):
+    """
+    Creates (but does not save) the file attachments for the card.
+    The file data is written to storage. Returns None and removes
+    any written files if one of the file attachments is invalid.
+    """
+    file_attachments = []
+
+    for fa_obj in fa_list:
+        try:
+            file_attachment = create_file_attachment_from_object(card, fa_obj)
+        except (TypeError, ValueError):
+            file_attachment = None
+
+        if not file_attachment:
+            for saved_file_attachment in file_attachments:
+                saved_file_attachment.file.delete(save=False)
+
+            return None
+
+        file_attachments.append(file_attachment)
+
+    return file_attachments
+
+
 def import_file_attachments_from_list(card, fa_list):
     num_saved_files = 0
 
@@ -628,12 +1757,13 @@ def import_file_attachments_from_list(card, fa_list):
 
         if file_attachment:
             file_attachment.save()
+            content_hash.add_card_file_hash(card, file_attachment.sha_512)
             num_saved_files += 1
 
     return (num_saved_files == len(fa_list))
 
 
-def create_retrieval_attempt_obj(retrieval_attempt, output_format=""):
+def create_retrieval_attempt_obj(retrieval_attempt, output_format="", card=None):
     options = {'include_links': True}
 
     if output_format == "archive":
@@ -646,26 +1776,24 @@ def create_retrieval_attempt_obj(retrieval_attempt, output_format=""):
     }
 
     if options['include_links']:
+        card_href = '/cards/api/v1/cards/' + str((card or retrieval_attempt.card).uuid)
         obj['links'] = [
-            { 'rel': 'self', 'href': '/cards/api/v1/cards/' + str(retrieval_attempt.card.uuid) + '/retrieval-attempts/' + str(retrieval_attempt.pk)},
-            { 'rel': 'card', 'href': '/cards/api/v1/cards/' + str(retrieval_attempt.card.uuid)},
+            { 'rel': 'self', 'href': card_href + '/retrieval-attempts/' + str(retrieval_attempt.pk)},
+            { 'rel': 'card', 'href': card_href},
         ]
 
     return obj
 
 
 def create_retrieval_attempt_from_object(card, ra_obj):
+    """
+    Raises a ValidationError if one of the values of ra_obj is invalid.
+    """
     retrieval_attempt = RetrievalAttempt()
     retrieval_attempt.card = card
 
-    if 'retrieval_date' in ra_obj:
-        retrieval_attempt.retrieval_date = ra_obj['retrieval_date']
-
-    if 'retrieved' in ra_obj:
-        retrieval_attempt.retrieved = ra_obj['retrieved']
-
-    if 'spacing_bin' in ra_obj:
-        retrieval_attempt.spacing_bin = ra_obj['spacing_bin']
+    set_field_values(retrieval_attempt, ra_obj, ['retrieval_date', 'retrieved', 'spacing_bin'])
+    retrieval_attempt.clean_fields(exclude=['card'])
 
     return retrieval_attempt
 
@@ -674,10 +1802,9 @@ def create_card_retrieval_attempt_list(card=None, retrieval_attempt_output_forma
     ra_list = {'retrieval_attempts': []}
 
     if card:
-        retrieval_attempts = RetrievalAttempt.objects.filter(card=card)
-
-        for retrieval_attempt in retrieval_attempts:
-            retrieval_attempt_obj = create_retrieval_attempt_obj(retrieval_attempt, retrieval_attempt_output_format)
+        # Uses the prefetched retrieval attempts if they are available
+        for retrieval_attempt in card.retrievalattempt_set.all():
+            retrieval_attempt_obj = create_retrieval_attempt_obj(retrieval_attempt, retrieval_attempt_output_format, card)
             ra_list['retrieval_attempts'].append(retrieval_attempt_obj)
 
     return ra_list
@@ -689,6 +1816,133 @@ def import_retrieval_attempts_from_list(card, ra_list):
         retrieval_attempt.save()
 
 
+def apply_retrieval_attempt(card, retrieved, retrieval_date=None):
+    """
+    Schedules the next retrieval of the card (relative to retrieval_date)
+    with the scheduler of its user. Returns the new (unsaved) retrieval
+    attempt. The card is not saved. Load the card with
+    select_related('user__schedulersetting') to avoid loading the user
+    and the scheduler setting separately.
+    """
+    if retrieval_date is None:
+        retrieval_date = timezone.now()
+
+    card_scheduler = scheduler.get_user_scheduler(card.user)
+    state = scheduler.get_card_states(card_scheduler, [card])[card.pk]
+
+    return scheduler.review_card(card_scheduler, card, state, retrieved, retrieval_date)[0]
+
+
+def parse_retrieval_result(result_obj):
+    """
+    Returns a (uuid, retrieved, retrieval_date) tuple for a review
+    result object or raises a ValueError if the object is invalid.
+    """
+    if not isinstance(result_obj, dict):
+        raise ValueError("Invalid result format. Result must be an object")
+
+    if not isinstance(result_obj.get('uuid'), str):
+        raise ValueError("Missing card uuid")
+
+    if not isinstance(result_obj.get('success'), bool):
+        raise ValueError("Missing or invalid success value")
+
+    retrieval_date = timezone.now()
+
+    if result_obj.get('retrieval_date') is not None:
+        retrieval_date = dateparse.parse_datetime(str(result_obj['retrieval_date']))
+
+        if retrieval_date is None:
+            raise ValueError("Invalid retrieval date")
+
+        if timezone.is_naive(retrieval_date):
+            retrieval_date = timezone.make_aware(retrieval_date, timezone.utc)
+
+        if retrieval_date > timezone.now():
+            raise ValueError("Retrieval date is in the future")
+
+    return (result_obj['uuid'], result_obj['success'], retrieval_date)
+
+
+def import_retrieval_results(result_objects, user):
+    """
+    Applies the review results ({uuid, success, retrieval_date}) to the
+    cards of the user. The results of each card are applied in order
+    of their retrieval dates. The cards (and their retrieval histories
+    if the scheduler of the user replays them) are loaded with one
+    query each and the retrieval attempts and cards are written with
+    one bulk insert and one bulk update (in a single transaction).
+
+    Returns a list containing a (status, retrieval attempt or message)
+    tuple for each result object (in the same order as result_objects).
+    The tuples of the created retrieval attempts also contain the
+    schedule of the card after the attempt (spacing_bin,
+    next_retrieval_date and active values).
+    """
+    results = [None] * len(result_objects)
+    parsed_results = []
+
+    for index, result_obj in enumerate(result_objects):
+        try:
+            parsed_results.append((index,) + parse_retrieval_result(result_obj))
+        except ValueError as err:
+            results[index] = (400, str(err))
+
+    uuids = set([parsed_result[1] for parsed_result in parsed_results])
+    cards = {card.uuid: card for card in Card.objects.filter(user=user, uuid__in=uuids)}
+
+    card_scheduler = scheduler.get_user_scheduler(user)
+    states = scheduler.get_card_states(card_scheduler, cards.values())
+
+    retrieval_attempts = []
+
+    # Sorting is stable so results with equal dates keep their order
+    for index, uuid, retrieved, retrieval_date in sorted(parsed_results, key=lambda r: r[3]):
+        if uuid not in cards:
+            results[index] = (404, 'Card not found')
+            continue
+
+        card = cards[uuid]
+        retrieval_attempt, states[card.pk] = scheduler.review_card(card_scheduler, card, states[card.pk],
+                                                                   retrieved, retrieval_date)
+        retrieval_attempts.append(retrieval_attempt)
+        results[index] = (201, retrieval_attempt, {
+            'spacing_bin': card.spacing_bin,
+            'next_retrieval_date': card.next_retrieval_date,
+            'active': card.active
+        })
+
+    updated_uuids = set([retrieval_attempt.card.uuid for retrieval_attempt in retrieval_attempts])
+    updated_cards = [card for card in cards.values() if card.uuid in updated_uuids]
+
+    with transaction.atomic():
+        RetrievalAttempt.objects.bulk_create(retrieval_attempts)
+        Card.objects.bulk_update(updated_cards, ['spacing_bin', 'next_retrieval_date', 'active'])
+        record_card_changes(user.pk, [card.uuid for card in updated_cards])
+
+    return results
+
+
+def set_card_scheduler(user, name, parameters={}):
+    """
+    Changes the scheduler of the user and reschedules all of the cards
+    of the user with it. Raises a ValueError if the scheduler name or
+    parameters are invalid. Returns the number of rescheduled cards.
+    """
+    card_scheduler = scheduler.create_scheduler(name, parameters)
+
+    with transaction.atomic():
+        SchedulerSetting.objects.update_or_create(user=user, defaults={
+            'name': name,
+            'parameters': json.dumps(parameters)
+        })
+
+        rescheduled_uuids = scheduler.reschedule_cards(card_scheduler, Card.objects.filter(user=user))
+        record_card_changes(user.pk, rescheduled_uuids)
+
+    return len(rescheduled_uuids)
+
+
 def create_tag_obj(tag, output_format="", card=None):
     options = {'include_links': True}
 
@@ -751,7 +2005,11 @@ def import_tag(tag_obj, user):
     if tag:
         try:
             tag.user = user
-            tag.save()
+
+            # Use a savepoint so a duplicate label does not break
+            # a transaction which the caller may have started.
+            with transaction.atomic():
+                tag.save()
 
         except IntegrityError:
             tag = Tag.from_label(tag.label, user)
@@ -762,6 +2020,25 @@ def import_tag(tag_obj, user):
     return tag
 
 
+def get_or_create_tags(labels, user):
+    """
+    Returns a dict which maps each of the (already normalized)
+    labels to a tag for the user. Missing tags are created
+    with a single bulk insert.
+    """
+    tags = {tag.label: tag for tag in Tag.objects.filter(user=user, label__in=labels)}
+    missing_labels = [label for label in labels if label not in tags]
+
+    if len(missing_labels) > 0:
+        Tag.objects.bulk_create([Tag(user=user, label=label) for label in missing_labels],
+                                ignore_conflicts=True)
+
+        new_tags = Tag.objects.filter(user=user, label__in=missing_labels)
+        tags.update({tag.label: tag for tag in new_tags})
+
+    return tags
+
+
 def import_tags_from_list(tag_list, user):
     tags = []
 
@@ -1,14 +1,30 @@
 # Copyright (c) 2019, Piet Hein Schouten. All rights reserved.
 # Licensed under the terms of the MIT license.
 
+from django.conf import settings
 from django.shortcuts import render
 from django.http import HttpResponse, HttpResponseNotFound, HttpResponseNotAllowed
+from django.utils.safestring import mark_safe
 from django.core.serializers.json import DjangoJSONEncoder
 
 from notecards.models import Card, RetrievalAttempt
 
 import json
 from . import utils
+from . import card_list_cache
+
+
+# The filter params which index.html passes to the cards api when
+# it loads the card list (the others keep their default values).
+INDEX_CARD_LIST_FILTER_PARAMS = ['review_status', 'order_by', 'active', 'tags_filter',
+                                 'title_filter', 'cards_per_page', 'page']
+
+# Same as the escapes of the json_script template filter
+JSON_SCRIPT_ESCAPES = {
+    ord('>'): '\\u003E',
+    ord('<'): '\\u003C',
+    ord('&'): '\\u0026',
+}
 
 
 def index(request):
@@ -21,9 +37,27 @@ def index(request):
         filter_params['cards_per_page'] = 20
 
     context = {'filter_params': filter_params}
+
+    if request.user.is_authenticated and getattr(settings, 'NOTECARDS_EMBED_INDEX_CARD_LIST', True):
+        context['card_list_json'] = get_index_card_list_json(request.user, filter_params)
+
     return render(request, 'notecards/index.html', context)
 
 
+def get_index_card_list_json(user, filter_params):
+    """
+    Returns the first card list of the index page (the same json as the
+    cards api returns for the request index.html would otherwise send)
+    escaped for embedding in a script element.
+    """
+    card_list_filter_params = utils.parse_card_filter(
+        {name: filter_params[name] for name in INDEX_CARD_LIST_FILTER_PARAMS})
+
+    etag, content = card_list_cache.get_encoded_card_list(user, card_list_filter_params, 'index')
+
+    return mark_safe(content.decode('utf-8').translate(JSON_SCRIPT_ESCAPES))
+
+
 def edit_card(request, card_uuid):
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])